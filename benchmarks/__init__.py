@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+Benchmarks for voitools. These aren't installed with the package; run them
+from the root of the source tree with python -m benchmarks.run
+"""
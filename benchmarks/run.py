@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+"""Run voitools benchmarks on synthetic VOI groups; save results as JSON.
+
+Each benchmark case runs in its own process, so its peak memory use can be
+measured. Times are the best of --repeat runs. Peak memory is the child
+process's maximum resident set size (in kB on Linux). Cases that write
+files also record how big they are. The startup cases import each console
+script in a fresh interpreter, and record which heavy modules it loads and
+(with python -X importtime, on 3.7 and up) how long the import took. Run
+this from the root of the source tree, as python -m benchmarks.run
+
+Usage:
+  benchmarks.run [options]
+  benchmarks.run compare <before> <after>
+  benchmarks.run -h | --help
+
+Options:
+  --output=<file>   Write results here [default: benchmark-results.json]
+  --only=<names>    Run only these benchmarks; separate with commas.
+  --shape=<x,y,z>   Grid size of the synthetic VOI groups [default: 79,95,68]
+  --vois=<n>        Number of VOIs in each group [default: 20]
+  --voxels=<n>      Number of voxels in each VOI [default: 20000]
+  --many-vois=<n>   Number of (small) VOIs in the groups for the header and
+                    attribute benchmarks [default: 5000]
+  --repeat=<n>      Run each case this many times [default: 3]
+  -h --help         Show this screen
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+from collections import namedtuple
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+import numpy as np
+
+from voitools import nifti
+from voitools import voi
+from voitools.scripts import voi2nii
+from voitools.vendor import docopt
+from voitools.vendor.ordereddict import OrderedDict
+
+from benchmarks import synthetic
+
+Settings = namedtuple(
+    'Settings', ['shape', 'vois', 'voxels', 'many_vois', 'repeat'])
+
+# Voxels in each VOI of the many-VOI groups
+SMALL_VOI_VOXELS = 10
+# How many times the attribute benchmark reads each VOI's attributes
+ATTRIBUTE_ROUNDS = 100
+
+# The console scripts whose start-up the startup benchmark times, and the
+# modules that make them slow to start
+ENTRY_POINTS = (
+    "voi_info", "voi2nii", "nii2voi", "voi_extract", "voi_overlap",
+    "voi_catalog", "voi_convert")
+HEAVY_MODULES = ("numpy", "nibabel")
+
+# One thing to time: fx(*args), described by params.
+Case = namedtuple('Case', ['params', 'fx', 'args'])
+
+
+def make_group(settings, workdir, data_format, byte_order="BIG_ENDIAN"):
+    """
+    Write a synthetic VOI group into workdir (once per format and byte
+    order) and return its filename.
+    """
+    filename = os.path.join(workdir, "{0}-{1}.voi".format(
+        data_format.replace(" ", "_"), byte_order))
+    if not os.path.exists(filename):
+        synthetic.write_voi_group(
+            filename,
+            shape=settings.shape,
+            voi_count=settings.vois,
+            voxels_per_voi=settings.voxels,
+            data_format=data_format,
+            byte_order=byte_order)
+    return filename
+
+
+def make_many_group(settings, workdir):
+    """
+    Write a group with settings.many_vois small VOIs into workdir (once) and
+    return its filename.
+    """
+    filename = os.path.join(workdir, "many-{0}.voi".format(settings.many_vois))
+    if not os.path.exists(filename):
+        synthetic.write_voi_group(
+            filename,
+            shape=settings.shape,
+            voi_count=settings.many_vois,
+            voxels_per_voi=SMALL_VOI_VOXELS)
+    return filename
+
+
+def bench_read_file(settings, workdir):
+    for data_format in synthetic.DATA_FORMATS:
+        for byte_order in sorted(synthetic.BYTE_ORDERS):
+            filename = make_group(settings, workdir, data_format, byte_order)
+            yield Case(
+                {'data_format': data_format, 'byte_order': byte_order},
+                voi.read_file,
+                (filename,))
+
+
+def run_to_volume(filename):
+    for cur_voi in voi.read_file(filename).vois:
+        cur_voi.to_volume()
+
+
+def run_iter_volumes(filename, dtype, buffers):
+    for cur_voi, vol in voi.read_file(filename).iter_volumes(dtype, buffers):
+        pass
+
+
+def bench_to_volume(settings, workdir):
+    filename = make_group(settings, workdir, "LONG coordinate index")
+    yield Case({}, run_to_volume, (filename,))
+    yield Case(
+        {'dtype': 'uint8', 'buffers': 2}, run_iter_volumes,
+        (filename, "uint8", 2))
+
+
+def run_voi2nii(filename, out_dir, pattern, extra=()):
+    voi2nii.main([str(arg) for arg in extra] + [
+        str("--no-cache"),
+        str("--pattern={0}".format(pattern)),
+        str("--out-dir={0}".format(out_dir)),
+        str(filename)])
+
+
+def bench_voi2nii(settings, workdir):
+    for data_format in synthetic.DATA_FORMATS:
+        filename = make_group(settings, workdir, data_format)
+        for ext in [".nii", ".nii.gz"]:
+            out_dir = tempfile.mkdtemp(dir=workdir)
+            yield Case(
+                {'data_format': data_format, 'output': ext},
+                run_voi2nii,
+                (filename, out_dir, "{voi_number}" + ext))
+
+
+def bench_voi2nii_writers(settings, workdir):
+    filename = make_group(settings, workdir, "LONG coordinate index")
+    for writers in [0, 4]:
+        out_dir = tempfile.mkdtemp(dir=workdir)
+        yield Case(
+            {'writers': writers, 'output': ".nii.gz"},
+            run_voi2nii,
+            (filename, out_dir, "{voi_number}.nii.gz",
+             ["--writers={0}".format(writers)]))
+
+
+def run_gzip(filename, out_filename, compression):
+    """
+    Write every VOI as a .nii.gz: with nibabel's own gzip writer if
+    compression is None, or our block-parallel one. Returns the bytes
+    written.
+    """
+    written = 0
+    for cur_voi in voi.read_file(filename).vois:
+        nii = voi2nii.make_nifti(cur_voi)
+        if compression is None:
+            nii.to_filename(out_filename)
+        else:
+            voi2nii.write_nifti(nii, out_filename, compression=compression)
+        written += os.path.getsize(out_filename)
+    return {'output_bytes': written}
+
+
+def bench_gzip(settings, workdir):
+    filename = make_group(settings, workdir, "LONG coordinate index")
+    out_filename = os.path.join(workdir, "gzip.nii.gz")
+    yield Case({'writer': "nibabel"}, run_gzip, (filename, out_filename, None))
+    for level, threads in [(1, 1), (1, 4), (6, 4)]:
+        yield Case(
+            {'writer': "parallel", 'level': level, 'threads': threads},
+            run_gzip,
+            (filename, out_filename, nifti.Compression(level, threads)))
+
+
+def bench_headers(settings, workdir):
+    filename = make_many_group(settings, workdir)
+    yield Case({'vois': settings.many_vois}, voi.read_headers, (filename,))
+
+
+def run_attributes(filename, rounds):
+    vois = voi.read_headers(filename).vois
+    for i in range(rounds):
+        for cur_voi in vois:
+            cur_voi.shape
+            cur_voi.voxel_dimensions
+            cur_voi.voxel_count
+            cur_voi.voi_group.data_type_string
+
+
+def bench_attributes(settings, workdir):
+    filename = make_many_group(settings, workdir)
+    yield Case(
+        {'vois': settings.many_vois, 'rounds': ATTRIBUTE_ROUNDS},
+        run_attributes,
+        (filename, ATTRIBUTE_ROUNDS))
+
+
+def run_startup(script):
+    """
+    Import a console script in a fresh interpreter. Returns which of
+    HEAVY_MODULES it loaded and, on Python 3.7 and up (with -X importtime),
+    how many microseconds the import took.
+    """
+    module = "voitools.scripts." + script
+    code = (
+        "import sys, {0}; "
+        "print(' '.join(m for m in {1} if m in sys.modules))")
+    command = [sys.executable]
+    if sys.version_info >= (3, 7):
+        command += ["-X", "importtime"]
+    proc = subprocess.Popen(
+        command + ["-c", code.format(module, list(map(str, HEAVY_MODULES)))],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    if proc.returncode:
+        raise RuntimeError(err.decode("utf-8", "replace"))
+    result = {'heavy_modules': out.decode("utf-8").split()}
+    for line in err.decode("utf-8", "replace").splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = [f.strip() for f in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            result['import_us'] = int(fields[1])
+    return result
+
+
+def bench_startup(settings, workdir):
+    for script in ENTRY_POINTS:
+        yield Case({'script': script}, run_startup, (script,))
+
+
+BENCHMARKS = OrderedDict([
+    ('read_file', bench_read_file),
+    ('to_volume', bench_to_volume),
+    ('voi2nii', bench_voi2nii),
+    ('voi2nii_writers', bench_voi2nii_writers),
+    ('gzip', bench_gzip),
+    ('headers', bench_headers),
+    ('attributes', bench_attributes),
+    ('startup', bench_startup),
+])
+
+
+def _measure_child(queue, fx, args, repeat):
+    try:
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        times = []
+        for i in range(repeat):
+            start = time.time()
+            extra = fx(*args)
+            times.append(time.time() - start)
+        result = {
+            'seconds': min(times),
+            'mean_seconds': sum(times) / len(times),
+            'baseline_rss_kb': baseline,
+            'peak_rss_kb': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss,
+        }
+        # Cases may report more, like how much they wrote, as a dict
+        if isinstance(extra, dict):
+            result.update(extra)
+        queue.put(result)
+    except Exception:
+        queue.put({'error': traceback.format_exc()})
+
+
+def measure(case, repeat):
+    """
+    Run case in a child process; return its timing and memory results.
+    """
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(
+        target=_measure_child, args=(queue, case.fx, case.args, repeat))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def run_benchmarks(settings, names=None):
+    names = names or list(BENCHMARKS.keys())
+    workdir = tempfile.mkdtemp(prefix="voitools-bench-")
+    results = []
+    try:
+        for name in names:
+            for case in BENCHMARKS[name](settings, workdir):
+                result = OrderedDict([('benchmark', name)])
+                result['params'] = case.params
+                result.update(measure(case, settings.repeat))
+                print(format_result(result))
+                results.append(result)
+    finally:
+        shutil.rmtree(workdir)
+    return results
+
+
+def result_label(result):
+    return " ".join(
+        [result['benchmark']] +
+        ["{0}={1}".format(k, v) for k, v in sorted(result['params'].items())])
+
+
+def format_result(result):
+    label = result_label(result)
+    if 'error' in result:
+        return "{0}: failed\n{1}".format(label, result['error'])
+    text = "{0}: {1:.4f} s, peak {2} kB".format(
+        label, result['seconds'], result['peak_rss_kb'])
+    if 'output_bytes' in result:
+        text += ", {0} bytes written".format(result['output_bytes'])
+    if 'heavy_modules' in result:
+        text += ", loads {0}".format(
+            ", ".join(result['heavy_modules']) or "nothing heavy")
+    if 'import_us' in result:
+        text += ", import {0} us".format(result['import_us'])
+    return text
+
+
+def result_key(result):
+    return (result['benchmark'], json.dumps(result['params'], sort_keys=True))
+
+
+def compare(before_file, after_file):
+    with open(before_file) as f:
+        before = dict((result_key(r), r) for r in json.load(f)['results'])
+    with open(after_file) as f:
+        after = json.load(f)['results']
+    for result in after:
+        old = before.get(result_key(result))
+        if old is None or 'error' in old or 'error' in result:
+            continue
+        text = "{0}: {1:.2f}x time, {2:.2f}x peak memory".format(
+            result_label(result),
+            result['seconds'] / old['seconds'],
+            result['peak_rss_kb'] / old['peak_rss_kb'])
+        if result.get('output_bytes') and old.get('output_bytes'):
+            text += ", {0:.2f}x output size".format(
+                result['output_bytes'] / old['output_bytes'])
+        if result.get('import_us') and old.get('import_us'):
+            text += ", {0:.2f}x import time".format(
+                result['import_us'] / old['import_us'])
+        print(text)
+
+
+def main(argv):
+    arguments = docopt.docopt(__doc__, argv)
+    if arguments['compare']:
+        compare(arguments['<before>'], arguments['<after>'])
+        return
+    settings = Settings(
+        shape=tuple(int(n) for n in arguments['--shape'].split(",")),
+        vois=int(arguments['--vois']),
+        voxels=int(arguments['--voxels']),
+        many_vois=int(arguments['--many-vois']),
+        repeat=int(arguments['--repeat']))
+    names = None
+    if arguments['--only']:
+        names = arguments['--only'].split(",")
+    results = run_benchmarks(settings, names)
+    output = OrderedDict([
+        ('settings', settings._asdict()),
+        ('python', platform.python_version()),
+        ('numpy', np.__version__),
+        ('platform', platform.platform()),
+        ('time', time.strftime("%Y-%m-%dT%H:%M:%S")),
+        ('results', results),
+    ])
+    with open(arguments['--output'], 'w') as f:
+        json.dump(output, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
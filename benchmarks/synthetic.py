@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+Writes synthetic VOI group files, laid out the way Spamalize writes them,
+for benchmarking.
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+import numpy as np
+
+DATA_FORMATS = (
+    "LONG coordinate index",
+    "Text coordinate index",
+    "Text coordinate triple",
+)
+BYTE_ORDERS = {
+    "BIG_ENDIAN": ">i4",
+    "LITTLE_ENDIAN": "<i4",
+}
+
+
+def make_voxel_indexes(shape, voxel_count, rng):
+    """
+    Pick voxel_count distinct voxel indexes, sorted, from a volume of the
+    given shape.
+    """
+    total = int(np.prod(shape))
+    voxel_count = min(voxel_count, total)
+    indexes = np.unique(rng.randint(0, total, voxel_count))
+    while len(indexes) < voxel_count:
+        more = rng.randint(0, total, voxel_count - len(indexes))
+        indexes = np.union1d(indexes, more)
+    return indexes.astype(np.int32)
+
+
+def write_voi_group(
+        filename,
+        shape=(79, 95, 68),
+        voi_count=3,
+        voxels_per_voi=1000,
+        data_format="LONG coordinate index",
+        byte_order="BIG_ENDIAN",
+        voxel_dimensions=(2.0, 2.0, 2.0),
+        seed=0):
+    """
+    Write a VOI group file with voi_count VOIs of voxels_per_voi random
+    voxels each. Returns a list of each VOI's voxel indexes.
+    """
+    if data_format not in DATA_FORMATS:
+        raise ValueError("unknown data format {0}".format(data_format))
+    rng = np.random.RandomState(seed)
+    all_indexes = [
+        make_voxel_indexes(shape, voxels_per_voi, rng)
+        for i in range(voi_count)]
+    with open(filename, 'wb') as f:
+        write_lines(f, group_header_lines(
+            filename, shape, voxel_dimensions, voi_count, byte_order))
+        for i, indexes in enumerate(all_indexes):
+            write_lines(f, voi_header_lines(
+                filename, i + 1, shape, voxel_dimensions, len(indexes),
+                data_format))
+            write_voxel_data(f, indexes, shape, data_format, byte_order)
+            write_lines(f, [
+                " ",
+                "Number of vertecies =            0",
+                "End of VOI = {0}".format(i + 1),
+                " "])
+            if i + 1 < voi_count:
+                write_lines(f, ["-----------------------------------"])
+        write_lines(f, [
+            " ",
+            "Finished writing VOIGroup at 20150101_000000",
+            "END"])
+    return all_indexes
+
+
+def write_lines(f, lines):
+    f.write("".join(line + "\r\n" for line in lines).encode("ascii"))
+
+
+def write_voxel_data(f, indexes, shape, data_format, byte_order):
+    if data_format == "LONG coordinate index":
+        f.write(indexes.astype(BYTE_ORDERS[byte_order]).tobytes())
+    elif data_format == "Text coordinate index":
+        write_lines(f, [str(idx) for idx in indexes.tolist()])
+    else:
+        x, y, z = np.unravel_index(indexes, shape, order='F')
+        write_lines(f, [
+            "{0}, {1}, {2}".format(*xyz)
+            for xyz in zip(x.tolist(), y.tolist(), z.tolist())])
+
+
+def group_header_lines(
+        filename, shape, voxel_dimensions, voi_count, byte_order):
+    lines = [
+        "******** VOIGroup File *********",
+        "*** Program name: VOIGroup, from the SPAMALIZE package.***",
+        " ",
+        "Date and time of file creation or last update = 20150101_000000",
+        "Original file name = {0}".format(filename),
+        "Current file name = {0}".format(filename),
+        "Image-base file name = synthetic.img",
+        " ",
+        "Creator = Unknown",
+        "Owner = Unknown",
+        " ",
+        "Byte Order = {0}".format(byte_order),
+        " ",
+        "Number of VOIs = {0}".format(voi_count),
+    ]
+    lines.extend(
+        "VOI name  = voi {0}".format(i + 1) for i in range(voi_count))
+    lines.extend([
+        "Current VOI = {0}".format(voi_count),
+        "Last mode = voxel",
+        " ",
+        "X dim = {0}".format(shape[0]),
+        "Y dim = {0}".format(shape[1]),
+        "Z dim = {0}".format(shape[2]),
+        "X pixdim = {0:.5f}".format(voxel_dimensions[0]),
+        "Y pixdim = {0:.5f}".format(voxel_dimensions[1]),
+        "Z pixdim = {0:.5f}".format(voxel_dimensions[2]),
+        " ",
+    ])
+    lines.extend(
+        "Color = 255, 0, 0 = {0}".format(i + 1) for i in range(voi_count))
+    lines.extend([" ", "-----------------------------------"])
+    return lines
+
+
+def voi_header_lines(
+        filename, number, shape, voxel_dimensions, voxel_count,
+        data_format):
+    voxel_cc = np.prod(voxel_dimensions) / 1000.0
+    return [
+        "VOI",
+        "VOI number = {0}".format(number),
+        "VOI name = voi {0}".format(number),
+        "Filename = {0}".format(filename),
+        "Date written = 20150101_000000",
+        "Date created = 20150101_000000",
+        "Date updated any = 20150101_000000",
+        "Date updated vox = 20150101_000000",
+        "Date updated vert = ",
+        "Creator = Unknown",
+        "Owner = Unknown",
+        " ",
+        "x_dim = {0:8d}".format(shape[0]),
+        "y_dim = {0:8d}".format(shape[1]),
+        "z_dim = {0:8d}".format(shape[2]),
+        "x_pixdim = {0:13.5f}".format(voxel_dimensions[0]),
+        "y_pixdim = {0:13.5f}".format(voxel_dimensions[1]),
+        "z_pixdim = {0:13.5f}".format(voxel_dimensions[2]),
+        "color = 255, 0, 0",
+        " ",
+        "VOI volume (cc) = {0:g}".format(voxel_count * voxel_cc),
+        "Number of voxels = {0}".format(voxel_count),
+        "Voxel volume (cm^3) = {0:g}".format(voxel_cc),
+        "VOI CoM = 0, 0, 0",
+        "Start voxel data = {0}".format(data_format),
+    ]
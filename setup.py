@@ -25,7 +25,12 @@ setup(
     entry_points={
         'console_scripts': [
             'voi_info = voitools.scripts.voi_info:console',
-            'voi2nii = voitools.scripts.voi2nii:console'
+            'voi2nii = voitools.scripts.voi2nii:console',
+            'nii2voi = voitools.scripts.nii2voi:console',
+            'voi_extract = voitools.scripts.voi_extract:console',
+            'voi_overlap = voitools.scripts.voi_overlap:console',
+            'voi_catalog = voitools.scripts.voi_catalog:console',
+            'voi_convert = voitools.scripts.voi_convert:console'
         ]
     }
 )
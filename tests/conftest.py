@@ -15,6 +15,14 @@ import os
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
 
 
+@pytest.fixture(autouse=True)
+def cache_dir(tmpdir, monkeypatch):
+    # Keep the scripts from writing to the real parsed-VOI cache.
+    path = str(tmpdir.join('cache'))
+    monkeypatch.setenv('VOITOOLS_CACHE_DIR', path)
+    return path
+
+
 @pytest.fixture
 def long_data_filename():
     return os.path.join(DATA_DIR, "long.voi")
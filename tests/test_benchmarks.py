@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+This contains tests for the benchmark suite and its synthetic VOI groups
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+from voitools import voi
+from benchmarks import synthetic
+from benchmarks import run
+
+import numpy as np
+
+import json
+
+
+def test_synthetic_groups_read_back(tmpdir):
+    filename = str(tmpdir.join("synthetic.voi"))
+    for data_format in synthetic.DATA_FORMATS:
+        for byte_order in synthetic.BYTE_ORDERS:
+            indexes = synthetic.write_voi_group(
+                filename,
+                shape=(20, 30, 40),
+                voi_count=4,
+                voxels_per_voi=500,
+                data_format=data_format,
+                byte_order=byte_order)
+            voi_group = voi.read_file(filename)
+            assert voi_group.shape == voi.Triple(20, 30, 40)
+            assert len(voi_group.vois) == 4
+            for expected, cur_voi in zip(indexes, voi_group.vois):
+                assert cur_voi.voxel_count == 500
+                assert np.array_equal(cur_voi.voxel_indexes, expected)
+
+
+def test_run_benchmarks(tmpdir):
+    output = str(tmpdir.join("results.json"))
+    run.main([
+        str("--shape=10,10,10"),
+        str("--vois=2"),
+        str("--voxels=50"),
+        str("--many-vois=20"),
+        str("--repeat=1"),
+        str("--output={0}".format(output))])
+    with open(output) as f:
+        results = json.load(f)['results']
+    assert set(r['benchmark'] for r in results) == set(run.BENCHMARKS)
+    for result in results:
+        assert 'error' not in result
+        assert result['seconds'] >= 0
+        assert result['peak_rss_kb'] > 0
+    run.main([str("compare"), str(output), str(output)])
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+This contains tests for voitools.cache
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+from voitools import voi
+from voitools.cache import VOICache
+
+import numpy as np
+
+import os
+import shutil
+
+
+def copy_to(filename, tmpdir):
+    dest = str(tmpdir.join(os.path.basename(filename)))
+    shutil.copy(filename, dest)
+    return dest
+
+
+def assert_same_group(a, b):
+    assert list(a.header.items()) == list(b.header.items())
+    assert len(a.vois) == len(b.vois)
+    for va, vb in zip(a.vois, b.vois):
+        assert list(va.header.items()) == list(vb.header.items())
+        assert np.array_equal(va.voxel_indexes, vb.voxel_indexes)
+
+
+def test_round_trip(triple_data_filename, cache_dir):
+    cache = VOICache(cache_dir)
+    assert cache.load(triple_data_filename) is None
+    parsed = voi.read_file(triple_data_filename, cache=cache)
+    assert os.path.exists(cache.entry_filename(triple_data_filename))
+    cached = cache.load(triple_data_filename)
+    assert cached is not None
+    assert_same_group(parsed, cached)
+
+
+def test_partial_read_from_cache(triple_data_filename, cache_dir):
+    cache = VOICache(cache_dir)
+    full = voi.read_file(triple_data_filename, cache=cache)
+    some = voi.read_file(triple_data_filename, voi_numbers=[2], cache=cache)
+    assert [v.voi_number for v in some.vois] == ['2']
+    assert np.array_equal(
+        some.vois[0].voxel_indexes, full.vois[1].voxel_indexes)
+
+
+def test_invalidated_by_change(triple_data_filename, cache_dir, tmpdir):
+    filename = copy_to(triple_data_filename, tmpdir)
+    cache = VOICache(cache_dir)
+    voi.read_file(filename, cache=cache)
+    assert cache.load(filename) is not None
+    with open(filename, 'ab') as f:
+        f.write(b"\n")
+    assert cache.load(filename) is None
+
+
+def test_touched_file_still_cached(
+        triple_data_filename, cache_dir, tmpdir):
+    filename = copy_to(triple_data_filename, tmpdir)
+    cache = VOICache(cache_dir)
+    voi.read_file(filename, cache=cache)
+    st = os.stat(filename)
+    os.utime(filename, (st.st_atime, st.st_mtime + 10))
+    assert cache.load(filename) is not None
+
+
+def test_eviction(triple_data_filename, cache_dir, tmpdir):
+    cache = VOICache(
+        cache_dir, max_bytes=os.path.getsize(triple_data_filename))
+    filenames = [copy_to(triple_data_filename, tmpdir.mkdir("0"))]
+    voi.read_file(filenames[0], cache=cache)
+    # Entries are smaller than the file; make enough to need evicting
+    entry_size = os.path.getsize(cache.entry_filename(filenames[0]))
+    os.utime(cache.entry_filename(filenames[0]), (0, 0))
+    for i in range(1, cache.max_bytes // entry_size + 1):
+        filenames.append(copy_to(triple_data_filename, tmpdir.mkdir(str(i))))
+        voi.read_file(filenames[-1], cache=cache)
+    assert not os.path.exists(cache.entry_filename(filenames[0]))
+    assert os.path.exists(cache.entry_filename(filenames[-1]))
+    assert sum(
+        os.path.getsize(os.path.join(cache_dir, name))
+        for name in os.listdir(cache_dir)) <= cache.max_bytes
+
+
+def test_long_and_big_files_not_stored(
+        long_data_filename, triple_data_filename, cache_dir):
+    cache = VOICache(cache_dir)
+    voi.read_file(long_data_filename, cache=cache)
+    list(voi.iter_vois(long_data_filename, cache=cache))
+    assert not os.path.exists(cache_dir) or os.listdir(cache_dir) == []
+    cache = VOICache(
+        cache_dir, max_bytes=os.path.getsize(triple_data_filename) - 1)
+    voi.read_file(triple_data_filename, cache=cache)
+    list(voi.iter_vois(triple_data_filename, cache=cache))
+    assert not os.path.exists(cache_dir) or os.listdir(cache_dir) == []
+
+
+def test_iter_vois_fills_cache(triple_data_filename, cache_dir):
+    cache = VOICache(cache_dir)
+    streamed = list(voi.iter_vois(triple_data_filename, cache=cache))
+    cached = cache.load(triple_data_filename)
+    assert cached is not None
+    assert len(cached.vois) == len(streamed)
+    again = list(voi.iter_vois(triple_data_filename, [7, 1], cache=cache))
+    assert [v.voi_number for v in again] == ['7', '1']
+    assert np.array_equal(again[1].voxel_indexes, streamed[0].voxel_indexes)
+
+
+def test_iter_vois_drops_earlier_vois(triple_data_filename, cache_dir):
+    import gc
+    import weakref
+    cache = VOICache(cache_dir)
+    refs = []
+    for cur_voi in voi.iter_vois(triple_data_filename, cache=cache):
+        refs.append(weakref.ref(cur_voi.voxel_indexes))
+        gc.collect()
+        assert all(ref() is None for ref in refs[:-1])
+    assert len(refs) > 1
+    # ... and still filled the cache
+    cached = cache.load(triple_data_filename)
+    assert [len(v.voxel_indexes) for v in cached.vois] == [
+        v.voxel_count for v in cached.vois]
+    assert [f for f in os.listdir(cache_dir) if f.endswith(".spool")] == []
+
+
+def test_hit_survives_failed_update(
+        triple_data_filename, cache_dir, tmpdir, monkeypatch):
+    filename = copy_to(triple_data_filename, tmpdir)
+    cache = VOICache(cache_dir)
+    voi.read_file(filename, cache=cache)
+
+    def fail(*args):
+        raise OSError("read-only cache")
+    monkeypatch.setattr(os, 'utime', fail)
+    assert cache.load(filename) is not None
+    monkeypatch.undo()
+    st = os.stat(filename)
+    os.utime(filename, (st.st_atime, st.st_mtime + 10))
+    monkeypatch.setattr(cache, 'store', fail)
+    assert cache.load(filename) is not None
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+This contains tests for voitools.catalog
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+from voitools import voi
+from voitools import catalog
+
+import os
+import shutil
+
+
+def copy_data(tmpdir, long_data_filename, triple_data_filename):
+    archive = tmpdir.mkdir("archive")
+    subject = archive.mkdir("subject")
+    shutil.copy(long_data_filename, str(archive.join("a.voi")))
+    shutil.copy(triple_data_filename, str(subject.join("b.voi")))
+    archive.join("notes.txt").write("not a VOI file")
+    return archive
+
+
+def test_scan_and_query(tmpdir, long_data_filename, triple_data_filename):
+    archive = copy_data(tmpdir, long_data_filename, triple_data_filename)
+    with catalog.Catalog(str(tmpdir.join("cat.db"))) as cat:
+        assert cat.scan([str(archive)], jobs=2) == (2, 0, 0)
+        rows = cat.query(name="caudate L")
+        assert rows == [
+            (str(archive.join("a.voi")), 1, "caudate L", 148, 148 * 8.0)]
+        assert len(cat.query()) == 10
+        big = cat.query(min_voxels=200, columns=("voxel_count",))
+        assert all(count >= 200 for (count,) in big)
+        assert cat.query(where="name LIKE 'caudate%'", max_voxels=0) == []
+
+
+def test_bounding_boxes(tmpdir, long_data_filename):
+    with catalog.Catalog(str(tmpdir.join("cat.db"))) as cat:
+        cat.scan([long_data_filename])
+        columns = (
+            "x_start", "y_start", "z_start", "x_stop", "y_stop", "z_stop")
+        rows = cat.query(columns=columns)
+    vois = voi.read_file(long_data_filename).vois
+    assert rows == [
+        tuple(v.bounding_box().start) + tuple(v.bounding_box().stop)
+        for v in vois]
+
+
+def test_rescan_is_incremental(
+        tmpdir, long_data_filename, triple_data_filename):
+    archive = copy_data(tmpdir, long_data_filename, triple_data_filename)
+    filename = str(tmpdir.join("cat.db"))
+    with catalog.Catalog(filename) as cat:
+        cat.scan([str(archive)], jobs=1)
+    with catalog.Catalog(filename) as cat:
+        assert cat.scan([str(archive)], jobs=1) == (0, 2, 0)
+        changed = str(archive.join("a.voi"))
+        os.utime(changed, (0, 0))
+        found, missing = catalog.find_voi_files([str(archive)])
+        assert cat.stale_files(found) == ([changed], [])
+        assert cat.scan([str(archive)], jobs=1) == (1, 1, 0)
+        assert len(cat.query()) == 10
+        archive.join("subject").remove()
+        assert cat.scan([str(archive)], jobs=1) == (0, 1, 0)
+        assert len(cat.query()) == 3
+
+
+def test_bad_files_are_skipped(tmpdir, long_data_filename):
+    tmpdir.join("bad.voi").write("not a VOI file")
+    shutil.copy(long_data_filename, str(tmpdir.join("good.voi")))
+    with catalog.Catalog(str(tmpdir.join("cat.db"))) as cat:
+        assert cat.scan([str(tmpdir)], jobs=1) == (1, 0, 1)
+        assert len(cat.query()) == 3
+
+
+def test_missing_files_are_skipped(tmpdir, long_data_filename):
+    good = str(tmpdir.join("good.voi"))
+    shutil.copy(long_data_filename, good)
+    nowhere = str(tmpdir.join("nowhere"))
+    assert catalog.find_voi_files([good, nowhere]) == ([good], [nowhere])
+    with catalog.Catalog(str(tmpdir.join("cat.db"))) as cat:
+        assert cat.scan([good, nowhere], jobs=1) == (1, 0, 1)
+        assert len(cat.query()) == 3
+        # Deleted between finding files and checking them
+        gone = str(tmpdir.join("gone.voi"))
+        assert cat.stale_files([good, gone]) == ([], [gone])
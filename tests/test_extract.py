@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+This contains tests for extracting VOI time series from images
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+
+from voitools import voi
+from voitools import extract
+
+import nibabel as nib
+import numpy as np
+
+import pytest
+
+
+def make_group():
+    voi_group = voi.VOIGroup.new((4, 5, 6), (2.0, 2.0, 2.0))
+    voi.VOI.new(voi_group, [0, 7, 33, 119], "a")
+    voi.VOI.new(voi_group, [], "empty")
+    voi.VOI.new(voi_group, [7, 50], "b")
+    return voi_group
+
+
+def test_extract_matches_masks():
+    voi_group = make_group()
+    data = np.random.RandomState(0).rand(4, 5, 6, 7).astype(np.float32)
+    results = extract.extract(
+        voi_group.vois, data, extract.STATISTICS, chunk_volumes=3)
+    assert list(results.keys()) == list(extract.STATISTICS)
+    for i, cur_voi in enumerate(voi_group.vois):
+        mask = cur_voi.to_volume().astype(bool)
+        inside = data[mask]
+        if not len(inside):
+            assert np.isnan(results['mean'][:, i]).all()
+            continue
+        assert np.allclose(results['mean'][:, i], inside.mean(axis=0))
+        assert np.allclose(results['median'][:, i], np.median(inside, axis=0))
+        assert np.allclose(results['std'][:, i], inside.std(axis=0))
+
+
+def test_extract_3d_data():
+    voi_group = make_group()
+    data = np.arange(120, dtype=np.int16).reshape((4, 5, 6), order='F')
+    results = extract.extract(voi_group.vois, data)
+    assert results['mean'].shape == (1, 3)
+    assert results['mean'][0, 0] == np.mean([0, 7, 33, 119])
+
+
+def test_extract_rejects_unknown_statistic():
+    with pytest.raises(ValueError):
+        extract.extract(make_group().vois, np.zeros((4, 5, 6)), ["mode"])
+
+
+def test_extract_file(tmpdir):
+    voi_group = make_group()
+    data = np.random.RandomState(1).rand(4, 5, 6, 5)
+    filename = str(tmpdir.join("data.nii.gz"))
+    nib.Nifti1Image(data, np.eye(4)).to_filename(filename)
+    results = extract.extract_file(voi_group.vois, filename, chunk_volumes=2)
+    expected = extract.extract(voi_group.vois, data)
+    assert np.allclose(results['mean'], expected['mean'], equal_nan=True)
+
+
+def test_extract_file_checks_shape(tmpdir):
+    filename = str(tmpdir.join("data.nii"))
+    nib.Nifti1Image(np.zeros((3, 3, 3, 2)), np.eye(4)).to_filename(filename)
+    with pytest.raises(ValueError):
+        extract.extract_file(make_group().vois, filename)
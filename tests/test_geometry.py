@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+This contains tests for voitools.geometry, checked against volumes
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+from voitools import geometry
+
+import numpy as np
+
+SHAPE = (7, 8, 9)
+
+
+def random_index_lists():
+    rng = np.random.RandomState(3)
+    grid_size = int(np.prod(SHAPE))
+    lists = [
+        rng.choice(grid_size, size, replace=False)
+        for size in (1, 40, 200, grid_size // 2)]
+    # A solid block, and an empty VOI
+    block = np.zeros(SHAPE, dtype=bool)
+    block[1:4, 2:6, 3:8] = True
+    return lists + [np.flatnonzero(block.ravel('F')), np.array([], int)]
+
+
+def to_volume(indexes):
+    vol = np.zeros(SHAPE, dtype=bool, order='F')
+    vol.ravel('A')[indexes] = True
+    return vol
+
+
+def test_centers_of_mass():
+    index_lists = random_index_lists()
+    centers = geometry.centers_of_mass(index_lists, SHAPE)
+    for indexes, center in zip(index_lists[:-1], centers):
+        expected = np.mean(np.nonzero(to_volume(indexes)), axis=1)
+        assert np.allclose(center, expected)
+    assert np.isnan(centers[-1]).all()
+
+
+def test_world_coordinates():
+    affine = np.diag([2.0, 3.0, 4.0, 1.0])
+    affine[:3, 3] = [10, 20, 30]
+    coords = geometry.world_coordinates(np.array([[1.0, 2.0, 3.0]]), affine)
+    assert np.allclose(coords, [[12, 26, 42]])
+
+
+def test_bounding_boxes():
+    index_lists = random_index_lists()
+    starts, stops = geometry.bounding_boxes(index_lists, SHAPE)
+    for indexes, start, stop in zip(index_lists[:-1], starts, stops):
+        coords = np.nonzero(to_volume(indexes))
+        assert list(start) == [c.min() for c in coords]
+        assert list(stop) == [c.max() + 1 for c in coords]
+    assert list(starts[4]) == [1, 2, 3] and list(stops[4]) == [4, 6, 8]
+    assert list(starts[-1]) == list(stops[-1]) == [0, 0, 0]
+    padded_starts, padded_stops = geometry.bounding_boxes(
+        index_lists, SHAPE, padding=2)
+    found = stops.any(axis=1)
+    assert (padded_starts[found] == np.maximum(starts[found] - 2, 0)).all()
+    assert (padded_stops[found] == np.minimum(
+        stops[found] + 2, SHAPE)).all()
+    assert list(padded_starts[-1]) == list(padded_stops[-1]) == [0, 0, 0]
+
+
+def test_boundary_counts():
+    index_lists = random_index_lists()
+    counts = geometry.boundary_counts(index_lists, SHAPE)
+    for indexes, count in zip(index_lists, counts):
+        vol = np.pad(to_volume(indexes), 1, 'constant')
+        interior = vol.copy()
+        for axis in range(3):
+            for step in (-1, 1):
+                interior &= np.roll(vol, step, axis)
+        assert count == vol.sum() - interior.sum()
+    # A 3x4x5 block hides a 1x2x3 core
+    assert counts[4] == 3 * 4 * 5 - 1 * 2 * 3
+    assert counts[-1] == 0
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+This contains tests for voitools.lazy, and that the scripts use it
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+from voitools import lazy
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_lazy_module():
+    colorsys = lazy.module("colorsys")
+    assert 'rgb_to_hsv' not in vars(colorsys)
+    assert colorsys.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+    # After the first use, attributes are the module's own
+    assert 'rgb_to_hsv' in vars(colorsys)
+    with pytest.raises(AttributeError):
+        colorsys.no_such_thing
+
+
+@pytest.mark.parametrize("script", [
+    "voi_info", "voi2nii", "nii2voi", "voi_extract", "voi_overlap",
+    "voi_catalog", "voi_convert"])
+def test_scripts_import_without_numpy(script):
+    code = (
+        "import sys, voitools.scripts.{0}; "
+        "print('numpy' in sys.modules or 'nibabel' in sys.modules)").format(
+            script)
+    out = subprocess.check_output(
+        [sys.executable, str("-c"), str(code)], cwd=ROOT)
+    assert out.strip() == b"False"
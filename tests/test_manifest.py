@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+This contains tests for voitools.manifest
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+from voitools import voi
+from voitools import manifest
+
+import numpy as np
+
+
+def test_voi_digest(long_data_filename):
+    vois = voi.read_file(long_data_filename).vois
+    digest = manifest.voi_digest(vois[:1])
+    assert digest == manifest.voi_digest(vois[:1])
+    assert not digest == manifest.voi_digest(vois[1:2])
+    # The same voxels in another byte order hash the same
+    swapped = voi.VOI(
+        vois[0].voi_group, vois[0].header,
+        vois[0].voxel_indexes.astype('<i4'), attach=False)
+    assert digest == manifest.voi_digest([swapped])
+    moved = voi.VOI(
+        vois[0].voi_group, vois[0].header,
+        vois[0].voxel_indexes + 1, attach=False)
+    assert not digest == manifest.voi_digest([moved])
+
+
+def test_manifest_round_trip(tmpdir):
+    out_dir = str(tmpdir)
+    entry = {'digest': 'abc', 'affine': np.eye(4).tolist(), 'crop': None}
+    outputs = manifest.Manifest.load(out_dir)
+    assert not outputs.is_current('a.nii', entry)
+    outputs.record('a.nii', entry)
+    tmpdir.join('a.nii').write("")
+    outputs.save()
+    loaded = manifest.Manifest.load(out_dir)
+    assert loaded.is_current('a.nii', entry)
+    assert not loaded.is_current('a.nii', dict(entry, crop=2))
+    tmpdir.join('a.nii').remove()
+    assert not loaded.is_current('a.nii', entry)
+    assert (loaded.rebuilt, loaded.reused) == (0, 1)
+
+
+def test_save_keeps_other_entries(tmpdir):
+    out_dir = str(tmpdir)
+    first = manifest.Manifest.load(out_dir)
+    second = manifest.Manifest.load(out_dir)
+    first.record('a.nii', {'digest': 'a'})
+    second.record('b.nii', {'digest': 'b'})
+    first.save()
+    second.save()
+    assert sorted(manifest.Manifest.load(out_dir).entries) == [
+        'a.nii', 'b.nii']
+
+
+def test_unreadable_manifest_is_empty(tmpdir):
+    tmpdir.join(manifest.MANIFEST_NAME).write("not json")
+    assert manifest.Manifest.load(str(tmpdir)).entries == {}
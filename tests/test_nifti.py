@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+This contains tests for voitools.nifti
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+import voitools
+from voitools import nifti
+from voitools.scripts import voi2nii
+
+import nibabel as nib
+import numpy as np
+
+import pytest
+
+
+def test_header_size():
+    header = nifti.make_header((2, 3, 4), np.eye(4), np.int16)
+    assert len(header) == nifti.HEADER_SIZE
+
+
+def test_matches_nibabel(long_data_filename, sample_nii, tmpdir):
+    voi_group = voitools.voi.read_file(long_data_filename)
+    for affine in [None, nib.load(sample_nii).get_affine()]:
+        voi_group.set_affine(affine)
+        cur_voi = voi_group.vois[0]
+        for name in ["native.nii", "native.nii.gz"]:
+            expected_name = str(tmpdir.join("nibabel.nii"))
+            native_name = str(tmpdir.join(name))
+            voi2nii.make_nifti(cur_voi).to_filename(expected_name)
+            # Small chunks, so we cross lots of chunk boundaries
+            nifti.write_mask(
+                native_name,
+                cur_voi.voxel_indexes,
+                cur_voi.shape,
+                cur_voi.affine,
+                chunk_voxels=1000)
+            expected = nib.load(expected_name)
+            native = nib.load(native_name)
+            assert np.array_equal(expected.get_data(), native.get_data())
+            assert np.allclose(expected.get_qform(), native.get_qform())
+            assert np.allclose(expected.get_sform(), native.get_sform())
+            assert native.get_header()['qform_code'] == 1
+            assert native.get_header()['sform_code'] == 1
+
+
+def test_rejects_outside_indexes(tmpdir):
+    with pytest.raises(ValueError):
+        nifti.write_mask(
+            str(tmpdir.join("bad.nii")), np.array([24]), (2, 3, 4), np.eye(4))
+
+
+
+def test_per_voxel_values(tmpdir):
+    filename = str(tmpdir.join("values.nii"))
+    nifti.write_mask(
+        filename, np.array([23, 0, 5]), (2, 3, 4), np.eye(4),
+        value=np.array([0.5, 0.25, 1.0]), dtype=np.float32, chunk_voxels=4)
+    data = nib.load(filename).get_data().ravel(order='F')
+    assert data[0] == 0.25 and data[5] == 1.0 and data[23] == 0.5
+    assert data.sum() == 1.75
+
+
+def test_parallel_gzip_file(tmpdir):
+    import gzip
+    data = np.zeros(300000, dtype=np.int16)
+    data[1000:1500] = 7
+    data[250000] = 3
+    expected = data.tobytes()
+    for threads in [1, 3]:
+        filename = str(tmpdir.join("out{0}.gz".format(threads)))
+        with nifti.ParallelGzipFile(
+                filename, 6, threads, block_size=10000) as f:
+            f.write(expected[:12345])
+            f.write(memoryview(expected)[12345:])
+            assert f.tell() == len(expected)
+            f.seek(len(expected))
+            with pytest.raises(IOError):
+                f.seek(0)
+        with open(filename, 'rb') as f:
+            assert f.read().count(b"\x1f\x8b\x08") > 1
+        assert gzip.open(filename).read() == expected
+
+
+def test_parallel_gzip_empty_file(tmpdir):
+    import gzip
+    filename = str(tmpdir.join("empty.gz"))
+    nifti.ParallelGzipFile(filename).close()
+    assert gzip.open(filename).read() == b""
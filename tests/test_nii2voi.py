@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+This contains tests for the nii2voi script
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+
+import voitools
+from voitools.scripts import nii2voi
+from voitools.scripts import voi2nii
+
+import numpy as np
+
+import tempfile
+import shutil
+import os
+
+import pytest
+
+
+def test_nii2voi_runs(capsys):
+    with pytest.raises(SystemExit):
+        nii2voi.main(['--help'])
+    out, err = capsys.readouterr()
+    assert len(out) > 0
+    assert len(err) == 0
+
+
+def test_masks_round_trip(long_data_filename):
+    original = voitools.voi.read_file(long_data_filename)
+    out_dir = tempfile.mkdtemp()
+    try:
+        voi2nii.process_vois(
+            original, "{voi_name}.nii", range(3), out_dir)
+        masks = [os.path.join(out_dir, "caudate_{0}.nii".format(s))
+                 for s in ["L", "R", "both"]]
+        out_file = os.path.join(out_dir, "masks.voi")
+        # docopt wants native strings for repeated arguments
+        nii2voi.main([str(a) for a in
+                      ['--byte-order=LITTLE_ENDIAN', out_file] + masks])
+        converted = voitools.voi.read_file(out_file)
+        assert converted.data_type_string == "<i4"
+        assert converted.shape == original.shape
+        assert converted.voxel_dimensions == original.voxel_dimensions
+        assert [v.name for v in converted.vois] == [
+            "caudate_L", "caudate_R", "caudate_both"]
+        for a, b in zip(original.vois, converted.vois):
+            assert a.voxel_count == b.voxel_count
+            assert np.array_equal(
+                np.sort(a.voxel_indexes), b.voxel_indexes)
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def test_labels_round_trip(long_data_filename):
+    original = voitools.voi.read_file(long_data_filename)
+    out_dir = tempfile.mkdtemp()
+    try:
+        voi2nii.main([
+            '--label-map=labels.nii.gz',
+            '--overlap=first',
+            '--out-dir={0}'.format(out_dir),
+            long_data_filename])
+        out_file = os.path.join(out_dir, "labels.voi")
+        nii2voi.main([str(a) for a in [
+            '--labels',
+            '--names={0}'.format(os.path.join(out_dir, "labels.tsv")),
+            out_file,
+            os.path.join(out_dir, "labels.nii.gz")]])
+        converted = voitools.voi.read_file(out_file)
+        assert [v.name for v in converted.vois] == ["caudate L", "caudate R"]
+        assert [v.voi_number for v in converted.vois] == ['1', '2']
+        for a, b in zip(original.vois, converted.vois):
+            assert np.array_equal(np.sort(a.voxel_indexes), b.voxel_indexes)
+    finally:
+        shutil.rmtree(out_dir)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+This contains tests for the write pipeline
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+from voitools import pipeline
+
+import threading
+import time
+
+import pytest
+
+
+def test_no_writers_runs_in_submit():
+    done = []
+    with pipeline.WritePipeline(0) as writes:
+        writes.submit(done.append, (threading.current_thread(),))
+        assert done == [threading.current_thread()]
+
+
+def test_writers_respect_byte_cap():
+    lock = threading.Lock()
+    in_flight = [0]
+    peak = [0]
+
+    def job(nbytes):
+        with lock:
+            in_flight[0] += nbytes
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= nbytes
+
+    with pipeline.WritePipeline(4, max_bytes=25) as writes:
+        for i in range(20):
+            writes.submit(job, (10,), 10)
+        assert writes.queued_bytes <= 25
+    assert 10 <= peak[0] <= 20
+    assert writes.queued_bytes == 0
+
+
+def test_oversized_job_still_runs():
+    done = []
+    with pipeline.WritePipeline(2, max_bytes=1) as writes:
+        writes.submit(done.append, (1,), 100)
+        writes.submit(done.append, (2,), 100)
+    assert sorted(done) == [1, 2]
+
+
+def test_writer_errors_raised():
+    def fail():
+        raise IOError("disk full")
+
+    with pytest.raises(IOError):
+        with pipeline.WritePipeline(2) as writes:
+            writes.submit(fail)
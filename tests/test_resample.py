@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+This contains tests for resampling VOIs onto other grids
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+
+from voitools import voi
+from voitools import resample
+
+import numpy as np
+
+import pytest
+
+FINE_AFFINE = np.eye(4)
+# Voxel 0 of the coarse grid covers voxels 0 and 1 of the fine grid
+COARSE_AFFINE = np.diag([2.0, 2.0, 2.0, 1.0])
+COARSE_AFFINE[:3, 3] = 0.5
+
+
+def fine_indexes(points):
+    return np.ravel_multi_index(np.array(points).T, (4, 4, 4), order='F')
+
+
+def test_same_grid_is_unchanged(long_data_filename):
+    voi_group = voi.read_file(long_data_filename)
+    resampler = resample.Resampler(
+        voi_group.shape, voi_group.affine, voi_group.shape, voi_group.affine)
+    for cur_voi in voi_group.vois:
+        targets, weights = resampler.resample(cur_voi.voxel_indexes)
+        assert np.array_equal(targets, np.sort(cur_voi.voxel_indexes))
+        assert (weights == 1).all()
+
+
+def test_nearest_upsampling():
+    resampler = resample.Resampler(
+        (2, 2, 2), COARSE_AFFINE, (4, 4, 4), FINE_AFFINE)
+    targets, weights = resampler.resample([0])
+    assert np.array_equal(targets, np.sort(fine_indexes(
+        [(x, y, z) for x in (0, 1) for y in (0, 1) for z in (0, 1)])))
+    vol = resampler.to_volume([7])
+    assert vol.dtype == np.int16
+    assert vol[2:, 2:, 2:].all() and vol.sum() == 8
+
+
+def test_fraction_downsampling():
+    resampler = resample.Resampler(
+        (4, 4, 4), FINE_AFFINE, (2, 2, 2), COARSE_AFFINE,
+        mode="fraction", subdivisions=2)
+    targets, weights = resampler.resample(
+        fine_indexes([(0, 0, 0), (1, 1, 1), (3, 3, 3)]))
+    assert list(targets) == [0, 7]
+    assert np.allclose(weights, [0.25, 0.125])
+    assert resampler.to_volume(fine_indexes([(2, 2, 2)])).dtype == np.float32
+
+
+def test_resample_group(long_data_filename):
+    voi_group = voi.read_file(long_data_filename)
+    target_affine = voi_group.affine.copy()
+    target_affine[:3, :3] *= 2
+    resampler = resample.Resampler(
+        voi_group.shape, voi_group.affine, (40, 48, 34), target_affine)
+    resampled = resampler.resample_group(voi_group)
+    assert resampled.shape == (40, 48, 34)
+    assert resampled.voxel_dimensions == (4.0, 4.0, 4.0)
+    assert np.array_equal(resampled.affine, target_affine)
+    assert [v.name for v in resampled.vois] == [v.name for v in voi_group.vois]
+    for cur_voi in resampled.vois:
+        assert cur_voi.shape == (40, 48, 34)
+        assert 0 < cur_voi.voxel_count == len(cur_voi.voxel_indexes)
+
+
+def test_fraction_group_refused():
+    resampler = resample.Resampler(
+        (4, 4, 4), FINE_AFFINE, (2, 2, 2), COARSE_AFFINE, mode="fraction")
+    with pytest.raises(ValueError):
+        resampler.resample_group(voi.VOIGroup.new((4, 4, 4), (1, 1, 1)))
+
+
+def test_for_group_reuses_resampler(long_data_filename):
+    voi_group = voi.read_file(long_data_filename)
+    target = resample.Target((10, 10, 10), np.eye(4), "nearest")
+    first = resample.for_group(voi_group, target)
+    assert resample.for_group(voi_group, target) is first
+    other = resample.Target((10, 10, 10), np.eye(4), "fraction")
+    assert resample.for_group(voi_group, other) is not first
+
+
+RESAMPLE_SCRIPT = """
+import json, resource, sys
+import numpy as np
+from voitools import resample
+source_affine = np.diag([2.0, 2.0, 2.0, 1.0])
+source_affine[:3, 3] = [-90, -126, -72]
+target_affine = np.eye(4)
+target_affine[:3, 3] = [-90, -126, -72]
+x, y, z = np.mgrid[35:55, 44:64, 35:55]
+indexes = np.ravel_multi_index(
+    (x.ravel(), y.ravel(), z.ravel()), (91, 109, 91), order='F')
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+resampler = resample.Resampler(
+    (91, 109, 91), source_affine, (182, 218, 182), target_affine,
+    mode="fraction")
+targets, weights = resampler.resample(indexes)
+growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+json.dump([growth, len(indexes), float(weights.sum())], sys.stdout)
+"""
+
+
+def test_realistic_grid_memory():
+    # A 2 mm MNI-sized grid onto a 1 mm one; mapping the whole target grid
+    # would take gigabytes.
+    import json
+    import os
+    import subprocess
+    import sys
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    output = subprocess.check_output(
+        [sys.executable, "-c", RESAMPLE_SCRIPT], env=env)
+    growth, voxel_count, volume = json.loads(output.decode("utf-8"))
+    if sys.platform == 'darwin':
+        growth //= 1024
+    assert growth < 64 * 1024
+    # Each source voxel covers 8 target voxels
+    assert np.isclose(volume, voxel_count * 8)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+This contains tests for VOI set operations and overlap measures
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+
+from voitools import voi
+from voitools import sets
+
+import numpy as np
+
+import pytest
+
+
+def test_set_operations():
+    rand = np.random.RandomState(0)
+    a = sets.sorted_indexes(rand.randint(0, 100, 40))
+    b = sets.sorted_indexes(rand.randint(0, 100, 40))
+    assert np.array_equal(sets.intersection(a, b), np.intersect1d(a, b))
+    assert np.array_equal(sets.union(a, b), np.union1d(a, b))
+    assert np.array_equal(sets.difference(a, b), np.setdiff1d(a, b))
+    empty = np.array([], dtype=a.dtype)
+    assert np.array_equal(sets.union(empty, b), b)
+    assert len(sets.intersection(a, empty)) == 0
+
+
+def test_overlap_matches_volumes(long_data_filename):
+    vois = voi.read_file(long_data_filename).vois
+    shared = sets.overlap_matrix(vois, measure="intersection")
+    dice = sets.overlap_matrix(vois)
+    jaccard = sets.overlap_matrix(vois, vois, "jaccard")
+    for i, a in enumerate(vois):
+        for j, b in enumerate(vois):
+            va = a.to_volume().astype(bool)
+            vb = b.to_volume().astype(bool)
+            both = (va & vb).sum()
+            assert shared[i, j] == both
+            assert np.isclose(dice[i, j], 2.0 * both / (va.sum() + vb.sum()))
+            assert np.isclose(jaccard[i, j], both / (va | vb).sum())
+    assert np.allclose(np.diag(dice), 1)
+
+
+def test_overlap_of_empty_vois():
+    voi_group = voi.VOIGroup.new((2, 2, 2), (1, 1, 1))
+    voi.VOI.new(voi_group, [], "empty")
+    voi.VOI.new(voi_group, [1, 2], "full")
+    dice = sets.overlap_matrix(voi_group.vois)
+    assert np.isnan(dice[0, 0])
+    assert dice[0, 1] == 0 and dice[1, 1] == 1
+
+
+def test_unknown_measure():
+    with pytest.raises(ValueError):
+        sets.overlap_matrix([], measure="cosine")
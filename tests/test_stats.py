@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+This contains tests for voitools.stats
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+from voitools import stats
+from voitools import voi
+
+import io
+
+
+def test_disabled_by_default():
+    assert stats.active() is None
+    assert stats.phase("anything") is stats._NULL_PHASE
+
+
+def test_records_phases(long_data_filename):
+    recorder = stats.enable()
+    try:
+        voi_group = voi.read_file(long_data_filename)
+        voi_group.vois[0].to_volume()
+    finally:
+        stats.disable()
+    assert stats.active() is None
+    summary = dict((t['phase'], t) for t in recorder.summary())
+    assert summary['voxel_data']['calls'] == 3
+    assert summary['to_volume']['calls'] == 1
+    assert summary['group_header']['bytes_read'] > 0
+    per_voi = recorder.per_voi()
+    assert set(per_voi[(None, '1')].keys()) == set(
+        ['voxel_data', 'to_volume'])
+    out = io.StringIO()
+    recorder.write_text(out)
+    assert "voxel_data" in out.getvalue()
+
+
+RSS_GROWTH_SCRIPT = """
+import io, json, sys
+from voitools import stats
+# On Linux, a new process's peak RSS starts at the RSS its parent had when
+# it forked; allocate 32 MB past that.
+baseline_kb = stats._max_rss_kb()
+recorder = stats.enable(trace_memory=False)
+with stats.phase("allocate"):
+    data = bytearray((baseline_kb + 32 * 1024) * 1024)
+    data[::4096] = b"x" * len(data[::4096])
+stats.disable()
+out = io.StringIO()
+recorder.write_text(out)
+json.dump([recorder.summary()[0], out.getvalue()], sys.stdout)
+"""
+
+
+def test_records_rss_growth():
+    # In another process, so the allocation is gone when it exits, rather
+    # than raising the test run's own peak
+    import json
+    import os
+    import subprocess
+    import sys
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    output = subprocess.check_output(
+        [sys.executable, "-c", RSS_GROWTH_SCRIPT], env=env)
+    total, text = json.loads(output.decode("utf-8"))
+    assert total['peak_alloc_kb'] is None
+    assert total['rss_growth_kb'] >= 16 * 1024
+    assert total['process_max_rss_kb'] >= total['rss_growth_kb']
+    assert "RSS growth kB" in text
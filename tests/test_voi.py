@@ -57,6 +57,42 @@ def test_voi_properties(long_data_file):
     assert voi_0.voxel_dimensions == voi.Triple(2.0, 2.0, 2.0)
 
 
+def test_header_fields_parsed_once(long_data_filename):
+    voi_group = voi.read_file(long_data_filename)
+    voi_0 = voi_group.vois[0]
+    # Slotted records, with the raw header kept alongside
+    assert not hasattr(voi_group, '__dict__')
+    assert not hasattr(voi_0, '__dict__')
+    assert voi_0.header['x_dim'].strip() == "79"
+    assert voi_0.voxel_count == 148
+    assert voi_0.voi_number == "1"
+    assert voi_0.data_format == voi.LONG_INDEX
+    assert voi_group.shape is voi_group.shape
+    assert voi_group.byte_order == "BIG_ENDIAN"
+
+
+def test_bad_headers_raise(long_data_filename):
+    import pytest
+    from voitools.vendor.ordereddict import OrderedDict
+    header = OrderedDict(voi.read_headers(long_data_filename).header)
+    header['X dim'] = "seventy-nine"
+    with pytest.raises(voi.VOIFileError):
+        voi.VOIGroup(header)
+    del header['X dim']
+    with pytest.raises(voi.VOIFileError):
+        voi.VOIGroup(header)
+
+
+def test_truncated_voi_header_raises(triple_data_filename):
+    import io
+    import pytest
+    with open(triple_data_filename, 'rb') as f:
+        text = f.read()
+    truncated = text[:text.index(b"Start voxel data")]
+    with pytest.raises(voi.VOIFileError):
+        voi.read_file(io.BytesIO(truncated))
+
+
 def test_read_file_filename(long_data_filename):
     voi_group = voi.read_file(long_data_filename)
     assert voi_group.voi_count == len(voi_group.vois)
@@ -67,6 +103,70 @@ def test_read_file_io(long_data_file):
     assert vg.voi_count == len(vg.vois)
 
 
+def test_read_file_maps_long_data(long_data_filename):
+    import numpy as np
+    vg = voi.read_file(long_data_filename)
+    indexes = vg.vois[0].voxel_indexes
+    # A view of the mapped file, not a copy
+    assert not indexes.flags.owndata
+    assert not indexes.flags.writeable
+    with open(long_data_filename, 'r') as f:
+        expected = voi.read_file(f).vois[0].voxel_indexes
+    assert np.array_equal(indexes, expected)
+
+
+def test_mapped_file_reads_like_a_file(long_data_filename):
+    with voi.MappedFile(long_data_filename) as mapped:
+        with open(long_data_filename, 'rb') as f:
+            assert mapped.readline() == voi._native_str(f.readline())
+            assert mapped.tell() == f.tell()
+            mapped.seek(100)
+            f.seek(100)
+            assert mapped.read(50) == f.read(50)
+            mapped.seek(-10, 2)
+            assert mapped.read() == f.read()[-10:]
+            assert mapped.readline() == ""
+
+
+def test_mapped_file_read_lines(triple_data_filename):
+    with voi.MappedFile(triple_data_filename) as mapped:
+        with open(triple_data_filename, 'rb') as f:
+            lines = [voi._native_str(line) for line in f]
+        assert mapped.read_lines(0) == ""
+        assert mapped.read_lines(3) == "".join(lines[:3])
+        mapped.skip_lines(200)
+        assert mapped.readline() == lines[203]
+        assert mapped.read_lines(len(lines)) == "".join(lines[204:])
+        assert mapped.read_lines(1) == ""
+
+
+def test_text_data_read_in_blocks(triple_data_filename, monkeypatch):
+    # Voxel lines are found all at once, not a readline() per voxel
+    calls = []
+    readline = voi.MappedFile.readline
+
+    def counting_readline(self):
+        calls.append(1)
+        return readline(self)
+    monkeypatch.setattr(voi.MappedFile, 'readline', counting_readline)
+    full = voi.read_file(triple_data_filename, cache=None)
+    voxels = sum(v.voxel_count for v in full.vois)
+    assert 0 < len(calls) < voxels / 10
+    del calls[:]
+    voi.read_headers(triple_data_filename)
+    assert 0 < len(calls) < voxels / 10
+
+
+def test_truncated_long_data_raises(long_data_filename):
+    import io
+    import pytest
+    with open(long_data_filename, 'rb') as f:
+        data = f.read()
+    truncated = data[:data.index(b"Start voxel data") + 100]
+    with pytest.raises(voi.VOIFileError):
+        voi.read_file(io.BytesIO(truncated))
+
+
 def test_to_volume(long_data_file):
     import numpy as np
     vg = voi.read_file(long_data_file)
@@ -74,3 +174,322 @@ def test_to_volume(long_data_file):
     vol = voi1.to_volume()
     assert vol.shape == voi1.shape
     assert np.sum(vol) == voi1.voxel_count
+
+
+def test_bounding_box():
+    import numpy as np
+    shape = (10, 20, 30)
+    indexes = np.ravel_multi_index(
+        ([2, 5, 3], [4, 4, 19], [7, 9, 8]), shape, order='F')
+    box = voi.bounding_box(indexes, shape)
+    assert box == voi.BoundingBox((2, 4, 7), (6, 20, 10))
+    assert box.shape == voi.Triple(4, 16, 3)
+    padded = voi.bounding_box(indexes, shape, padding=3)
+    assert padded == voi.BoundingBox((0, 1, 4), (9, 20, 13))
+    assert voi.bounding_box(np.array([], dtype=int), shape) is None
+    cropped = box.crop_indexes(indexes, shape)
+    assert list(cropped) == list(np.ravel_multi_index(
+        ([0, 3, 1], [0, 0, 15], [0, 2, 1]), box.shape, order='F'))
+    affine = np.diag([2.0, 2.0, 2.0, 1.0])
+    affine[:3, 3] = [-10, -20, -30]
+    assert np.allclose(box.crop_affine(affine)[:3, 3], [-6, -12, -16])
+
+
+def test_to_volume_box(long_data_file):
+    import numpy as np
+    vg = voi.read_file(long_data_file)
+    voi1 = vg.vois[0]
+    box = voi1.bounding_box(padding=2)
+    vol = voi1.to_volume(box=box)
+    assert vol.shape == box.shape
+    assert np.array_equal(vol, voi1.to_volume()[box.slices])
+
+
+def test_to_volume_dtypes(long_data_file):
+    import numpy as np
+    vg = voi.read_file(long_data_file)
+    voi1 = vg.vois[0]
+    for dtype in ["uint8", "bool"]:
+        vol = voi1.to_volume(dtype)
+        assert vol.dtype == np.dtype(dtype)
+        assert np.array_equal(vol, voi1.to_volume().astype(dtype))
+
+
+def test_to_volume_out(long_data_file):
+    import numpy as np
+    import pytest
+    vg = voi.read_file(long_data_file)
+    buffer = voi.VolumeBuffer(vg.shape, "uint8")
+    for cur_voi in vg.vois:
+        vol = cur_voi.to_volume(out=buffer)
+        assert vol is buffer.array
+        assert np.array_equal(vol, cur_voi.to_volume("uint8"))
+    box = vg.vois[0].bounding_box()
+    with pytest.raises(ValueError):
+        vg.vois[0].to_volume(box=box, out=buffer)
+
+
+def test_iter_volumes(long_data_file):
+    import numpy as np
+    import pytest
+    vg = voi.read_file(long_data_file)
+    arrays = set()
+    for cur_voi, vol in vg.iter_volumes("bool", buffers=2):
+        arrays.add(id(vol))
+        assert vol.dtype == np.bool_
+        assert np.array_equal(vol, cur_voi.to_volume("bool"))
+    assert len(arrays) == min(2, len(vg.vois))
+    with pytest.raises(ValueError):
+        list(vg.iter_volumes(buffers=0))
+
+
+def test_voi_geometry(long_data_filename):
+    import numpy as np
+    vg = voi.read_file(long_data_filename)
+    voi1 = vg.vois[0]
+    vol = voi1.to_volume()
+    assert voi1.volume_mm3() == vol.sum() * 8.0
+    coords = np.mean(np.nonzero(vol), axis=1)
+    assert np.allclose(voi1.center_of_mass(), coords)
+    assert np.allclose(
+        voi1.world_center_of_mass(),
+        vg.affine.dot(list(coords) + [1])[:3])
+    assert voi1.boundary_voxel_count() <= voi1.voxel_count
+    # The group's batched versions agree
+    assert np.allclose(vg.volumes_mm3()[0], voi1.volume_mm3())
+    assert np.allclose(vg.centers_of_mass()[0], voi1.center_of_mass())
+    assert np.allclose(
+        vg.world_centers_of_mass()[0], voi1.world_center_of_mass())
+    assert vg.bounding_boxes(2) == [v.bounding_box(2) for v in vg.vois]
+    # New VOIs' "VOI CoM" headers agree, even when empty
+    new_group = voi.VOIGroup.new(vg.shape, vg.voxel_dimensions)
+    made = voi.VOI.new(new_group, voi1.voxel_indexes, "copy")
+    assert np.allclose(
+        [float(c) for c in made.header['VOI CoM'].split(",")],
+        voi1.center_of_mass())
+    empty = voi.VOI.new(new_group, [], "empty")
+    assert np.isnan(
+        [float(c) for c in empty.header['VOI CoM'].split(",")]).all()
+    assert np.isnan(empty.center_of_mass()).all()
+    assert empty.bounding_box() is None
+    assert list(vg.boundary_voxel_counts()) == [
+        v.boundary_voxel_count() for v in vg.vois]
+
+
+def test_log_to_stderr():
+    voi.log_to_stderr()
+    count = len(voi.logger.handlers)
+    voi.log_to_stderr()
+    assert len(voi.logger.handlers) == count
+
+
+def test_parse_text_indexes():
+    indexes = voi._parse_text_indexes("12\r\n7\r\n 300\n", 3)
+    assert list(indexes) == [12, 7, 300]
+
+
+def test_parse_text_block_wrong_count():
+    import pytest
+    with pytest.raises(voi.VOIFileError):
+        voi._parse_text_indexes("1\n2\n", 3)
+
+
+def test_text_triple_parse_speedup():
+    # Compare against the line-at-a-time loop the block parser replaced.
+    import io
+    import time
+    import numpy as np
+    shape = voi.Triple(191, 236, 171)
+    count = 50000
+    rng = np.random.RandomState(0)
+    coords = np.column_stack([
+        rng.randint(0, dim, count) for dim in shape])
+    text = "".join(
+        "{0}, {1}, {2}\n".format(*row) for row in coords.tolist())
+
+    def loop_parse(stream):
+        out = np.zeros(count, dtype=np.int32)
+        for i in range(count):
+            x, y, z = [int(n) for n in stream.readline().strip().split(",")]
+            out[i] = (z * shape.x * shape.y) + (y * shape.x) + x
+        return out
+
+    start = time.time()
+    expected = loop_parse(io.StringIO(text))
+    loop_time = time.time() - start
+
+    start = time.time()
+    parsed = voi._parse_text_triples(
+        voi._read_text_block(io.StringIO(text), count), count, shape)
+    block_time = time.time() - start
+
+    assert np.array_equal(parsed, expected)
+    assert block_time < loop_time
+
+
+def test_scan_vois(long_data_file):
+    vg = voi.VOIGroup.from_io(long_data_file)
+    offsets = voi.scan_vois(vg, long_data_file)
+    assert len(offsets) == vg.voi_count
+    assert [o.header['VOI number'] for o in offsets] == ['1', '2', '3']
+    assert offsets[0].data_format == "LONG coordinate index"
+    assert offsets[1].voxel_count == 82
+
+
+def test_parse_voi_numbers():
+    assert voi.parse_voi_numbers(None) is None
+    assert voi.parse_voi_numbers("3,1") == [3, 1]
+
+
+def test_read_file_voi_numbers(long_data_filename, triple_data_filename):
+    import numpy as np
+    for filename in [long_data_filename, triple_data_filename]:
+        full = voi.read_file(filename)
+        some = voi.read_file(filename, voi_numbers=[3, 1])
+        assert [v.voi_number for v in some.vois] == ['3', '1']
+        assert np.array_equal(
+            some.vois[0].voxel_indexes, full.vois[2].voxel_indexes)
+        assert np.array_equal(
+            some.vois[1].voxel_indexes, full.vois[0].voxel_indexes)
+
+
+def test_read_file_bad_voi_number(long_data_filename):
+    import pytest
+    with pytest.raises(voi.VOIFileError):
+        voi.read_file(long_data_filename, voi_numbers=[4])
+
+
+def test_label_volume(long_data_file):
+    import numpy as np
+    vg = voi.read_file(long_data_file)
+    # VOI 3 is the union of VOIs 1 and 2
+    last = voi.label_volume(vg.vois, vg.shape)
+    assert last.shape == vg.shape
+    assert set(np.unique(last)) == set([0, 3])
+    first = voi.label_volume(vg.vois, vg.shape, overlap="first")
+    assert np.sum(first == 1) == vg.vois[0].voxel_count
+    assert np.sum(first == 2) == vg.vois[1].voxel_count
+    assert np.sum(first > 0) == np.sum(last > 0)
+
+
+def test_label_volume_overlap_error(long_data_file):
+    import pytest
+    vg = voi.read_file(long_data_file)
+    voi.label_volume(vg.vois[:2], vg.shape, overlap="error")
+    with pytest.raises(voi.VOIOverlapError):
+        voi.label_volume(vg.vois, vg.shape, overlap="error")
+
+
+def test_read_headers(long_data_filename, triple_data_filename):
+    for filename in [long_data_filename, triple_data_filename]:
+        full = voi.read_file(filename)
+        headers = voi.read_headers(filename)
+        assert list(headers.header.items()) == list(full.header.items())
+        assert len(headers.vois) == len(full.vois)
+        for h, f in zip(headers.vois, full.vois):
+            assert list(h.header.items()) == list(f.header.items())
+            assert h.voxel_indexes is None
+
+
+def test_iter_vois(triple_data_filename):
+    import numpy as np
+    full = voi.read_file(triple_data_filename)
+    streamed = list(voi.iter_vois(triple_data_filename))
+    assert len(streamed) == len(full.vois)
+    for s, f in zip(streamed, full.vois):
+        assert s.voi_number == f.voi_number
+        assert np.array_equal(s.voxel_indexes, f.voxel_indexes)
+    # The group doesn't hold on to streamed VOIs
+    assert streamed[0].voi_group.vois == []
+
+
+def test_iter_vois_numbers_and_affine(long_data_filename):
+    import numpy as np
+    affine = np.eye(4)
+    streamed = list(voi.iter_vois(long_data_filename, [2], affine))
+    assert [v.voi_number for v in streamed] == ['2']
+    assert streamed[0].affine is affine
+
+
+def test_group_from_labels():
+    import numpy as np
+    labels = np.zeros((4, 5, 6), dtype=np.int16)
+    labels[1, 2, 3] = 7
+    labels[0, 0, 1] = 2
+    labels[3, 4, 5] = 2
+    vg, values = voi.group_from_labels(labels, (1.0, 1.0, 2.0), {7: "seven"})
+    assert values == [2, 7]
+    assert [v.name for v in vg.vois] == ["label 2", "seven"]
+    for v, value in zip(vg.vois, values):
+        assert np.array_equal(
+            v.to_volume() > 0, labels == value)
+    assert vg.voxel_dimensions == voi.Triple(1.0, 1.0, 2.0)
+
+
+def test_write_file_round_trip(triple_data_filename, tmpdir):
+    import numpy as np
+    vg = voi.read_file(triple_data_filename)
+    filename = str(tmpdir.join("out.voi"))
+    for data_format in voi.DATA_FORMATS:
+        for byte_order in sorted(voi.BYTE_ORDER_TYPES):
+            voi.write_file(vg, filename, data_format, byte_order)
+            written = voi.read_file(filename)
+            assert written.header['Byte Order'] == byte_order
+            assert written.voi_count == vg.voi_count
+            for a, b in zip(vg.vois, written.vois):
+                assert b.header[voi.VOI.BEGIN_DATA] == data_format
+                assert a.name == b.name
+                assert np.array_equal(a.voxel_indexes, b.voxel_indexes)
+
+
+def test_write_file_same_bytes(long_data_filename, triple_data_filename):
+    import io
+    for filename, data_format in [
+            (long_data_filename, voi.LONG_INDEX),
+            (triple_data_filename, voi.TEXT_TRIPLE)]:
+        with open(filename, 'rb') as f:
+            original = f.read()
+        vg = voi.read_file(filename)
+        for other_format in voi.DATA_FORMATS:
+            for byte_order in sorted(voi.BYTE_ORDER_TYPES):
+                converted = io.BytesIO()
+                voi.write_file(vg, converted, other_format, byte_order)
+                converted.seek(0)
+                back = io.BytesIO()
+                voi.write_file(
+                    voi.read_file(converted), back, data_format,
+                    vg.byte_order)
+                assert back.getvalue() == original
+
+
+def test_write_file_new_headers(long_data_filename):
+    import io
+    vg = voi.read_file(long_data_filename)
+    # With VOIs missing, the file can't be written as read
+    del vg.vois[0]
+    out = io.BytesIO()
+    voi.write_file(vg, out)
+    out.seek(0)
+    written = voi.read_file(out)
+    assert written.voi_count == vg.voi_count - 1
+    assert [v.name for v in written.vois] == [v.name for v in vg.vois]
+
+
+def test_write_file_renumbers_vois(long_data_filename):
+    import io
+    vg = voi.read_file(long_data_filename)
+    vg.raw_header = None
+    del vg.vois[0]
+    out = io.BytesIO()
+    voi.write_file(vg, out)
+    text = out.getvalue().decode("latin-1")
+    assert "Number of VOIs = 2\r\n" in text
+    assert "Current VOI = 2\r\n" in text
+    out.seek(0)
+    written = voi.read_file(out)
+    assert [v.voi_number for v in written.vois] == ['1', '2']
+    for i in (1, 2):
+        number = text.index("VOI number = {0}\r\n".format(i))
+        end = text.index("End of VOI = {0}\r\n".format(i))
+        assert number < end
+        assert "VOI number" not in text[number + 1:end]
@@ -26,6 +26,7 @@ import numpy as np
 import tempfile
 import shutil
 import glob
+import json
 import os
 
 import pytest
@@ -60,6 +61,10 @@ def test_creates_files(long_data_file):
             out_dir)
         files = glob.glob(os.path.join(out_dir, "*"))
         assert voi_group.voi_count == len(files)
+        # The volumes are all made in one buffer; each must be cleared
+        for i, voi in enumerate(voi_group.vois):
+            data = nib.load(os.path.join(out_dir, "{0}.nii".format(i + 1)))
+            assert np.array_equal(data.get_data(), voi.to_volume())
     finally:
         shutil.rmtree(out_dir)
 
@@ -79,3 +84,321 @@ def test_setting_affine(long_data_file, sample_nii):
         assert np.array_equal(parent_nii.get_affine(), out_nii.get_affine())
     finally:
         shutil.rmtree(out_dir)
+
+
+def test_voi_numbers_option(long_data_filename):
+    out_dir = tempfile.mkdtemp()
+    try:
+        voi2nii.main([
+            '--voi-numbers=2',
+            '--pattern={voi_number}.nii',
+            '--out-dir={0}'.format(out_dir),
+            long_data_filename])
+        files = os.listdir(out_dir)
+        assert files == ['2.nii']
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def test_label_map(long_data_filename):
+    out_dir = tempfile.mkdtemp()
+    try:
+        voi2nii.main([
+            '--label-map=labels.nii.gz',
+            '--overlap=first',
+            '--out-dir={0}'.format(out_dir),
+            long_data_filename])
+        assert sorted(os.listdir(out_dir)) == ['labels.nii.gz', 'labels.tsv']
+        data = nib.load(os.path.join(out_dir, 'labels.nii.gz')).get_data()
+        assert set(np.unique(data)) == set([0, 1, 2])
+        with open(os.path.join(out_dir, 'labels.tsv')) as f:
+            lines = f.read().splitlines()
+        assert lines[0] == "index\tname"
+        assert lines[1] == "1\tcaudate L"
+        assert len(lines) == 4
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def test_label_map_overlap_error(long_data_filename):
+    out_dir = tempfile.mkdtemp()
+    try:
+        with pytest.raises(SystemExit):
+            voi2nii.main([
+                '--label-map=labels.nii',
+                '--overlap=error',
+                '--out-dir={0}'.format(out_dir),
+                long_data_filename])
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def test_native_writer_option(long_data_filename):
+    out_dir = tempfile.mkdtemp()
+    try:
+        voi2nii.main([
+            '--native-writer',
+            '--pattern={voi_number}.nii.gz',
+            '--out-dir={0}'.format(out_dir),
+            long_data_filename])
+        assert sorted(os.listdir(out_dir)) == [
+            '1.nii.gz', '2.nii.gz', '3.nii.gz']
+        out_nii = nib.load(os.path.join(out_dir, '1.nii.gz'))
+        assert np.sum(out_nii.get_data()) == 148
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def test_crop_option(long_data_filename):
+    out_dir = tempfile.mkdtemp()
+    try:
+        for native in [[], ['--native-writer']]:
+            voi2nii.main(native + [
+                '--crop',
+                '--crop-padding=1',
+                '--pattern=crop{0}-{{voi_number}}.nii'.format(len(native)),
+                '--out-dir={0}'.format(out_dir),
+                long_data_filename])
+        voi2nii.main([
+            '--pattern=full-{voi_number}.nii',
+            '--out-dir={0}'.format(out_dir),
+            long_data_filename])
+        full = nib.load(os.path.join(out_dir, 'full-1.nii'))
+        full_data = full.get_data()
+        for name in ['crop0-1.nii', 'crop1-1.nii']:
+            cropped = nib.load(os.path.join(out_dir, name))
+            data = cropped.get_data()
+            assert data.shape < full.shape
+            assert np.sum(data) == 148
+            # The one-voxel border is empty
+            assert np.sum(data[1:-1, 1:-1, 1:-1]) == 148
+            # Every voxel lands in the same place in the world
+            start = np.round(np.linalg.inv(full.get_affine()).dot(
+                cropped.get_affine())[:3, 3]).astype(int)
+            box = tuple(
+                slice(a, a + n) for a, n in zip(start, data.shape))
+            assert np.array_equal(full_data[box], data)
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def test_crop_label_map(long_data_filename):
+    out_dir = tempfile.mkdtemp()
+    try:
+        for name, extra in [('full', []), ('crop', ['--crop'])]:
+            voi2nii.main(extra + [
+                '--label-map={0}.nii'.format(name),
+                '--out-dir={0}'.format(out_dir),
+                long_data_filename])
+        full = nib.load(os.path.join(out_dir, 'full.nii')).get_data()
+        cropped = nib.load(os.path.join(out_dir, 'crop.nii')).get_data()
+        assert cropped.shape < full.shape
+        assert np.array_equal(
+            np.bincount(full.ravel())[1:], np.bincount(cropped.ravel())[1:])
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def test_incremental_option(
+        long_data_filename, triple_data_filename, caplog):
+    out_dir = tempfile.mkdtemp()
+    summaries = []
+
+    def run(*extra):
+        caplog.clear()
+        voi2nii.main(list(extra) + [
+            '--incremental',
+            '--pattern={cur_name}-{voi_number}.nii',
+            '--out-dir={0}'.format(out_dir),
+            long_data_filename,
+            triple_data_filename])
+        summaries.extend(
+            r.getMessage().split(" in ")[0] for r in caplog.records
+            if r.getMessage().startswith("Converted"))
+        with open(os.path.join(out_dir, '.voitools-manifest.json')) as f:
+            entries = json.load(f)['entries']
+        return dict(
+            (name, os.path.getmtime(os.path.join(out_dir, name)))
+            for name in entries)
+
+    try:
+        first = run()
+        assert len(first) == 10
+        for name in first:
+            os.utime(os.path.join(out_dir, name), (0, 0))
+        assert set(run().values()) == set([0])
+        os.remove(os.path.join(out_dir, sorted(first)[0]))
+        rebuilt = run()
+        assert [rebuilt[name] > 0 for name in sorted(first)] == (
+            [True] + [False] * 9)
+        # Changing the settings rebuilds everything
+        assert 0 not in run('--crop').values()
+        assert summaries == [
+            "Converted 2 of 2 files (10 VOIs)",
+            "Converted 2 of 2 files (0 VOIs)",
+            "Converted 2 of 2 files (1 VOIs)",
+            "Converted 2 of 2 files (10 VOIs)"]
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def test_incremental_label_map(
+        long_data_filename, triple_data_filename, caplog):
+    out_dir = tempfile.mkdtemp()
+    args = [
+        '--incremental',
+        '--label-map={cur_name}.nii',
+        '--overlap=first',
+        '--out-dir={0}'.format(out_dir),
+        long_data_filename,
+        triple_data_filename]
+    try:
+        voi2nii.main(args)
+        caplog.clear()
+        voi2nii.main(args)
+        messages = [r.getMessage() for r in caplog.records]
+        assert any(
+            m.startswith("Converted 2 of 2 files (0 VOIs)") for m in messages)
+        assert "Rebuilt 0 outputs, reused 2" in messages
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def test_batch_conversion(long_data_filename, triple_data_filename):
+    out_dir = tempfile.mkdtemp()
+    try:
+        voi2nii.main([
+            '--jobs=2',
+            '--pattern={cur_name}-{voi_number}.nii',
+            '--out-dir={0}'.format(out_dir),
+            long_data_filename,
+            triple_data_filename])
+        files = glob.glob(os.path.join(out_dir, "*"))
+        assert len(files) == 3 + 7
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def test_batch_reports_failures(long_data_filename):
+    out_dir = tempfile.mkdtemp()
+    try:
+        with pytest.raises(SystemExit):
+            voi2nii.main([
+                '--pattern={voi_number}.nii',
+                '--out-dir={0}'.format(out_dir),
+                str(os.path.join(out_dir, 'missing.voi')),
+                long_data_filename])
+        assert len(os.listdir(out_dir)) == 3
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def test_find_datafiles(long_data_filename):
+    data_dir = os.path.dirname(long_data_filename)
+    found = voi2nii.find_datafiles([data_dir])
+    assert [os.path.basename(f) for f in found] == ['long.voi', 'triples.voi']
+
+
+def test_stats_report(long_data_filename, capsys):
+    import json
+    out_dir = tempfile.mkdtemp()
+    try:
+        stats_file = os.path.join(out_dir, 'stats.json')
+        voi2nii.main([
+            '--stats',
+            '--stats-json={0}'.format(stats_file),
+            '--no-cache',
+            '--pattern={voi_number}.nii',
+            '--out-dir={0}'.format(out_dir),
+            long_data_filename])
+        out, err = capsys.readouterr()
+        assert "to_volume" in err
+        with open(stats_file) as f:
+            report = json.load(f)
+        phases = set(total['phase'] for total in report['summary'])
+        assert set(['group_header', 'voxel_data', 'to_volume',
+                    'nifti_header', 'write']) <= phases
+        writes = [e for e in report['events'] if e['phase'] == 'write']
+        assert len(writes) == 3
+        assert all(e['bytes_written'] > 0 for e in writes)
+        assert all(e['file'] == long_data_filename for e in writes)
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def test_resample_option(long_data_filename):
+    out_dir = tempfile.mkdtemp()
+    try:
+        voi_group = voitools.voi.read_file(long_data_filename)
+        parent_affine = voi_group.affine.copy()
+        parent_affine[:3, :3] *= 2
+        parent = os.path.join(out_dir, 'parent.nii')
+        nib.Nifti1Image(
+            np.zeros((40, 48, 34), dtype=np.int16),
+            parent_affine).to_filename(parent)
+        modes = [('nearest', []), ('fraction', ['--native-writer'])]
+        for mode, extra in modes:
+            voi2nii.main(extra + [
+                '--affine-parent={0}'.format(parent),
+                '--resample={0}'.format(mode),
+                '--pattern={0}-{{voi_number}}.nii'.format(mode),
+                '--out-dir={0}'.format(out_dir),
+                long_data_filename])
+            out_nii = nib.load(
+                os.path.join(out_dir, '{0}-1.nii'.format(mode)))
+            assert out_nii.shape == (40, 48, 34)
+            assert np.allclose(out_nii.get_affine(), parent_affine)
+        fraction = nib.load(os.path.join(out_dir, 'fraction-1.nii'))
+        assert fraction.get_data_dtype() == np.float32
+        # 148 2mm voxels make 18.5 4mm voxels' worth, give or take sampling
+        assert np.isclose(fraction.get_data().sum(), 148 / 8, rtol=0.1)
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def test_resample_needs_affine_parent(long_data_filename):
+    with pytest.raises(SystemExit):
+        voi2nii.main(['--resample=nearest', long_data_filename])
+
+
+def test_writers_option(long_data_filename):
+    out_dir = tempfile.mkdtemp()
+    try:
+        for writers in ['0', '3']:
+            for native in [[], ['--native-writer']]:
+                voi2nii.main(native + [
+                    '--writers={0}'.format(writers),
+                    '--max-queued-mb=1',
+                    '--pattern={0}{1}-{{voi_number}}.nii.gz'.format(
+                        writers, len(native)),
+                    '--out-dir={0}'.format(out_dir),
+                    long_data_filename])
+        assert len(os.listdir(out_dir)) == 12
+        for name in ['01-1', '30-1', '31-1']:
+            expected = nib.load(os.path.join(out_dir, '00-1.nii.gz'))
+            written = nib.load(os.path.join(out_dir, name + '.nii.gz'))
+            assert np.array_equal(expected.get_data(), written.get_data())
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def test_compress_options(long_data_filename):
+    out_dir = tempfile.mkdtemp()
+    try:
+        runs = [('1', []), ('9', []), ('9', ['--native-writer'])]
+        for level, native in runs:
+            voi2nii.main(native + [
+                '--compress-level={0}'.format(level),
+                '--compress-threads=2',
+                '--pattern={0}{1}-{{voi_number}}.nii.gz'.format(
+                    level, len(native)),
+                '--out-dir={0}'.format(out_dir),
+                long_data_filename])
+        fast = nib.load(os.path.join(out_dir, '10-3.nii.gz'))
+        for name in ['90-3', '91-3']:
+            small = nib.load(os.path.join(out_dir, name + '.nii.gz'))
+            assert np.array_equal(fast.get_data(), small.get_data())
+        assert (os.path.getsize(os.path.join(out_dir, '90-3.nii.gz')) <
+                os.path.getsize(os.path.join(out_dir, '10-3.nii.gz')))
+    finally:
+        shutil.rmtree(out_dir)
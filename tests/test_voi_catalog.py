@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+This contains tests for the voi_catalog script
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+
+from voitools.scripts import voi_catalog
+
+import pytest
+
+
+def test_voi_catalog_runs(capsys):
+    with pytest.raises(SystemExit):
+        voi_catalog.main(['--help'])
+    out, err = capsys.readouterr()
+    assert len(out) > 0
+    assert len(err) == 0
+
+
+def test_scan_and_query(
+        tmpdir, long_data_filename, triple_data_filename, capsys):
+    db = str(tmpdir.join("cat.db"))
+    voi_catalog.main(
+        ['scan', '--jobs=1', db, long_data_filename, triple_data_filename])
+    output = str(tmpdir.join("found.tsv"))
+    voi_catalog.main([
+        'query', '--name=caudate L', '--min-voxels=100',
+        '--output={0}'.format(output), db])
+    with open(output) as f:
+        lines = f.read().splitlines()
+    assert lines[0].split("\t") == list(voi_catalog.QUERY_COLUMNS)
+    assert len(lines) == 2
+    assert lines[1].split("\t")[1:] == ["1", "caudate L", "148", "1184.0"]
+    voi_catalog.main(['query', '--where=voxel_count < 0', db])
+    out, err = capsys.readouterr()
+    assert out.splitlines() == ["\t".join(voi_catalog.QUERY_COLUMNS)]
+
+
+def test_scan_failure_exits(tmpdir):
+    bad = tmpdir.join("bad.voi")
+    bad.write("not a VOI file")
+    with pytest.raises(SystemExit):
+        voi_catalog.main(['scan', str(tmpdir.join("cat.db")), str(bad)])
+
+
+def test_scan_missing_path_exits(tmpdir, long_data_filename):
+    from voitools import catalog
+    db = str(tmpdir.join("cat.db"))
+    with pytest.raises(SystemExit):
+        voi_catalog.main(
+            ['scan', db, long_data_filename, str(tmpdir.join("nowhere"))])
+    # The files that could be read were still committed
+    with catalog.Catalog(db) as cat:
+        assert len(cat.query()) == 3
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+This contains tests for the voi_convert script
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+import shutil
+
+from voitools import voi
+from voitools.scripts import voi_convert
+
+import pytest
+
+
+def test_voi_convert_runs(capsys):
+    with pytest.raises(SystemExit):
+        voi_convert.main(['--help'])
+    out, err = capsys.readouterr()
+    assert len(out) > 0
+    assert len(err) == 0
+
+
+def test_convert_and_back(triple_data_filename, tmpdir):
+    long_name = str(tmpdir.join("long.voi"))
+    voi_convert.main(['--check', triple_data_filename, long_name])
+    converted = voi.read_file(long_name)
+    assert all(
+        v.header[voi.VOI.BEGIN_DATA] == voi.LONG_INDEX
+        for v in converted.vois)
+    back_name = str(tmpdir.join("back.voi"))
+    voi_convert.main(['--format=text-triple', long_name, back_name])
+    with open(triple_data_filename, 'rb') as a, open(back_name, 'rb') as b:
+        assert a.read() == b.read()
+
+
+def test_convert_in_place(long_data_filename, tmpdir):
+    filename = str(tmpdir.join("data.voi"))
+    shutil.copy(long_data_filename, filename)
+    voi_convert.main(['--byte-order=LITTLE_ENDIAN', filename, filename])
+    converted = voi.read_file(filename)
+    assert converted.byte_order == "LITTLE_ENDIAN"
+    original = voi.read_file(long_data_filename)
+    for a, b in zip(original.vois, converted.vois):
+        assert (a.voxel_indexes == b.voxel_indexes).all()
+    assert tmpdir.listdir() == [tmpdir.join("data.voi")]
+
+
+def test_bad_format(long_data_filename, tmpdir):
+    with pytest.raises(SystemExit):
+        voi_convert.main(
+            ['--format=nifti', long_data_filename, str(tmpdir.join("x"))])
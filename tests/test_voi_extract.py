@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+This contains tests for the voi_extract script
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+
+import voitools
+from voitools.scripts import voi_extract
+
+import nibabel as nib
+import numpy as np
+
+import pytest
+
+
+@pytest.fixture
+def series_filename(long_data_filename, tmpdir):
+    shape = voitools.voi.read_headers(long_data_filename).shape
+    data = np.random.RandomState(0).rand(*(tuple(shape) + (4,)))
+    filename = str(tmpdir.join("series.nii"))
+    nib.Nifti1Image(data.astype(np.float32), np.eye(4)).to_filename(filename)
+    return filename
+
+
+def test_voi_extract_runs(capsys):
+    with pytest.raises(SystemExit):
+        voi_extract.main(['--help'])
+    out, err = capsys.readouterr()
+    assert len(out) > 0
+    assert len(err) == 0
+
+
+def test_voi_extract_writes_tsv(long_data_filename, series_filename, capsys):
+    voi_extract.main([
+        '--stats=mean,std', '--voi-numbers=2,1',
+        long_data_filename, series_filename])
+    out, err = capsys.readouterr()
+    lines = out.splitlines()
+    assert lines[0].split("\t") == [
+        "volume", "2_mean", "2_std", "1_mean", "1_std"]
+    assert len(lines) == 5
+
+
+def test_voi_extract_writes_npy(long_data_filename, series_filename, tmpdir):
+    output = str(tmpdir.join("out.npy"))
+    voi_extract.main([
+        '--stats=mean,median', '--output={0}'.format(output),
+        long_data_filename, series_filename])
+    values = np.load(output)
+    assert values.shape == (2, 4, 3)
+    data = nib.load(series_filename).get_data()
+    cur_voi = voitools.voi.read_file(long_data_filename).vois[0]
+    inside = data[cur_voi.to_volume().astype(bool)]
+    assert np.allclose(values[0, :, 0], inside.mean(axis=0))
+
+
+def test_unknown_statistic(long_data_filename, series_filename):
+    with pytest.raises(SystemExit) as e:
+        voi_extract.main(
+            ['--stats=mean,max', long_data_filename, series_filename])
+    assert e.value.code == 1
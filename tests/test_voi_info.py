@@ -42,3 +42,12 @@ def test_voitools_reads_triple_file(triple_data_filename, capsys):
     out, err = capsys.readouterr()
     assert len(out) > 0
     assert len(err) == 0
+
+
+def test_stats_table(long_data_filename, capsys):
+    voi_info.main(['--stats', long_data_filename])
+    out, err = capsys.readouterr()
+    rows = [line.split("\t") for line in out.splitlines()]
+    assert rows[0] == list(voi_info.STATS_COLUMNS)
+    assert len(rows) == 4
+    assert rows[1][:4] == ["1", "caudate L", "148", "1184"]
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+This contains tests for the voi_overlap script
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+
+from voitools.scripts import voi_overlap
+
+import csv
+import io
+
+import pytest
+
+
+def test_voi_overlap_runs(capsys):
+    with pytest.raises(SystemExit):
+        voi_overlap.main(['--help'])
+    out, err = capsys.readouterr()
+    assert len(out) > 0
+    assert len(err) == 0
+
+
+def test_one_group(long_data_filename, capsys):
+    voi_overlap.main([long_data_filename])
+    out, err = capsys.readouterr()
+    rows = list(csv.reader(io.StringIO(out)))
+    assert rows[0] == ["", "1 caudate L", "2 caudate R", "3 caudate both"]
+    assert [row[0] for row in rows[1:]] == rows[0][1:]
+    assert rows[1][1] == "1" and rows[1][2] == "0"
+
+
+def test_two_groups(long_data_filename, tmpdir):
+    output = str(tmpdir.join("overlap.csv"))
+    voi_overlap.main([
+        '--measure=intersection', '--output={0}'.format(output),
+        long_data_filename, long_data_filename])
+    with open(output) as f:
+        rows = list(csv.reader(f))
+    assert rows[3][1:] == ["148", "82", "230"]
+
+
+def test_different_grids(long_data_filename, triple_data_filename):
+    with pytest.raises(SystemExit):
+        voi_overlap.main([long_data_filename, triple_data_filename])
+
+
+def test_unknown_measure(long_data_filename):
+    with pytest.raises(SystemExit) as e:
+        voi_overlap.main(['--measure=overlap', long_data_filename])
+    assert e.value.code == 1
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+An on-disk cache of parsed VOI group files. Each source file gets one .npz
+file in the cache directory, holding its headers and voxel indexes; loading
+that is much faster than parsing text voxel data again. Groups stored as
+"LONG coordinate index" are read straight from a memory map, which is
+faster than the cache, so they aren't cached.
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+import hashlib
+import json
+import os
+import tempfile
+
+from voitools import lazy
+from voitools import voi
+from voitools.vendor.ordereddict import OrderedDict
+
+np = lazy.module("numpy")
+
+logger = voi.logger
+
+CACHE_DIR_ENV = "VOITOOLS_CACHE_DIR"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def default_cache_dir():
+    if os.environ.get(CACHE_DIR_ENV):
+        return os.environ[CACHE_DIR_ENV]
+    base = os.environ.get(
+        "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "voitools")
+
+
+def file_digest(filename):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class VOICache(object):
+    """
+    Cached entries are checked against the source file's size and mtime. If
+    only the mtime has changed, we compare content hashes before deciding
+    the entry is stale. When the cache grows past max_bytes, the least
+    recently used entries are removed. Files bigger than max_bytes, and
+    groups whose voxel data is all binary, aren't stored.
+    """
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        super(VOICache, self).__init__()
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    SUFFIX = ".npz"
+
+    def read_file(self, filename, voi_numbers=None):
+        """
+        Like voi.read_file(), but uses and fills the cache. Partial reads
+        (with voi_numbers) are served from the cache, but aren't stored.
+        """
+        voi_group = self.load(filename)
+        if voi_group is None:
+            if voi_numbers is not None:
+                return voi.read_file(filename, voi_numbers)
+            voi_group = voi.read_file(filename)
+            try:
+                self.store(filename, voi_group)
+            except (IOError, OSError, ValueError) as e:
+                logger.warning("Can't cache %s: %s", filename, e)
+            return voi_group
+        if voi_numbers is None:
+            return voi_group
+        return voi.select_vois(voi_group, voi_numbers)
+
+    def iter_vois(self, filename, voi_numbers=None, affine=None):
+        """
+        Like voi.iter_vois(), but uses and fills the cache. To fill it, each
+        VOI's voxel indexes are written to a spool file in the cache
+        directory as it's yielded, so the VOIs themselves can be freed.
+        """
+        voi_group = self.load(filename)
+        if voi_group is not None:
+            if voi_numbers is not None:
+                voi_group = voi.select_vois(voi_group, voi_numbers)
+            voi_group.set_affine(affine)
+            for cur_voi in voi_group.vois:
+                yield cur_voi
+            return
+        if voi_numbers is not None:
+            for cur_voi in voi.iter_vois(filename, voi_numbers, affine):
+                yield cur_voi
+            return
+        spool = None
+        if self.__fits(filename):
+            spool = self.__open_spool(filename)
+        try:
+            for cur_voi in voi.iter_vois(filename, affine=affine):
+                if spool is not None and not spool.counts and (
+                        cur_voi.data_format == voi.LONG_INDEX):
+                    # Spamalize writes every VOI in a group the same way,
+                    # so we won't be caching this one.
+                    spool.close()
+                    spool = None
+                if spool is not None:
+                    spool = self.__spool_voi(filename, spool, cur_voi)
+                yield cur_voi
+            if spool is not None and spool.counts:
+                try:
+                    self.__write_entry(filename, *spool.contents())
+                except (IOError, OSError, ValueError) as e:
+                    logger.warning("Can't cache %s: %s", filename, e)
+        finally:
+            if spool is not None:
+                spool.close()
+
+    def __open_spool(self, filename):
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            return _Spool(self.cache_dir)
+        except (IOError, OSError) as e:
+            logger.warning("Can't cache %s: %s", filename, e)
+            return None
+
+    def __spool_voi(self, filename, spool, cur_voi):
+        """
+        Add cur_voi to spool; if that fails, give up caching and return
+        None.
+        """
+        try:
+            spool.add(cur_voi)
+            return spool
+        except (IOError, OSError, ValueError) as e:
+            logger.warning("Can't cache %s: %s", filename, e)
+            spool.close()
+            return None
+
+    def entry_filename(self, filename):
+        key = hashlib.sha1(
+            os.path.abspath(filename).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + self.SUFFIX)
+
+    def load(self, filename):
+        """
+        Returns the cached VOIGroup for filename, or None if there isn't a
+        current one.
+        """
+        entry = self.entry_filename(filename)
+        if not os.path.exists(entry):
+            return None
+        try:
+            with np.load(entry, allow_pickle=False) as data:
+                source = json.loads(str(data['source']))
+                if not self.__is_current(filename, source):
+                    logger.debug("Cache entry for %s is stale", filename)
+                    return None
+                voi_group = self.__group_from_npz(data)
+        except (IOError, OSError, ValueError, KeyError) as e:
+            logger.debug("Can't read cache entry %s: %s", entry, e)
+            return None
+        # A worker may have evicted the entry since, or the cache may be
+        # read-only; either way, we have the data.
+        try:
+            if not source['mtime'] == os.stat(filename).st_mtime:
+                # Same contents, new mtime: refresh the entry so we don't
+                # hash the file again next time.
+                self.store(filename, voi_group)
+            else:
+                os.utime(entry, None)
+        except (IOError, OSError, ValueError) as e:
+            logger.warning("Can't update cache entry %s: %s", entry, e)
+        logger.debug("Read %s from cache", filename)
+        return voi_group
+
+    def store(self, filename, voi_group):
+        """
+        Cache voi_group, read from filename -- unless it's too big, or all
+        its voxel data is binary.
+        """
+        if not self.__fits(filename):
+            logger.debug("Not caching %s: it's too big", filename)
+            return
+        if all(v.data_format == voi.LONG_INDEX for v in voi_group.vois):
+            logger.debug("Not caching %s: its voxel data is binary", filename)
+            return
+        if voi_group.vois:
+            indexes = np.concatenate(
+                [v.voxel_indexes for v in voi_group.vois])
+        else:
+            indexes = np.zeros(0, dtype=voi_group.data_type_string)
+        self.__write_entry(
+            filename,
+            voi_group.header,
+            [v.header for v in voi_group.vois],
+            [len(v.voxel_indexes) for v in voi_group.vois],
+            indexes)
+
+    def __write_entry(
+            self, filename, group_header, voi_headers, counts, indexes):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        st = os.stat(filename)
+        source = {
+            'path': os.path.abspath(filename),
+            'size': st.st_size,
+            'mtime': st.st_mtime,
+            'sha1': file_digest(filename),
+        }
+        fd, tmp_name = tempfile.mkstemp(
+            suffix=self.SUFFIX, dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(
+                    f,
+                    source=np.array(json.dumps(source)),
+                    group_header=np.array(
+                        json.dumps(list(group_header.items()))),
+                    voi_headers=np.array(json.dumps(
+                        [list(h.items()) for h in voi_headers])),
+                    counts=np.array(counts, dtype=np.int64),
+                    indexes=indexes)
+            os.rename(tmp_name, self.entry_filename(filename))
+        except Exception:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in
+        max_bytes.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(self.SUFFIX):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            st = os.stat(path)
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            logger.debug("Evicting cache entry %s", path)
+            os.remove(path)
+            total -= size
+
+    def __fits(self, filename):
+        try:
+            return os.path.getsize(filename) <= self.max_bytes
+        except OSError:
+            return False
+
+    def __is_current(self, filename, source):
+        st = os.stat(filename)
+        if not st.st_size == source['size']:
+            return False
+        if st.st_mtime == source['mtime']:
+            return True
+        return file_digest(filename) == source['sha1']
+
+    def __group_from_npz(self, data):
+        voi_group = voi.VOIGroup(OrderedDict(
+            json.loads(str(data['group_header']))))
+        voi_headers = json.loads(str(data['voi_headers']))
+        indexes = data['indexes']
+        bounds = np.concatenate([[0], np.cumsum(data['counts'])])
+        for i, header in enumerate(voi_headers):
+            voi.VOI(
+                voi_group,
+                OrderedDict(header),
+                indexes[bounds[i]:bounds[i + 1]])
+        return voi_group
+
+
+class _Spool(object):
+    """
+    The headers of streamed VOIs, with their voxel indexes written to a
+    temporary file as int64, so they needn't be kept in memory until the
+    group can be cached.
+    """
+    SPOOL_DTYPE = '<i8'
+
+    def __init__(self, cache_dir):
+        super(_Spool, self).__init__()
+        fd, self.filename = tempfile.mkstemp(suffix=".spool", dir=cache_dir)
+        self.file = os.fdopen(fd, 'wb')
+        self.group_header = None
+        self.voi_headers = []
+        self.counts = []
+
+    def add(self, cur_voi):
+        if self.group_header is None:
+            self.group_header = cur_voi.voi_group.header
+        indexes = np.asarray(cur_voi.voxel_indexes, dtype=self.SPOOL_DTYPE)
+        self.file.write(indexes.tobytes())
+        self.voi_headers.append(cur_voi.header)
+        self.counts.append(len(indexes))
+
+    def contents(self):
+        """
+        (group header, VOI headers, counts, indexes), with the indexes
+        mapped from the spool file.
+        """
+        self.file.close()
+        if sum(self.counts):
+            indexes = np.memmap(
+                self.filename, dtype=self.SPOOL_DTYPE, mode='r')
+        else:
+            indexes = np.zeros(0, dtype=self.SPOOL_DTYPE)
+        return self.group_header, self.voi_headers, self.counts, indexes
+
+    def close(self):
+        self.file.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
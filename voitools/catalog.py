@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+A SQLite catalog of VOI group files: their headers, and for each VOI, its
+size and bounding box. Files are parsed once, in parallel, and only parsed
+again when their size or mtime changes; after that, finding VOIs is an
+indexed query. The voi_summary view joins each VOI with its file.
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+
+from voitools import voi
+
+logger = voi.logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    cur_name TEXT,
+    base_name TEXT,
+    x_dim INTEGER, y_dim INTEGER, z_dim INTEGER,
+    x_pixdim REAL, y_pixdim REAL, z_pixdim REAL,
+    voi_count INTEGER,
+    header TEXT
+);
+CREATE TABLE IF NOT EXISTS vois (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files (id),
+    voi_number INTEGER NOT NULL,
+    name TEXT,
+    voxel_count INTEGER NOT NULL,
+    volume_mm3 REAL NOT NULL,
+    x_start INTEGER, y_start INTEGER, z_start INTEGER,
+    x_stop INTEGER, y_stop INTEGER, z_stop INTEGER,
+    header TEXT
+);
+CREATE INDEX IF NOT EXISTS vois_file_id ON vois (file_id);
+CREATE INDEX IF NOT EXISTS vois_name ON vois (name, voxel_count);
+CREATE INDEX IF NOT EXISTS vois_voxel_count ON vois (voxel_count);
+CREATE VIEW IF NOT EXISTS voi_summary AS
+    SELECT files.path, files.cur_name, files.base_name, vois.*
+    FROM vois JOIN files ON vois.file_id = files.id;
+"""
+
+FILE_COLUMNS = (
+    'path', 'size', 'mtime', 'cur_name', 'base_name',
+    'x_dim', 'y_dim', 'z_dim', 'x_pixdim', 'y_pixdim', 'z_pixdim',
+    'voi_count', 'header')
+VOI_COLUMNS = (
+    'voi_number', 'name', 'voxel_count', 'volume_mm3',
+    'x_start', 'y_start', 'z_start', 'x_stop', 'y_stop', 'z_stop',
+    'header')
+
+# Commit after this many files, so an interrupted scan keeps its work
+COMMIT_FILES = 500
+
+
+def find_voi_files(paths):
+    """
+    Absolute paths of the .voi files in paths: files are taken as they are,
+    and directories are searched recursively. Returns (found, missing),
+    where missing are the paths that don't exist; they're logged.
+    """
+    found = []
+    missing = []
+    for path in paths:
+        if not os.path.exists(path):
+            logger.error("Can't find {0}".format(path))
+            missing.append(path)
+            continue
+        if not os.path.isdir(path):
+            found.append(os.path.abspath(path))
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            found.extend(
+                os.path.abspath(os.path.join(dirpath, name))
+                for name in sorted(filenames) if name.endswith(".voi"))
+    return found, missing
+
+
+def summarize_file(filename):
+    """
+    The catalog rows for one VOI group file: a dict for the file, and a
+    list of dicts, one per VOI.
+    """
+    st = os.stat(filename)
+    voi_group = voi.read_file(filename)
+    file_row = {
+        'path': _path_text(filename),
+        'size': st.st_size,
+        'mtime': st.st_mtime,
+        'cur_name': _text(voi_group.cur_name),
+        'base_name': _text(voi_group.base_name),
+        'voi_count': len(voi_group.vois),
+        'header': _header_json(voi_group.header),
+    }
+    for axis, dim, pixdim in zip(
+            "xyz", voi_group.shape, voi_group.voxel_dimensions):
+        file_row['{0}_dim'.format(axis)] = dim
+        file_row['{0}_pixdim'.format(axis)] = pixdim
+    return file_row, [_summarize_voi(v) for v in voi_group.vois]
+
+
+def _summarize_voi(cur_voi):
+    voxel_count = len(cur_voi.voxel_indexes)
+    row = {
+        'voi_number': int(cur_voi.voi_number),
+        'name': _text(cur_voi.name),
+        'voxel_count': voxel_count,
+        'volume_mm3': cur_voi.volume_mm3(),
+        'header': _header_json(cur_voi.header),
+    }
+    box = cur_voi.bounding_box()
+    for i, axis in enumerate("xyz"):
+        row['{0}_start'.format(axis)] = None if box is None else box.start[i]
+        row['{0}_stop'.format(axis)] = None if box is None else box.stop[i]
+    return row
+
+
+def _summarize_task(filename):
+    """
+    Worker for Catalog.scan(): returns (filename, summary or None, error
+    message or None).
+    """
+    try:
+        return (filename, summarize_file(filename), None)
+    except Exception as e:
+        logger.debug("Error reading {0}".format(filename), exc_info=True)
+        return (filename, None, str(e) or e.__class__.__name__)
+
+
+def _text(value):
+    # Headers are read as bytes on Python 2; they're Latin-1, near enough.
+    if isinstance(value, bytes):
+        return value.decode("latin-1")
+    return value
+
+
+def _path_text(path):
+    if isinstance(path, bytes):
+        return path.decode(sys.getfilesystemencoding() or "utf-8")
+    return path
+
+
+def _header_json(header):
+    return json.dumps([[_text(k), _text(v)] for k, v in header.items()])
+
+
+class Catalog(object):
+    def __init__(self, filename):
+        """
+        Open (or make) the catalog database in filename. Use as a context
+        manager, or call close() when done.
+        """
+        super(Catalog, self).__init__()
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def close(self):
+        self.connection.close()
+
+    def scan(self, paths, jobs=0):
+        """
+        Bring the catalog up to date with the .voi files in paths, parsing
+        only new and changed files, in jobs worker processes (0 means one
+        per CPU). Files under paths that have gone away are dropped.
+        Missing and unreadable files are logged and skipped. Returns (files
+        added or updated, files unchanged, files that failed).
+        """
+        filenames, missing = find_voi_files(paths)
+        stale, unstatable = self.stale_files(filenames)
+        self.remove_missing(paths, filenames)
+        if jobs == 1 or len(stale) < 2:
+            failed = self.__add_results(_summarize_task(f) for f in stale)
+        else:
+            pool = multiprocessing.Pool(jobs or None)
+            try:
+                failed = self.__add_results(
+                    pool.imap_unordered(_summarize_task, stale, 8))
+            finally:
+                pool.close()
+                pool.join()
+        self.connection.commit()
+        unchanged = len(filenames) - len(stale) - len(unstatable)
+        return (
+            len(stale) - failed, unchanged,
+            failed + len(unstatable) + len(missing))
+
+    def __add_results(self, results):
+        """
+        Add the results of _summarize_task(); returns how many failed.
+        """
+        failed = 0
+        for i, (filename, summary, error) in enumerate(results):
+            if summary is None:
+                logger.error("Can't read {0}: {1}".format(filename, error))
+                failed += 1
+                continue
+            self.add(*summary)
+            if (i + 1) % COMMIT_FILES == 0:
+                self.connection.commit()
+        return failed
+
+    def stale_files(self, filenames):
+        """
+        Those of filenames that aren't in the catalog, or whose size or
+        mtime has changed since they were added. Returns (stale, failed),
+        where failed are the files that can't be stat()ed (say, deleted
+        since they were found); they're logged.
+        """
+        known = dict(
+            (path, (size, mtime)) for path, size, mtime in
+            self.connection.execute("SELECT path, size, mtime FROM files"))
+        stale = []
+        failed = []
+        for filename in filenames:
+            try:
+                st = os.stat(filename)
+            except OSError as e:
+                logger.error("Can't read {0}: {1}".format(filename, e))
+                failed.append(filename)
+                continue
+            if not known.get(_path_text(filename)) == (
+                    st.st_size, st.st_mtime):
+                stale.append(filename)
+        return stale, failed
+
+    def add(self, file_row, voi_rows):
+        """
+        Add one file's rows (from summarize_file()), replacing any already
+        there for its path.
+        """
+        self.remove(file_row['path'])
+        cursor = self.connection.execute(
+            "INSERT INTO files ({0}) VALUES ({1})".format(
+                ", ".join(FILE_COLUMNS), ", ".join("?" * len(FILE_COLUMNS))),
+            [file_row[c] for c in FILE_COLUMNS])
+        file_id = cursor.lastrowid
+        self.connection.executemany(
+            "INSERT INTO vois (file_id, {0}) VALUES (?, {1})".format(
+                ", ".join(VOI_COLUMNS), ", ".join("?" * len(VOI_COLUMNS))),
+            [[file_id] + [row[c] for c in VOI_COLUMNS] for row in voi_rows])
+
+    def remove(self, path):
+        self.connection.execute(
+            "DELETE FROM vois WHERE file_id IN "
+            "(SELECT id FROM files WHERE path = ?)", [path])
+        self.connection.execute("DELETE FROM files WHERE path = ?", [path])
+
+    def remove_missing(self, paths, filenames):
+        """
+        Drop the catalogued files in or under paths that aren't in
+        filenames.
+        """
+        roots = [_path_text(os.path.abspath(p)) for p in paths]
+        present = set(_path_text(f) for f in filenames)
+        catalogued = [
+            row[0] for row in self.connection.execute(
+                "SELECT path FROM files")]
+        for path in catalogued:
+            under = any(
+                path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+                for root in roots)
+            if under and path not in present:
+                logger.debug("Dropping {0} from the catalog".format(path))
+                self.remove(path)
+
+    def query(
+            self, name=None, min_voxels=None, max_voxels=None, where=None,
+            columns=("path", "voi_number", "name", "voxel_count",
+                     "volume_mm3")):
+        """
+        Find VOIs in the voi_summary view, by exact name, number of voxels,
+        and any other SQL condition in where (eg, "name LIKE 'caudate%'").
+        Returns a list of tuples of columns, ordered by path and VOI number.
+        """
+        conditions = []
+        params = []
+        if name is not None:
+            conditions.append("name = ?")
+            params.append(name)
+        if min_voxels is not None:
+            conditions.append("voxel_count >= ?")
+            params.append(min_voxels)
+        if max_voxels is not None:
+            conditions.append("voxel_count <= ?")
+            params.append(max_voxels)
+        if where:
+            conditions.append("({0})".format(where))
+        sql = "SELECT {0} FROM voi_summary".format(", ".join(columns))
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY path, voi_number"
+        return list(self.connection.execute(sql, params))
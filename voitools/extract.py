@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+Summarize 4D images (eg, fMRI or PET time series) within VOIs. Rather than
+building a mask for each VOI, the voxels of every VOI are gathered straight
+from the image by their voxel indexes, a chunk of time points at a time, so
+the image never has to be in memory all at once.
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+from voitools import lazy
+from voitools.vendor.ordereddict import OrderedDict
+
+nib = lazy.module("nibabel")
+np = lazy.module("numpy")
+
+STATISTICS = ("mean", "median", "std")
+
+# Roughly how many voxels we read from the image at a time
+CHUNK_VOXELS = 16 * 1024 * 1024
+
+
+def load_image(filename):
+    """
+    Open a nifti image without reading its data. Uncompressed images are
+    memory-mapped, and gzipped ones are kept open so reading them a chunk at
+    a time doesn't start decompressing from the beginning every time.
+    """
+    return nib.load(filename, mmap=True, keep_file_open=True)
+
+
+def extract_file(vois, filename, statistics=("mean",), chunk_volumes=None):
+    """
+    Like extract(), with the data read from the image in filename, which
+    must be on the same grid as vois.
+    """
+    img = load_image(filename)
+    vois = list(vois)
+    if vois and not tuple(img.shape[:3]) == tuple(vois[0].shape):
+        raise ValueError(
+            "{0} has shape {1}, but the VOIs have shape {2}".format(
+                filename, tuple(img.shape[:3]), tuple(vois[0].shape)))
+    return extract(vois, img.dataobj, statistics, chunk_volumes)
+
+
+def extract(vois, data, statistics=("mean",), chunk_volumes=None):
+    """
+    Compute statistics of data within each VOI at each time point. data is
+    a 3D or 4D array (x, y, z[, time]) or anything that can be sliced like
+    one, such as a nibabel image's dataobj. It's read chunk_volumes time
+    points at a time; by default, as many as make up about CHUNK_VOXELS
+    voxels. Returns an OrderedDict mapping each statistic to a
+    (time points, VOIs) array. VOIs with no voxels get NaN.
+    """
+    for stat in statistics:
+        if stat not in STATISTICS:
+            raise ValueError("statistics must be among {0}".format(
+                ", ".join(STATISTICS)))
+    shape = tuple(data.shape)
+    if len(shape) not in (3, 4):
+        raise ValueError("data must be 3D or 4D, not {0}D".format(len(shape)))
+    volume_voxels = int(np.prod(shape[:3]))
+    time_points = shape[3] if len(shape) == 4 else 1
+    if chunk_volumes is None:
+        chunk_volumes = max(1, CHUNK_VOXELS // volume_voxels)
+    indexes, counts = _concatenate_indexes(vois, volume_voxels)
+    results = OrderedDict(
+        (stat, np.empty((time_points, len(counts)))) for stat in statistics)
+    for start in range(0, time_points, chunk_volumes):
+        stop = min(start + chunk_volumes, time_points)
+        if len(shape) == 4:
+            chunk = np.asarray(data[..., start:stop])
+        else:
+            chunk = np.asarray(data)[..., np.newaxis]
+        # Image data is in fortran order; for a whole slab of volumes this
+        # reshape is a view.
+        voxels = chunk.reshape((volume_voxels, stop - start), order='F')
+        gathered = voxels[indexes].astype(np.float64)
+        for stat, values in _summarize(gathered, counts, statistics).items():
+            results[stat][start:stop] = values.T
+    return results
+
+
+def _concatenate_indexes(vois, volume_voxels):
+    """
+    Returns all the VOIs' voxel indexes, one VOI after another, and the
+    number of voxels in each VOI.
+    """
+    index_lists = [np.asarray(v.voxel_indexes, dtype=np.intp) for v in vois]
+    counts = np.array([len(i) for i in index_lists], dtype=np.intp)
+    if not index_lists:
+        return np.zeros(0, dtype=np.intp), counts
+    indexes = np.concatenate(index_lists)
+    if len(indexes) and (indexes.min() < 0 or indexes.max() >= volume_voxels):
+        raise ValueError("voxel indexes are outside the image")
+    return indexes, counts
+
+
+def _summarize(gathered, counts, statistics):
+    """
+    Compute statistics for each run of counts[i] rows of gathered, which is
+    (voxels, time points). Returns an OrderedDict of (VOIs, time points)
+    arrays.
+    """
+    nonempty = counts > 0
+    starts = (np.cumsum(counts) - counts)[nonempty]
+    sizes = counts[nonempty][:, np.newaxis]
+    blank = np.full((len(counts), gathered.shape[1]), np.nan)
+    means = blank.copy()
+    if len(starts):
+        # Empty VOIs are left out of starts, so each reduceat segment runs
+        # exactly to the start of the next nonempty VOI.
+        means[nonempty] = np.add.reduceat(gathered, starts, axis=0) / sizes
+    out = OrderedDict()
+    for stat in statistics:
+        values = blank.copy()
+        if stat == "mean":
+            values = means
+        elif stat == "std" and len(starts):
+            deviations = gathered - np.repeat(
+                means[nonempty], counts[nonempty], axis=0)
+            values[nonempty] = np.sqrt(np.add.reduceat(
+                deviations * deviations, starts, axis=0) / sizes)
+        elif stat == "median":
+            stop = 0
+            for i, count in enumerate(counts):
+                start, stop = stop, stop + count
+                if count:
+                    values[i] = np.median(gathered[start:stop], axis=0)
+        out[stat] = values
+    return out
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+Sizes, centres and boundaries of VOIs, worked out from their voxel indexes
+(in fortran order) rather than from volumes. Each function takes a list of
+index arrays, all on a grid of the same shape, and does them all at once;
+VOI and VOIGroup have methods that call these.
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+from voitools import lazy
+
+np = lazy.module("numpy")
+
+
+def _concatenate(index_lists):
+    """
+    All of index_lists end to end, the number of each list each voxel came
+    from, and the length of each list.
+    """
+    counts = np.array([len(indexes) for indexes in index_lists], dtype=np.intp)
+    if not counts.sum():
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty.astype(np.intp), counts
+    indexes = np.concatenate(
+        [np.asarray(indexes, dtype=np.int64) for indexes in index_lists])
+    labels = np.repeat(np.arange(len(index_lists)), counts)
+    return indexes, labels, counts
+
+
+def _coords(indexes, shape):
+    return np.array(np.unravel_index(indexes, tuple(shape), order='F'))
+
+
+def centers_of_mass(index_lists, shape):
+    """
+    The mean voxel coordinates of each list, as an (n, 3) array; NaN for
+    empty lists.
+    """
+    indexes, labels, counts = _concatenate(index_lists)
+    coords = _coords(indexes, shape)
+    centers = np.full((len(index_lists), 3), np.nan)
+    found = counts > 0
+    for axis in range(3):
+        sums = np.bincount(
+            labels, weights=coords[axis], minlength=len(index_lists))
+        centers[found, axis] = sums[found] / counts[found]
+    return centers
+
+
+def world_coordinates(voxel_coords, affine):
+    """
+    (n, 3) voxel coordinates, in world space.
+    """
+    affine = np.asarray(affine, dtype=np.float64)
+    return voxel_coords.dot(affine[:3, :3].T) + affine[:3, 3]
+
+
+def bounding_boxes(index_lists, shape, padding=0):
+    """
+    The first and last voxel coordinates of each list, along each axis:
+    two (n, 3) integer arrays, starts and stops, with stops one past the
+    last voxel. Boxes are grown by padding voxels on each side, but not
+    past the edges of the grid. Empty lists get start == stop == 0.
+    """
+    indexes, labels, counts = _concatenate(index_lists)
+    coords = _coords(indexes, shape)
+    starts = np.zeros((len(index_lists), 3), dtype=np.intp)
+    stops = np.zeros((len(index_lists), 3), dtype=np.intp)
+    found = counts > 0
+    if not found.any():
+        return starts, stops
+    offsets = (np.cumsum(counts) - counts)[found]
+    for axis in range(3):
+        starts[found, axis] = np.maximum(
+            np.minimum.reduceat(coords[axis], offsets) - padding, 0)
+        stops[found, axis] = np.minimum(
+            np.maximum.reduceat(coords[axis], offsets) + 1 + padding,
+            shape[axis])
+    return starts, stops
+
+
+def boundary_counts(index_lists, shape):
+    """
+    How many voxels in each list have a face neighbour that isn't in the
+    list (or is off the grid). Repeated voxels are counted once.
+
+    Every voxel is keyed by its list's number and its index; a voxel is on
+    the boundary unless all six of its neighbours' keys are found among the
+    sorted keys.
+    """
+    shape = tuple(int(n) for n in shape)
+    grid_size = int(np.prod(shape))
+    indexes, labels, counts = _concatenate(index_lists)
+    keys = np.unique(labels.astype(np.int64) * grid_size + indexes)
+    labels = keys // grid_size
+    coords = _coords(keys % grid_size, shape)
+    interior = np.ones(len(keys), dtype=bool)
+    stride = 1
+    for axis in range(3):
+        for step in (-1, 1):
+            on_grid = (coords[axis] + step >= 0) & (
+                coords[axis] + step < shape[axis])
+            neighbours = keys[on_grid] + step * stride
+            positions = np.searchsorted(keys, neighbours)
+            positions[positions == len(keys)] = 0
+            found = np.zeros(len(keys), dtype=bool)
+            found[on_grid] = keys[positions] == neighbours
+            interior &= found
+        stride *= shape[axis]
+    return np.bincount(labels[~interior], minlength=len(index_lists))
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+Put off importing heavy modules (numpy, nibabel) until they're used, so the
+command-line tools start quickly when they don't need them -- say, for
+voi_info printing headers, or --help. Write
+
+    np = lazy.module("numpy")
+
+instead of "import numpy as np", and use np as usual, though not at import
+time (eg, in default arguments).
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stands in for a module, importing it the first time one of its
+    attributes is used. Then it copies the module's attributes, so looking
+    them up is as fast as on the module itself.
+    """
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def module(name):
+    return LazyModule(str(name))
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+A record of the files written to an output directory, and what they were
+made from, so unchanged outputs don't have to be made again. Each entry is
+a JSON-able dict (say, a digest of the VOIs plus the settings used), keyed
+by the output's name in the directory.
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+import hashlib
+import json
+import os
+import tempfile
+
+from voitools import lazy
+from voitools import voi
+
+np = lazy.module("numpy")
+
+logger = voi.logger
+
+MANIFEST_NAME = ".voitools-manifest.json"
+
+
+def voi_digest(vois):
+    """
+    A hash of the headers and voxel indexes of vois. It doesn't depend on
+    the byte order or format the voxels were stored in.
+    """
+    h = hashlib.sha1()
+    for cur_voi in vois:
+        h.update(json.dumps(list(cur_voi.header.items())).encode("utf-8"))
+        indexes = np.asarray(cur_voi.voxel_indexes).astype('<i4')
+        h.update(np.array(len(indexes), dtype='<i8').tobytes())
+        h.update(indexes.tobytes())
+    return h.hexdigest()
+
+
+class Manifest(object):
+    """
+    entries are as loaded; updates holds the entries for outputs made since.
+    rebuilt and reused count outputs that were made and skipped.
+    """
+    def __init__(self, out_dir, entries=None):
+        super(Manifest, self).__init__()
+        self.out_dir = out_dir
+        self.entries = entries or {}
+        self.updates = {}
+        self.rebuilt = 0
+        self.reused = 0
+
+    @property
+    def path(self):
+        return os.path.join(self.out_dir, MANIFEST_NAME)
+
+    @classmethod
+    def load(kls, out_dir):
+        """
+        The manifest in out_dir. A missing or unreadable one is empty, so
+        everything gets rebuilt.
+        """
+        manifest = kls(out_dir)
+        manifest.entries = manifest._read_entries()
+        return manifest
+
+    def _read_entries(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)['entries']
+        except (IOError, ValueError, KeyError, TypeError):
+            logger.warning("Can't read manifest {0}; ignoring it".format(
+                self.path))
+            return {}
+
+    def is_current(self, name, entry):
+        """
+        True if the output called name exists and was made from entry.
+        Counts it as reused if so.
+        """
+        current = (
+            self.entries.get(name) == _round_trip(entry) and
+            os.path.exists(os.path.join(self.out_dir, name)))
+        if current:
+            self.reused += 1
+        return current
+
+    def record(self, name, entry):
+        self.updates[name] = _round_trip(entry)
+        self.rebuilt += 1
+
+    def merge(self, other):
+        """
+        Add the updates and counts from other (say, from a worker process).
+        """
+        self.updates.update(other.updates)
+        self.rebuilt += other.rebuilt
+        self.reused += other.reused
+
+    def save(self):
+        """
+        Write our updates to the manifest file. It's read again first, so
+        entries written by someone else since we loaded it are kept.
+        """
+        entries = self._read_entries()
+        entries.update(self.updates)
+        fd, tmp_name = tempfile.mkstemp(suffix=".json", dir=self.out_dir)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'entries': entries}, f, sort_keys=True)
+            os.rename(tmp_name, self.path)
+        except Exception:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+        self.entries = entries
+        self.updates = {}
+
+
+def _round_trip(entry):
+    """
+    entry as it will read back from JSON (eg, with lists for tuples), so
+    it compares equal to a loaded one.
+    """
+    return json.loads(json.dumps(entry))
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+A minimal NIfTI-1 writer for VOI masks. Rather than building a dense volume
+and handing it to nibabel, it writes the header and then streams the data
+out a chunk at a time, so memory use depends on the chunk size and not the
+size of the grid.
+
+Also here is ParallelGzipFile, which gzips output in blocks on a pool of
+threads; nibabel can write through it too.
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+from collections import deque, namedtuple
+import multiprocessing.pool
+import os
+import struct
+import zlib
+
+from voitools import lazy
+
+np = lazy.module("numpy")
+
+HEADER_FORMAT = str(
+    "<i10s18sihbb8h3f4h8f3fhbb4f2i80s24s2h6f12f16s4s")
+HEADER_SIZE = 348
+# The header is followed by four bytes of (empty) extension flags
+VOX_OFFSET = HEADER_SIZE + 4
+
+# The nifti datatype codes for the output types we support, by dtype name
+DATATYPE_CODES = {
+    "uint8": 2,
+    "int16": 4,
+    "int32": 8,
+    "float32": 16,
+}
+
+# How many voxels we write at a time
+CHUNK_VOXELS = 1024 * 1024
+
+# nibabel's default, and fast; masks compress well at any level
+DEFAULT_COMPRESS_LEVEL = 1
+# How much uncompressed data goes in each gzip member
+GZIP_BLOCK_SIZE = 256 * 1024
+
+# How to gzip output: a level from 1 to 9, and a number of threads (0 means
+# one per CPU).
+Compression = namedtuple('Compression', ['level', 'threads'])
+DEFAULT_COMPRESSION = Compression(DEFAULT_COMPRESS_LEVEL, 1)
+
+
+def write_mask(
+        filename, voxel_indexes, shape, affine,
+        value=1, dtype="int16", chunk_voxels=CHUNK_VOXELS,
+        compression=DEFAULT_COMPRESSION):
+    """
+    Write a nifti-1 image of the given shape, with voxel_indexes (in fortran
+    order) set to value and everything else 0. value may also be an array,
+    with one value for each of voxel_indexes. Filenames ending in .gz will
+    be gzipped, as directed by compression. Like voi2nii's make_nifti(),
+    both qform and sform are set from affine, with code 1.
+    """
+    dtype = np.dtype(dtype).newbyteorder('<')
+    header = make_header(shape, affine, dtype)
+    with open_output(filename, compression) as f:
+        f.write(header)
+        f.write(b"\0" * (VOX_OFFSET - HEADER_SIZE))
+        write_mask_data(
+            f, voxel_indexes, int(np.prod(shape)), value, dtype, chunk_voxels)
+
+
+def write_mask_data(
+        f, voxel_indexes, voxel_count, value, dtype, chunk_voxels):
+    """
+    Write voxel_count voxels to f, chunk_voxels at a time: zeros, except for
+    voxel_indexes, which are set to value (or its corresponding element).
+    """
+    values = np.asarray(value)
+    if values.ndim:
+        order = np.argsort(voxel_indexes, kind='mergesort')
+        indexes = np.asarray(voxel_indexes)[order]
+        values = values[order]
+    else:
+        indexes = np.unique(voxel_indexes)
+    if len(indexes) and (indexes[0] < 0 or indexes[-1] >= voxel_count):
+        raise ValueError("voxel indexes are outside the volume")
+    buf = np.zeros(min(chunk_voxels, voxel_count), dtype=dtype)
+    zeros = buf.tobytes()
+    for start in range(0, voxel_count, chunk_voxels):
+        stop = min(start + chunk_voxels, voxel_count)
+        lo, hi = np.searchsorted(indexes, [start, stop])
+        if lo == hi:
+            f.write(zeros[:(stop - start) * dtype.itemsize])
+            continue
+        buf[:] = 0
+        buf[indexes[lo:hi] - start] = values[lo:hi] if values.ndim else value
+        f.write(buf[:stop - start].tobytes())
+
+
+def make_header(shape, affine, dtype):
+    """
+    Returns the 348 bytes of a little-endian nifti-1 single-file header.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.name not in DATATYPE_CODES:
+        raise ValueError("can't write nifti data of type {0}".format(dtype))
+    affine = np.asarray(affine, dtype=np.float64)
+    quat, zooms, qfac = affine_to_quaternion(affine)
+    dim = [3] + list(shape) + [1] * (7 - len(shape))
+    pixdim = [qfac] + list(zooms) + [1.0] * 4
+    return struct.pack(
+        HEADER_FORMAT,
+        HEADER_SIZE,
+        b"", b"", 0, 0, 0, 0,  # unused ANALYZE fields, dim_info
+        *(dim +
+          [0.0, 0.0, 0.0,  # intent_p1, p2, p3
+           0,  # intent_code
+           DATATYPE_CODES[dtype.name],
+           dtype.itemsize * 8,  # bitpix
+           0] +  # slice_start
+          pixdim +
+          [float(VOX_OFFSET),
+           float("nan"), float("nan"),  # scl_slope, scl_inter: no scaling
+           0, 0, 0,  # slice_end, slice_code, xyzt_units
+           0.0, 0.0, 0.0, 0.0,  # cal_max, cal_min, slice_duration, toffset
+           0, 0,  # glmax, glmin
+           b"", b"",  # descrip, aux_file
+           1, 1] +  # qform_code, sform_code
+          list(quat[1:]) +
+          list(affine[:3, 3]) +
+          list(affine[:3, :].ravel()) +
+          [b"", b"n+1\0"]))
+
+
+def affine_to_quaternion(affine):
+    """
+    Decompose the rotation/zoom part of affine the way the nifti-1 qform
+    expects. Returns (quaternion (a, b, c, d), zooms, qfac).
+    """
+    rzs = affine[:3, :3]
+    zooms = np.sqrt(np.sum(rzs * rzs, axis=0))
+    rot = rzs / zooms
+    qfac = 1.0
+    if np.linalg.det(rot) < 0:
+        rot[:, 2] *= -1
+        qfac = -1.0
+    # Snap to the nearest pure rotation, in case of shears or rounding.
+    p, s, q = np.linalg.svd(rot)
+    return rotation_to_quaternion(p.dot(q)), zooms, qfac
+
+
+def rotation_to_quaternion(rot):
+    """
+    Convert a 3x3 rotation matrix to a unit quaternion (a, b, c, d) with
+    a >= 0, using the eigenvector method of Bar-Itzhack (2000).
+    """
+    xx, yx, zx, xy, yy, zy, xz, yz, zz = rot.flat
+    k = np.array([
+        [xx - yy - zz, 0, 0, 0],
+        [yx + xy, yy - xx - zz, 0, 0],
+        [zx + xz, zy + yz, zz - xx - yy, 0],
+        [yz - zy, zx - xz, xy - yx, xx + yy + zz]]) / 3.0
+    vals, vecs = np.linalg.eigh(k)
+    quat = vecs[[3, 0, 1, 2], np.argmax(vals)]
+    if quat[0] < 0:
+        quat *= -1
+    return quat
+
+
+def open_output(filename, compression=DEFAULT_COMPRESSION):
+    """
+    Open filename for writing, as a ParallelGzipFile if it ends in .gz.
+    """
+    if filename.endswith(".gz"):
+        return ParallelGzipFile(
+            filename, compression.level, compression.threads)
+    return open(filename, 'wb')
+
+
+_pools = {}
+
+
+def _thread_pool(threads):
+    """
+    A shared pool of this many threads. Starting and stopping a pool for
+    every file costs more than compressing a mask does. Pools are kept per
+    process, as their threads don't survive a fork.
+    """
+    key = (os.getpid(), threads)
+    if key not in _pools:
+        _pools[key] = multiprocessing.pool.ThreadPool(threads)
+    return _pools[key]
+
+
+def compress_member(data, level):
+    """
+    Returns data as a complete gzip member.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class ParallelGzipFile(object):
+    """
+    A write-only gzip file. What's written is cut into block_size blocks,
+    and each is compressed as its own gzip member, on a pool of threads
+    (zlib lets go of the GIL while it works). gzip readers treat a series
+    of members as one stream, so the file reads back as usual. Blocks of
+    zeros -- most of a mask -- are only compressed once.
+    """
+    def __init__(
+            self, filename, compress_level=DEFAULT_COMPRESS_LEVEL, threads=1,
+            block_size=GZIP_BLOCK_SIZE):
+        super(ParallelGzipFile, self).__init__()
+        self.name = filename
+        self.compress_level = compress_level
+        self.block_size = block_size
+        self.threads = threads or multiprocessing.cpu_count()
+        self.__pool = None
+        if self.threads > 1:
+            self.__pool = _thread_pool(self.threads)
+        self.__file = open(filename, 'wb')
+        self.__buffer = []
+        self.__buffered = 0
+        self.__position = 0
+        self.__members = 0
+        # Compressed members (or pool results) not yet written, in order
+        self.__pending = deque()
+        self.__zero_members = {}
+        self.__zeros = b"\0" * block_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            data = memoryview(data).tobytes()
+        self.__position += len(data)
+        self.__buffer.append(data)
+        self.__buffered += len(data)
+        if self.__buffered >= self.block_size:
+            data = b"".join(self.__buffer)
+            whole = len(data) - len(data) % self.block_size
+            for start in range(0, whole, self.block_size):
+                self.__submit(data[start:start + self.block_size])
+            self.__buffer = [data[whole:]]
+            self.__buffered = len(data) - whole
+
+    def read(self, size=-1):
+        # nibabel only takes objects with read() for file objects
+        raise IOError("ParallelGzipFile is write-only")
+
+    def tell(self):
+        return self.__position
+
+    def seek(self, offset, whence=0):
+        # We can only "seek" to where we already are.
+        if not (whence == 0 and offset == self.__position):
+            raise IOError("can't seek in a ParallelGzipFile")
+
+    def flush(self):
+        pass
+
+    @property
+    def closed(self):
+        return self.__file.closed
+
+    def close(self):
+        if self.__file.closed:
+            return
+        try:
+            if self.__buffered or not self.__members:
+                self.__submit(b"".join(self.__buffer))
+            self.__buffer = []
+            self.__buffered = 0
+            while self.__pending:
+                self.__write_next()
+        finally:
+            self.__pending.clear()
+            self.__file.close()
+
+    def __submit(self, block):
+        self.__members += 1
+        # A comparison stops at the first difference, unlike a count.
+        if block == self.__zeros[:len(block)]:
+            if len(block) not in self.__zero_members:
+                self.__zero_members[len(block)] = compress_member(
+                    block, self.compress_level)
+            self.__pending.append(self.__zero_members[len(block)])
+        elif self.__pool is None:
+            self.__pending.append(compress_member(block, self.compress_level))
+        else:
+            self.__pending.append(self.__pool.apply_async(
+                compress_member, (block, self.compress_level)))
+        # Keep a couple of blocks per thread in flight, and no more.
+        while len(self.__pending) > 2 * self.threads:
+            self.__write_next()
+
+    def __write_next(self):
+        member = self.__pending.popleft()
+        if not isinstance(member, bytes):
+            member = member.get()
+        self.__file.write(member)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+Overlap writing files with making the next ones. Writing (and gzipping)
+mostly happens outside the GIL, so writer threads can keep the disk busy
+while the main thread reads VOIs and builds volumes.
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# How much data (eg, volumes waiting to be written) may be queued up
+MAX_QUEUED_BYTES = 256 * 1024 * 1024
+
+
+class WritePipeline(object):
+    def __init__(self, writers=0, max_bytes=MAX_QUEUED_BYTES):
+        """
+        Run submitted jobs in writers threads. Jobs say how many bytes they
+        hold on to; once max_bytes are queued or being written, submit()
+        waits for some to finish. With no writers, jobs run in submit().
+        Use as a context manager, or call close() when done.
+        """
+        super(WritePipeline, self).__init__()
+        self.writers = writers
+        self.max_bytes = max_bytes
+        self.queued_bytes = 0
+        self.error = None
+        self.__condition = threading.Condition()
+        self.__jobs = queue.Queue()
+        self.__threads = []
+        for i in range(writers):
+            thread = threading.Thread(target=self.__work)
+            thread.daemon = True
+            thread.start()
+            self.__threads.append(thread)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None:
+            # Don't let a writer's error hide the one we're handling
+            self.__stop()
+            return False
+        self.close()
+        return False
+
+    def submit(self, fx, args=(), nbytes=0):
+        """
+        Run fx(*args), now or in a writer thread. Raises the first error a
+        writer has hit, if any.
+        """
+        if not self.writers:
+            fx(*args)
+            return
+        with self.__condition:
+            # Always let one job through, however big it is.
+            while (self.error is None and self.queued_bytes > 0 and
+                    self.queued_bytes + nbytes > self.max_bytes):
+                self.__condition.wait()
+            self.__raise_error()
+            self.queued_bytes += nbytes
+        self.__jobs.put((fx, args, nbytes))
+
+    def close(self):
+        """
+        Wait for all the jobs to finish. Raises the first error a writer
+        hit.
+        """
+        self.__stop()
+        self.__raise_error()
+
+    def __stop(self):
+        for thread in self.__threads:
+            self.__jobs.put(None)
+        for thread in self.__threads:
+            thread.join()
+        self.__threads = []
+
+    def __raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def __work(self):
+        while True:
+            job = self.__jobs.get()
+            if job is None:
+                return
+            fx, args, nbytes = job
+            try:
+                # Once something's gone wrong, just drain the queue.
+                if self.error is None:
+                    fx(*args)
+            except Exception as e:
+                with self.__condition:
+                    if self.error is None:
+                        self.error = e
+            finally:
+                with self.__condition:
+                    self.queued_bytes -= nbytes
+                    self.__condition.notify_all()
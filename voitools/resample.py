@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+Resample VOIs from their own grid onto another image's grid. Only the
+target voxels near a VOI are looked at: a VOI's bounding box is mapped onto
+the target grid, and the target voxels in that box are sampled (a slab at a
+time) to see which source voxels they fall in. So the time and memory it
+takes grow with the size of the VOI, not of the grids.
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+from collections import namedtuple
+import itertools
+
+from voitools import lazy
+from voitools import voi
+from voitools.vendor.ordereddict import OrderedDict
+
+np = lazy.module("numpy")
+
+RESAMPLE_MODES = ("nearest", "fraction")
+
+# In fraction mode, each target voxel is sampled at this many points along
+# each axis.
+FRACTION_SUBDIVISIONS = 3
+
+# How many target voxels to sample at once
+CHUNK_VOXELS = 256 * 1024
+
+# Where to resample to: a grid shape and affine, and a mode.
+Target = namedtuple('Target', ['shape', 'affine', 'mode'])
+
+_cached = None
+
+
+def for_group(voi_group, target):
+    """
+    A Resampler from voi_group's grid (and affine) to target. The last one
+    made is reused if it's for the same grids, so every VOI in a group --
+    and every group on the same grid -- shares one.
+    """
+    global _cached
+    key = (
+        tuple(voi_group.shape),
+        np.asarray(voi_group.affine, dtype=np.float64).tobytes(),
+        tuple(target.shape),
+        np.asarray(target.affine, dtype=np.float64).tobytes(),
+        target.mode)
+    if _cached is None or not _cached[0] == key:
+        _cached = (key, Resampler(
+            voi_group.shape, voi_group.affine,
+            target.shape, target.affine, target.mode))
+    return _cached[1]
+
+
+class Resampler(object):
+    def __init__(
+            self, source_shape, source_affine, target_shape, target_affine,
+            mode="nearest", subdivisions=FRACTION_SUBDIVISIONS):
+        """
+        In nearest mode, a target voxel is in a VOI if the source voxel
+        nearest its center is. In fraction mode, each target voxel is
+        sampled at subdivisions ** 3 points, and gets the fraction of them
+        that fall in the VOI.
+        """
+        super(Resampler, self).__init__()
+        if mode not in RESAMPLE_MODES:
+            raise ValueError("mode must be one of {0}".format(
+                ", ".join(RESAMPLE_MODES)))
+        self.source_shape = tuple(int(n) for n in source_shape)
+        self.target_shape = tuple(int(n) for n in target_shape)
+        self.target_affine = np.asarray(target_affine, dtype=np.float64)
+        self.mode = mode
+        if mode == "nearest":
+            subdivisions = 1
+        self.samples_per_voxel = subdivisions ** 3
+        # Takes target voxel coordinates to source voxel coordinates
+        self.transform = np.linalg.inv(
+            np.asarray(source_affine, dtype=np.float64)).dot(
+                self.target_affine)
+        # Where each sample point is, relative to its target voxel's
+        # center, in source voxel coordinates
+        steps = (np.arange(subdivisions) + 0.5) / subdivisions - 0.5
+        self.sample_shifts = [
+            self.transform[:3, :3].dot(offset)[:, np.newaxis]
+            for offset in itertools.product(steps, repeat=3)]
+
+    @property
+    def dtype(self):
+        return np.int16 if self.mode == "nearest" else np.float32
+
+    def resample(self, voxel_indexes):
+        """
+        Map voxel indexes on the source grid onto the target grid. Returns
+        the target voxel indexes, in order, and the fraction of each one in
+        the VOI (always 1 in nearest mode).
+        """
+        sources = np.unique(voxel_indexes)
+        if len(sources) and (
+                sources[0] < 0 or
+                sources[-1] >= int(np.prod(self.source_shape))):
+            raise ValueError("voxel indexes are outside the source grid")
+        targets = [np.zeros(0, dtype=np.intp)]
+        counts = [np.zeros(0, dtype=np.intp)]
+        box = voi.bounding_box(sources, self.source_shape)
+        target_box = None if box is None else self.__target_box(box)
+        if target_box is not None:
+            # The VOI, in its bounding box
+            mask = box.crop_indexes(sources, self.source_shape)
+            in_voi = np.zeros(int(np.prod(box.shape)), dtype=bool)
+            in_voi[mask] = True
+            for coords in _slabs(target_box):
+                found, hits = self.__sample(coords, box, in_voi)
+                targets.append(np.ravel_multi_index(
+                    coords[:, found], self.target_shape, order='F'))
+                counts.append(hits[found])
+        return (
+            np.concatenate(targets),
+            np.concatenate(counts) / self.samples_per_voxel)
+
+    def __target_box(self, box):
+        """
+        The BoundingBox of target voxels that may have sample points in
+        box (of source voxels), or None if it's off the target grid.
+        """
+        inverse = np.linalg.inv(self.transform)
+        # The corners of the source voxels' extent
+        corners = np.array(list(itertools.product(*[
+            (start - 0.5, stop - 0.5)
+            for start, stop in zip(box.start, box.stop)]))).T
+        coords = inverse[:3, :3].dot(corners) + inverse[:3, 3:4]
+        # A target voxel's sample points are within half a voxel of its
+        # center
+        start = np.maximum(np.floor(coords.min(axis=1) - 0.5), 0)
+        stop = np.minimum(
+            np.ceil(coords.max(axis=1) + 0.5) + 1, self.target_shape)
+        if np.any(start >= stop):
+            return None
+        return voi.BoundingBox(
+            voi.Triple(*start.astype(int).tolist()),
+            voi.Triple(*stop.astype(int).tolist()))
+
+    def __sample(self, coords, box, in_voi):
+        """
+        For the target voxels at coords (a (3, n) array), whether any of
+        their sample points are in the VOI, and how many.
+        """
+        # Shifted so rounding is just floor(), and relative to box.start
+        centers = (
+            self.transform[:3, :3].dot(coords) + self.transform[:3, 3:4] +
+            0.5 - np.array(box.start)[:, np.newaxis])
+        hits = np.zeros(coords.shape[1], dtype=np.int32)
+        points = np.empty(coords.shape, dtype=np.intp)
+        for shift in self.sample_shifts:
+            np.floor(centers + shift, out=points, casting='unsafe')
+            inside = np.ones(coords.shape[1], dtype=bool)
+            for axis in range(3):
+                inside &= (points[axis] >= 0) & (
+                    points[axis] < box.shape[axis])
+            x, y, z = points[:, inside]
+            positions = x + box.shape.x * (y + box.shape.y * z)
+            hits[inside] += in_voi[positions]
+        return hits > 0, hits
+
+    def to_volume(self, voxel_indexes):
+        """
+        A volume on the target grid: 1 in the VOI, or in fraction mode, the
+        fraction of each voxel in the VOI.
+        """
+        vol = np.zeros(self.target_shape, dtype=self.dtype, order='F')
+        targets, weights = self.resample(voxel_indexes)
+        vol.ravel('A')[targets] = weights
+        return vol
+
+    def resample_group(self, voi_group):
+        """
+        Make a VOIGroup on the target grid, with voi_group's VOIs resampled
+        onto it. Only nearest mode makes whole-voxel VOIs, so this needs it.
+        """
+        if not self.mode == "nearest":
+            raise ValueError("resampled VOI groups need nearest mode")
+        zooms = np.sqrt(np.sum(self.target_affine[:3, :3] ** 2, axis=0))
+        header = OrderedDict(voi_group.header)
+        for axis, dim, pixdim in zip("XYZ", self.target_shape, zooms):
+            header['{0} dim'.format(axis)] = str(dim)
+            header['{0} pixdim'.format(axis)] = "{0:.5f}".format(pixdim)
+        resampled = voi.VOIGroup(header, affine=self.target_affine)
+        for cur_voi in voi_group.vois:
+            targets, weights = self.resample(cur_voi.voxel_indexes)
+            voi_header = OrderedDict(cur_voi.header)
+            for axis, dim, pixdim in zip("xyz", self.target_shape, zooms):
+                voi_header['{0}_dim'.format(axis)] = "{0:8d}".format(dim)
+                voi_header['{0}_pixdim'.format(axis)] = "{0:13.5f}".format(
+                    pixdim)
+            voi_header['Number of voxels'] = str(len(targets))
+            voi.VOI(resampled, voi_header, targets)
+        return resampled
+
+
+def _slabs(box):
+    """
+    The voxel coordinates in box, as (3, n) arrays, a slab of z planes at a
+    time, in fortran order.
+    """
+    shape = box.shape
+    plane = shape.x * shape.y
+    step = max(1, CHUNK_VOXELS // plane)
+    for z in range(box.start.z, box.stop.z, step):
+        z_stop = min(z + step, box.stop.z)
+        slab = (shape.x, shape.y, z_stop - z)
+        coords = np.array(np.unravel_index(
+            np.arange(int(np.prod(slab))), slab, order='F'))
+        coords += np.array([box.start.x, box.start.y, z])[:, np.newaxis]
+        yield coords
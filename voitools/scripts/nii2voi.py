@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Part of the voitools package
+# Copyright 2015 Board of Regents of the University of Wisconsin System
+# Licensed under the MIT license; see LICENSE at the root of the package.
+
+# Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+# Imaging and Behavior.
+
+"""Convert nifti masks or label maps into a spamalize .voi file.
+
+Each input image becomes one VOI made of its nonzero voxels, named after
+the image file. With --labels, there must be one input image, and each
+distinct nonzero value in it becomes a VOI, in order of value. Voxel data
+is written as "LONG coordinate index".
+
+Usage:
+  nii2voi [options] <output> <image>...
+  nii2voi -h | --help
+
+Options:
+  --labels              Treat the image as a label map, not a mask.
+  --names=<file>        With --labels, read VOI names from this
+                        tab-separated file, with "index" and "name" columns
+                        (like the one voi2nii --label-map writes).
+  --byte-order=<order>  BIG_ENDIAN or LITTLE_ENDIAN [default: BIG_ENDIAN]
+  -h --help             Show this screen
+  --version             Show version
+  -v --verbose          Display debugging information
+"""
+
+import sys
+import logging
+import os
+
+import voitools
+from voitools import lazy
+from voitools import voi
+from voitools.vendor import docopt
+
+nib = lazy.module("nibabel")
+
+logger = voi.logger
+
+
+def main(argv):
+    arguments = docopt.docopt(
+        __doc__,
+        argv,
+        version="voitools {0}".format(voitools.__version__))
+    voi.log_to_stderr()
+    logger.setLevel(logging.INFO)
+    if arguments['--verbose']:
+        logger.setLevel(logging.DEBUG)
+    logger.debug(arguments)
+    images = arguments['<image>']
+    group_args = dict(
+        byte_order=arguments['--byte-order'],
+        filename=arguments['<output>'],
+        base_filename=images[0])
+    if arguments['--labels']:
+        if not len(images) == 1:
+            logger.error("--labels takes exactly one image")
+            sys.exit(1)
+        names = None
+        if arguments['--names']:
+            names = read_names(arguments['--names'])
+        voi_group = labels_to_group(images[0], names, group_args)
+    else:
+        voi_group = masks_to_group(images, group_args)
+    logger.debug("Writing {0} VOIs".format(len(voi_group.vois)))
+    voi.write_file(voi_group, arguments['<output>'])
+
+
+def load_volume(filename):
+    """
+    Returns the 3D data and voxel dimensions of a nifti image.
+    """
+    img = nib.load(filename)
+    data = img.get_data()
+    if data.ndim == 4 and data.shape[3] == 1:
+        data = data[..., 0]
+    if not data.ndim == 3:
+        raise ValueError("{0} is not a 3D image".format(filename))
+    return data, img.get_header().get_zooms()[:3]
+
+
+def masks_to_group(filenames, group_args):
+    volumes = [load_volume(f) for f in filenames]
+    names = [image_name(f) for f in filenames]
+    return voi.group_from_masks(
+        (data for data, zooms in volumes),
+        volumes[0][1],
+        names,
+        **group_args)
+
+
+def labels_to_group(filename, names, group_args):
+    data, zooms = load_volume(filename)
+    voi_group, labels = voi.group_from_labels(
+        data.astype(int), zooms, names, **group_args)
+    return voi_group
+
+
+def image_name(filename):
+    name = os.path.basename(filename)
+    for ext in ['.gz', '.nii', '.img', '.hdr']:
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return name
+
+
+def read_names(filename):
+    """
+    Read a label -> name mapping from a tab-separated file with "index" and
+    "name" columns.
+    """
+    names = {}
+    with open(filename) as f:
+        columns = f.readline().rstrip("\r\n").split("\t")
+        index_col = columns.index("index")
+        name_col = columns.index("name")
+        for line in f:
+            fields = line.rstrip("\r\n").split("\t")
+            if len(fields) > max(index_col, name_col):
+                names[int(fields[index_col])] = fields[name_col]
+    return names
+
+
+def console():
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    console()
@@ -7,13 +7,25 @@
 # Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
 # Imaging and Behavior.
 
-"""Convert a spamalize .voi file into a set of nifti files.
+"""Convert spamalize .voi files into sets of nifti files.
 
 This program will produce one .nii file per VOI in a VOI group (.voi) file;
-the name will be determined by the --pattern parameter.
+the name will be determined by the --pattern parameter. With --label-map,
+it will instead produce one image where each voxel holds the number of the
+VOI it belongs to, plus a .tsv file listing the VOI names.
+
+Any number of .voi files may be given; for directories, every .voi file in
+the directory is converted. With --jobs, files are converted in parallel.
+A file that fails to convert is reported, and the rest are still converted.
+
+With --incremental, a manifest in --out-dir records what each output was
+made from: a hash of the VOI's header and voxels, its affine, and the
+resampling and cropping settings. Outputs whose entry still matches are
+skipped, without reading their volumes; changing only the compression
+doesn't count as a change.
 
 Usage:
-  voi2nii [options] <datafile>
+  voi2nii [options] <datafile>...
   voi2nii -h | --help
 
 Options:
@@ -34,7 +46,46 @@ Options:
                         file.
                         If not specified, reads voxel size from the .voi file
                         and assumes a centered origin in RPI orientation.
+  --resample=<mode>     With --affine-parent, resample the VOIs onto the
+                        parent image's grid, rather than just using its
+                        affine: nearest (nearest neighbour) or fraction (each
+                        voxel holds the fraction of it inside the VOI). The
+                        VOIs are taken to have the default centered affine.
+  --crop                Write only the bounding box of each VOI (or of all
+                        of them, for a label map), shifting the affine so
+                        it stays in the same place.
+  --crop-padding=<n>    With --crop, grow the box by this many voxels on
+                        each side, as far as the edges of the grid
+                        [default: 0]
   --out-dir=<dir>       Directory to write the output files [default: .]
+  --label-map=<file>    Write all VOIs to a single labelled image with this
+                        name, instead of one file per VOI. {base_name} and
+                        {cur_name} are substituted as in --pattern.
+  --overlap=<policy>    With --label-map, which VOI a voxel belongs to when
+                        VOIs overlap: first, last, or error [default: last]
+  --native-writer       Write each VOI with voitools' own streaming nifti
+                        writer, which never builds the whole volume in
+                        memory, instead of with nibabel.
+  --writers=<n>         Write this many files at once, in threads, while
+                        the next VOIs are read and converted. 0 writes each
+                        file before starting on the next VOI [default: 0]
+  --max-queued-mb=<mb>  With --writers, how many MB of converted VOIs may
+                        wait to be written before conversion pauses
+                        [default: 256]
+  --compress-level=<n>  gzip level (1-9) for .nii.gz output [default: 1]
+  --compress-threads=<n>
+                        Compress each .nii.gz file in blocks, this many at
+                        once; 0 means one per CPU [default: 1]
+  --incremental         Skip outputs that are already up to date, and keep
+                        the manifest of what they were made from
+  --stats               Print time, bytes read and written, and memory use
+                        for each phase of the conversion when done.
+  --stats-json=<file>   Save those statistics, and the details for each
+                        VOI, to this JSON file.
+  -j --jobs=<n>         Convert this many files at once; 0 means one per
+                        CPU [default: 1]
+  --no-cache            Don't read or store parsed VOI files in the cache
+                        ($VOITOOLS_CACHE_DIR, or ~/.cache/voitools)
   -h --help             Show this screen
   --version             Show version
   -v --verbose          Display debugging information
@@ -44,17 +95,29 @@ import sys
 import logging
 import re
 import os
-
-import nibabel as nib
+import glob
+import time
+import multiprocessing
 
 import voitools
+from voitools import lazy
 from voitools import voi
+from voitools import manifest
+from voitools import nifti
+from voitools import pipeline
+from voitools import resample
+from voitools import stats
+from voitools.cache import VOICache
 from voitools.vendor import docopt
 
+nib = lazy.module("nibabel")
+np = lazy.module("numpy")
+
 logger = voi.logger
 
 PATTERN_SUBS = set(
     ['base_name', 'cur_name', 'voi_number', 'voxel_count', 'voi_name'])
+GROUP_PATTERN_SUBS = set(['base_name', 'cur_name'])
 WORD_CHAR_RE = re.compile(r"\W+")
 
 
@@ -63,24 +126,251 @@ def main(argv):
         __doc__,
         argv,
         version="voitools {0}".format(voitools.__version__))
+    voi.log_to_stderr()
     logger.setLevel(logging.INFO)
     if arguments['--verbose']:
         logger.setLevel(logging.DEBUG)
     logger.debug(arguments)
-    voi_group = voitools.voi.read_file(arguments['<datafile>'])
-    voi_indexes = make_voi_numbers(voi_group, arguments['--voi-numbers'])
-    voi_group.set_affine(make_affine(arguments['--affine-parent']))
-    process_vois(
-        voi_group,
+    if not check_resample_arguments(arguments):
+        sys.exit(1)
+    filenames = find_datafiles(arguments['<datafile>'])
+    failures = process_files(filenames, arguments, int(arguments['--jobs']))
+    if failures:
+        sys.exit(1)
+
+
+def check_resample_arguments(arguments):
+    mode = arguments['--resample']
+    if mode is None:
+        return True
+    if mode not in resample.RESAMPLE_MODES:
+        logger.error("--resample must be one of {0}".format(
+            ", ".join(resample.RESAMPLE_MODES)))
+        return False
+    if not arguments['--affine-parent']:
+        logger.error("--resample needs --affine-parent")
+        return False
+    if arguments['--label-map'] and not mode == "nearest":
+        logger.error("--label-map can only be resampled with nearest")
+        return False
+    return True
+
+
+def find_datafiles(paths):
+    """
+    Expand directories in paths to the .voi files in them.
+    """
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(sorted(glob.glob(os.path.join(path, "*.voi"))))
+        else:
+            filenames.append(path)
+    return filenames
+
+
+def process_files(filenames, arguments, jobs=1):
+    """
+    Convert each of filenames, in a pool of jobs worker processes if jobs
+    is not 1. Errors are logged rather than raised. Returns the number of
+    files that failed.
+    """
+    start = time.time()
+    tasks = [(filename, arguments) for filename in filenames]
+    if jobs == 1 or len(filenames) < 2:
+        results = [convert_file_task(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(jobs or None)
+        try:
+            results = list(pool.imap_unordered(convert_file_task, tasks))
+        finally:
+            pool.close()
+            pool.join()
+    elapsed = time.time() - start
+    failures = 0
+    voi_count = 0
+    events = []
+    outputs = manifest.Manifest(arguments['--out-dir'])
+    for filename, converted, error, file_events, file_outputs in results:
+        if error is not None:
+            failures += 1
+            logger.error("Can't convert {0}: {1}".format(filename, error))
+        voi_count += converted
+        events.extend(file_events)
+        if file_outputs is not None:
+            outputs.merge(file_outputs)
+    if len(filenames) > 1:
+        log_summary(filenames, voi_count, failures, elapsed)
+    if arguments['--incremental']:
+        if outputs.updates:
+            outputs.save()
+        logger.info("Rebuilt {0} outputs, reused {1}".format(
+            outputs.rebuilt, outputs.reused))
+    if wants_stats(arguments):
+        report_stats(events, arguments)
+    return failures
+
+
+def wants_stats(arguments):
+    return bool(arguments['--stats'] or arguments['--stats-json'])
+
+
+def report_stats(events, arguments):
+    recorder = stats.Recorder()
+    recorder.events = events
+    if arguments['--stats']:
+        recorder.write_text(sys.stderr)
+    if arguments['--stats-json']:
+        with open(arguments['--stats-json'], 'w') as f:
+            recorder.write_json(f)
+
+
+def log_summary(filenames, voi_count, failures, elapsed):
+    in_bytes = sum(os.path.getsize(f) for f in filenames if os.path.isfile(f))
+    rate = 1.0 / elapsed if elapsed > 0 else 0.0
+    logger.info(
+        "Converted {0} of {1} files ({2} VOIs) in {3:.2f} s: "
+        "{4:.1f} files/s, {5:.1f} VOIs/s, {6:.2f} MB/s read".format(
+            len(filenames) - failures,
+            len(filenames),
+            voi_count,
+            elapsed,
+            len(filenames) * rate,
+            voi_count * rate,
+            in_bytes * rate / (1024 * 1024)))
+
+
+def convert_file_task(task):
+    """
+    Worker for process_files(): returns (filename, VOIs converted, error
+    message or None, list of stats events, manifest.Manifest of the outputs
+    made or None).
+    """
+    filename, arguments = task
+    recorder = stats.enable() if wants_stats(arguments) else None
+    outputs = None
+    if arguments['--incremental']:
+        outputs = manifest.Manifest.load(arguments['--out-dir'])
+    try:
+        converted = convert_file(filename, arguments, outputs)
+        error = None
+    except Exception as e:
+        logger.debug("Error converting {0}".format(filename), exc_info=True)
+        converted = 0
+        error = str(e) or e.__class__.__name__
+        # Its outputs may not all have been written
+        outputs = None
+    events = []
+    if recorder is not None:
+        stats.disable()
+        events = recorder.events
+        for event in events:
+            event['file'] = filename
+    return (filename, converted, error, events, outputs)
+
+
+def convert_file(filename, arguments, outputs=None):
+    """
+    Convert one .voi file as directed by arguments. If outputs (a
+    manifest.Manifest) is given, outputs it says are up to date are
+    skipped, and the rest recorded in it. Returns the number of VOIs
+    converted; skipped ones don't count.
+    """
+    cache = None if arguments['--no-cache'] else VOICache()
+    voi_numbers = voi.parse_voi_numbers(arguments['--voi-numbers'])
+    target = make_resample_target(
+        arguments['--affine-parent'], arguments['--resample'])
+    # When resampling, the VOIs keep their own affine; the parent's is the
+    # target's.
+    affine = None
+    if target is None:
+        affine = make_affine(arguments['--affine-parent'])
+    crop = make_crop(arguments)
+    if arguments['--label-map']:
+        voi_group = voitools.voi.read_file(filename, voi_numbers, cache=cache)
+        voi_group.set_affine(affine)
+        if outputs is not None:
+            name = make_filename(
+                arguments['--label-map'], voi_group, GROUP_PATTERN_SUBS)
+            entry = manifest_entry(
+                voi_group.vois, voi_group.affine, target, crop,
+                arguments['--overlap'])
+            if outputs.is_current(name, entry):
+                return 0
+            outputs.record(name, entry)
+        if target is not None:
+            with stats.phase("resample"):
+                voi_group = resample.for_group(
+                    voi_group, target).resample_group(voi_group)
+        process_label_map(
+            voi_group,
+            arguments['--label-map'],
+            arguments['--out-dir'],
+            arguments['--overlap'],
+            make_compression(arguments),
+            crop=crop)
+        return len(voi_group.vois)
+    return process_voi_stream(
+        voitools.voi.iter_vois(filename, voi_numbers, affine, cache=cache),
         arguments['--pattern'],
-        voi_indexes,
-        arguments['--out-dir'])
+        arguments['--out-dir'],
+        native_writer=arguments['--native-writer'],
+        target=target,
+        writers=int(arguments['--writers']),
+        max_queued_bytes=int(arguments['--max-queued-mb']) * 1024 * 1024,
+        compression=make_compression(arguments),
+        crop=crop,
+        outputs=outputs)
+
+
+def manifest_entry(vois, affine, target=None, crop=None, overlap=None):
+    """
+    What an output made from vois depends on, for the manifest.
+    """
+    resampled = None
+    if target is not None:
+        resampled = {
+            'mode': target.mode,
+            'shape': [int(n) for n in target.shape],
+            'affine': np.asarray(target.affine, dtype=np.float64).tolist(),
+        }
+    return {
+        'digest': manifest.voi_digest(vois),
+        'affine': np.asarray(affine, dtype=np.float64).tolist(),
+        'resample': resampled,
+        'crop': crop,
+        'overlap': overlap,
+    }
+
+
+def make_crop(arguments):
+    """
+    The --crop padding, or None not to crop.
+    """
+    if not arguments['--crop']:
+        return None
+    return int(arguments['--crop-padding'])
+
+
+def crop_to_box(voxel_indexes, shape, affine, padding):
+    """
+    Crop voxel_indexes, on a grid of shape and affine, to their bounding
+    box: returns their indexes in the box, and its shape and affine. With no
+    voxels, there's no box, and nothing changes.
+    """
+    box = voi.bounding_box(voxel_indexes, shape, padding)
+    if box is None:
+        return voxel_indexes, shape, affine
+    return (
+        box.crop_indexes(voxel_indexes, shape),
+        box.shape,
+        box.crop_affine(affine))
 
 
-def make_voi_numbers(voi_group, voi_numbers_string):
-    if voi_numbers_string is None:
-        return range(voi_group.voi_count)
-    return [int(num) - 1 for num in voi_numbers_string.split(",")]
+def make_compression(arguments):
+    return nifti.Compression(
+        int(arguments['--compress-level']),
+        int(arguments['--compress-threads']))
 
 
 def make_affine(affine_parent_name):
@@ -89,9 +379,19 @@ def make_affine(affine_parent_name):
     return nib.load(affine_parent_name).get_affine()
 
 
-def make_filename(pattern, voi):
+def make_resample_target(affine_parent_name, mode):
+    """
+    Where --resample sends the VOIs: a resample.Target, or None.
+    """
+    if mode is None:
+        return None
+    parent = nib.load(affine_parent_name)
+    return resample.Target(parent.shape[:3], parent.get_affine(), mode)
+
+
+def make_filename(pattern, voi, subs=PATTERN_SUBS):
     out_name = pattern
-    for attr in PATTERN_SUBS:
+    for attr in subs:
         val = getattr(voi, "{0}".format(attr))
         val_safe = re.sub(WORD_CHAR_RE, "_", str(val))
         out_name = out_name.replace(
@@ -99,20 +399,192 @@ def make_filename(pattern, voi):
     return out_name
 
 
-def process_vois(voi_group, name_pattern, voi_indexes, out_dir):
-    vois = [voi_group.vois[i] for i in voi_indexes]
-    for cur_voi in vois:
-        logger.debug("Converting VOI {0}".format(cur_voi.voi_number))
-        nii = make_nifti(cur_voi)
-        out_filename = os.path.join(
-            out_dir, make_filename(name_pattern, cur_voi))
-        nii.to_filename(out_filename)
+def process_vois(
+        voi_group, name_pattern, voi_indexes, out_dir, native_writer=False):
+    vois = (voi_group.vois[i] for i in voi_indexes)
+    return process_voi_stream(vois, name_pattern, out_dir, native_writer)
+
+
+def process_voi_stream(
+        vois, name_pattern, out_dir, native_writer=False, target=None,
+        writers=0, max_queued_bytes=pipeline.MAX_QUEUED_BYTES,
+        compression=nifti.DEFAULT_COMPRESSION, crop=None, outputs=None):
+    """
+    Convert each VOI from the iterable vois in turn, keeping nothing from
+    one to the next. If target (a resample.Target) is given, VOIs are
+    resampled onto it. With writers, files are written in that many
+    threads while later VOIs are converted, with at most max_queued_bytes
+    of converted VOIs waiting. .nii.gz files are compressed as directed by
+    compression (a nifti.Compression). If crop isn't None, each file holds
+    just the VOI's bounding box, grown by crop voxels. If outputs (a
+    manifest.Manifest) is given, VOIs whose files are up to date are
+    skipped. Returns the number of VOIs converted, not counting those.
+    """
+    converted = 0
+    # Without writer threads, each volume is written before the next one
+    # is made, so they can all be made in the same buffer.
+    buffer = None
+    with pipeline.WritePipeline(writers, max_queued_bytes) as writes:
+        for cur_voi in vois:
+            name = make_filename(name_pattern, cur_voi)
+            out_filename = os.path.join(out_dir, name)
+            if outputs is not None:
+                entry = manifest_entry([cur_voi], cur_voi.affine, target, crop)
+                if outputs.is_current(name, entry):
+                    logger.debug("{0} is up to date".format(out_filename))
+                    continue
+                outputs.record(name, entry)
+            converted += 1
+            logger.debug("Converting VOI {0}".format(cur_voi.voi_number))
+            resampler = None
+            if target is not None:
+                resampler = resample.for_group(cur_voi.voi_group, target)
+            if native_writer:
+                writes.submit(
+                    write_native_file,
+                    (cur_voi, out_filename, resampler, compression, crop),
+                    cur_voi.voxel_indexes.nbytes)
+            else:
+                if not writers and resampler is None and crop is None:
+                    buffer = volume_buffer(buffer, cur_voi.shape)
+                nii = make_nifti(cur_voi, resampler, crop, buffer)
+                writes.submit(
+                    write_nifti,
+                    (nii, out_filename, cur_voi.voi_number, compression),
+                    image_nbytes(nii))
+    return converted
+
+
+def volume_buffer(buffer, shape):
+    """
+    buffer, or a new voi.VolumeBuffer if it's None or the wrong shape.
+    """
+    if buffer is None or not buffer.shape == tuple(shape):
+        buffer = voi.VolumeBuffer(shape)
+    return buffer
+
+
+def write_nifti(
+        nii, out_filename, voi_number=None,
+        compression=nifti.DEFAULT_COMPRESSION):
+    with stats.phase("write", voi_number) as p:
+        if out_filename.endswith(".gz"):
+            # Have nibabel write through our block-parallel gzip writer
+            with nifti.open_output(out_filename, compression) as f:
+                nii.to_file_map({'image': nib.FileHolder(
+                    filename=out_filename, fileobj=f)})
+        else:
+            nii.to_filename(out_filename)
+        p.record_written(out_filename)
 
 
-def make_nifti(cur_voi):
+def write_native_file(
+        cur_voi, out_filename, resampler=None,
+        compression=nifti.DEFAULT_COMPRESSION, crop=None):
+    with stats.phase("write", cur_voi.voi_number) as p:
+        write_native(cur_voi, out_filename, resampler, compression, crop)
+        p.record_written(out_filename)
+
+
+def image_nbytes(nii):
+    return int(np.prod(nii.shape)) * nii.get_data_dtype().itemsize
+
+
+def write_native(
+        cur_voi, out_filename, resampler=None,
+        compression=nifti.DEFAULT_COMPRESSION, crop=None):
+    logger.debug("Streaming nifti for {0}".format(cur_voi.voi_number))
+    if resampler is None:
+        indexes, shape, affine = (
+            cur_voi.voxel_indexes, cur_voi.shape, cur_voi.affine)
+        if crop is not None:
+            indexes, shape, affine = crop_to_box(
+                indexes, shape, affine, crop)
+        nifti.write_mask(
+            out_filename,
+            indexes,
+            shape,
+            affine,
+            compression=compression)
+        return
+    with stats.phase("resample", cur_voi.voi_number):
+        indexes, weights = resampler.resample(cur_voi.voxel_indexes)
+    shape, affine = resampler.target_shape, resampler.target_affine
+    if crop is not None:
+        indexes, shape, affine = crop_to_box(indexes, shape, affine, crop)
+    nifti.write_mask(
+        out_filename,
+        indexes,
+        shape,
+        affine,
+        value=weights,
+        dtype=resampler.dtype,
+        compression=compression)
+
+
+def process_label_map(
+        voi_group, filename, out_dir, overlap,
+        compression=nifti.DEFAULT_COMPRESSION, crop=None):
+    logger.debug("Making label map from {0} VOIs".format(len(voi_group.vois)))
+    with stats.phase("label_volume"):
+        vol = voi.label_volume(voi_group.vois, voi_group.shape, overlap)
+    affine = voi_group.affine
+    if crop is not None:
+        box = voi.bounding_box(np.flatnonzero(vol.ravel('F')), vol.shape, crop)
+        if box is not None:
+            vol = vol[box.slices]
+            affine = box.crop_affine(affine)
+    out_filename = os.path.join(
+        out_dir, make_filename(filename, voi_group, GROUP_PATTERN_SUBS))
+    with stats.phase("nifti_header"):
+        nii = make_image(vol, affine)
+    write_nifti(nii, out_filename, compression=compression)
+    with open(label_table_filename(out_filename), 'w') as f:
+        f.write("index\tname\n")
+        for cur_voi in voi_group.vois:
+            f.write("{0}\t{1}\n".format(cur_voi.voi_number, cur_voi.name))
+
+
+def label_table_filename(image_filename):
+    base = image_filename
+    for ext in ['.gz', '.nii', '.img', '.hdr']:
+        if base.endswith(ext):
+            base = base[:-len(ext)]
+    return base + ".tsv"
+
+
+def make_nifti(cur_voi, resampler=None, crop=None, buffer=None):
+    """
+    A nifti image of cur_voi. Uncropped, unresampled volumes are made in
+    buffer (a voi.VolumeBuffer), if it's given.
+    """
     # It's OK if this is None, we'll just choose a centered affine.
     logger.debug("Making nifti for {0}".format(cur_voi.voi_number))
-    img = nib.Nifti1Image(cur_voi.to_volume(), cur_voi.affine)
+    if resampler is None:
+        box = None if crop is None else cur_voi.bounding_box(crop)
+        vol = cur_voi.to_volume(
+            box=box, out=buffer if box is None else None)
+        affine = cur_voi.affine
+        if box is not None:
+            affine = box.crop_affine(affine)
+    elif crop is None:
+        with stats.phase("resample", cur_voi.voi_number):
+            vol = resampler.to_volume(cur_voi.voxel_indexes)
+        affine = resampler.target_affine
+    else:
+        with stats.phase("resample", cur_voi.voi_number):
+            indexes, weights = resampler.resample(cur_voi.voxel_indexes)
+            indexes, shape, affine = crop_to_box(
+                indexes, resampler.target_shape, resampler.target_affine,
+                crop)
+            vol = np.zeros(shape, dtype=resampler.dtype, order='F')
+            vol.ravel('A')[indexes] = weights
+    with stats.phase("nifti_header", cur_voi.voi_number):
+        return make_image(vol, affine)
+
+
+def make_image(data, affine):
+    img = nib.Nifti1Image(data, affine)
     header = img.get_header()
     header['qform_code'] = 1
     header['sform_code'] = 1
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Part of the voitools package
+# Copyright 2015 Board of Regents of the University of Wisconsin System
+# Licensed under the MIT license; see LICENSE at the root of the package.
+
+# Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+# Imaging and Behavior.
+
+"""Keep a SQLite catalog of .voi files, and find VOIs in it.
+
+scan adds the .voi files in the given files and directories (searched
+recursively) to the catalog, with their headers and each VOI's number of
+voxels, volume, and bounding box. Only new and changed files (by path,
+size, and mtime) are read; files under the scanned directories that have
+gone away are dropped.
+
+query prints the matching VOIs as a tab-separated table. Its --where
+condition can use any column of the voi_summary view: path, cur_name,
+base_name, voi_number, name, voxel_count, volume_mm3, and x_start through
+z_stop (the bounding box, in voxels, with stop one past the last voxel).
+
+Usage:
+  voi_catalog scan [options] <catalog> <path>...
+  voi_catalog query [options] <catalog>
+  voi_catalog -h | --help
+
+Options:
+  -j --jobs=<n>         Read this many files at once; 0 means one per CPU
+                        [default: 0]
+  --name=<name>         Only VOIs with exactly this name
+  --min-voxels=<n>      Only VOIs with at least this many voxels
+  --max-voxels=<n>      Only VOIs with at most this many voxels
+  --where=<sql>         Only VOIs matching this SQL condition, like
+                        "name LIKE 'caudate%' AND volume_mm3 > 8000"
+  --output=<file>       Write the table here; - means standard output
+                        [default: -]
+  -h --help             Show this screen
+  --version             Show version
+  -v --verbose          Display debugging information
+"""
+
+import sys
+import logging
+
+import voitools
+from voitools import voi
+from voitools import catalog
+from voitools.vendor import docopt
+
+logger = voi.logger
+
+QUERY_COLUMNS = ("path", "voi_number", "name", "voxel_count", "volume_mm3")
+
+
+def main(argv):
+    arguments = docopt.docopt(
+        __doc__,
+        argv,
+        version="voitools {0}".format(voitools.__version__))
+    voi.log_to_stderr()
+    logger.setLevel(logging.INFO)
+    if arguments['--verbose']:
+        logger.setLevel(logging.DEBUG)
+    logger.debug(arguments)
+    with catalog.Catalog(arguments['<catalog>']) as cat:
+        if arguments['scan']:
+            scan(cat, arguments)
+        else:
+            query(cat, arguments)
+
+
+def scan(cat, arguments):
+    added, unchanged, failed = cat.scan(
+        arguments['<path>'], int(arguments['--jobs']))
+    logger.info("Added {0} files, {1} unchanged, {2} failed".format(
+        added, unchanged, failed))
+    if failed:
+        sys.exit(1)
+
+
+def query(cat, arguments):
+    rows = cat.query(
+        name=arguments['--name'],
+        min_voxels=optional_int(arguments['--min-voxels']),
+        max_voxels=optional_int(arguments['--max-voxels']),
+        where=arguments['--where'],
+        columns=QUERY_COLUMNS)
+    output = arguments['--output']
+    if output == "-":
+        write_table(sys.stdout, rows)
+    else:
+        with open(output, 'w') as f:
+            write_table(f, rows)
+
+
+def optional_int(value):
+    return None if value is None else int(value)
+
+
+def write_table(out, rows):
+    out.write("\t".join(QUERY_COLUMNS) + "\n")
+    for row in rows:
+        out.write("\t".join("{0}".format(value) for value in row) + "\n")
+
+
+def console():
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    console()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Part of the voitools package
+# Copyright 2015 Board of Regents of the University of Wisconsin System
+# Licensed under the MIT license; see LICENSE at the root of the package.
+
+# Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+# Imaging and Behavior.
+
+"""Rewrite a spamalize .voi file with its voxel data in another format or
+byte order.
+
+Everything else in the file -- the headers, in order, and the lines between
+VOIs -- is kept as it was, so converting a file and converting it back gives
+the same bytes. "LONG coordinate index" files are much smaller and faster to
+read than text ones. <output> may be <datafile>; it's replaced only once the
+new file is written.
+
+Formats are long ("LONG coordinate index"), text-index ("Text coordinate
+index") and text-triple ("Text coordinate triple").
+
+Usage:
+  voi_convert [options] <datafile> <output>
+  voi_convert -h | --help
+
+Options:
+  --format=<format>     Write voxel data in this format [default: long]
+  --byte-order=<order>  BIG_ENDIAN or LITTLE_ENDIAN; defaults to the input's
+  --check               Read the output back, and check it has the same
+                        VOIs as the input
+  -h --help             Show this screen
+  --version             Show version
+  -v --verbose          Display debugging information
+"""
+
+import sys
+import logging
+import os
+import shutil
+import tempfile
+
+import voitools
+from voitools import lazy
+from voitools import voi
+from voitools.vendor import docopt
+
+np = lazy.module("numpy")
+
+logger = voi.logger
+
+FORMATS = {
+    "long": voi.LONG_INDEX,
+    "text-index": voi.TEXT_INDEX,
+    "text-triple": voi.TEXT_TRIPLE,
+}
+
+
+def main(argv):
+    arguments = docopt.docopt(
+        __doc__,
+        argv,
+        version="voitools {0}".format(voitools.__version__))
+    voi.log_to_stderr()
+    logger.setLevel(logging.INFO)
+    if arguments['--verbose']:
+        logger.setLevel(logging.DEBUG)
+    logger.debug(arguments)
+    data_format = FORMATS.get(arguments['--format'])
+    if data_format is None:
+        logger.error("--format must be one of {0}".format(
+            ", ".join(sorted(FORMATS))))
+        sys.exit(1)
+    byte_order = arguments['--byte-order']
+    if byte_order is not None and byte_order not in voi.BYTE_ORDER_TYPES:
+        logger.error("--byte-order must be BIG_ENDIAN or LITTLE_ENDIAN")
+        sys.exit(1)
+    convert(
+        arguments['<datafile>'], arguments['<output>'], data_format,
+        byte_order, arguments['--check'])
+
+
+def convert(datafile, output, data_format, byte_order=None, check=False):
+    """
+    Write the VOI group in datafile to output, by way of a temporary file in
+    the same directory, so output is never left half-written. The new file
+    gets datafile's permissions.
+    """
+    voi_group = voi.read_file(datafile, cache=None)
+    out_dir = os.path.dirname(os.path.abspath(output))
+    fd, tmp_name = tempfile.mkstemp(suffix=".voi", dir=out_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            voi.write_file(voi_group, f, data_format, byte_order)
+        shutil.copymode(datafile, tmp_name)
+        if check:
+            check_output(voi_group, tmp_name)
+        os.rename(tmp_name, output)
+    except Exception:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+    logger.info("Wrote {0} VOIs to {1} as {2}".format(
+        len(voi_group.vois), output, data_format))
+
+
+def check_output(voi_group, filename):
+    """
+    Raise VOIFileError unless filename has the same VOIs, with the same
+    voxels, as voi_group.
+    """
+    written = voi.read_file(filename, cache=None)
+    same = len(written.vois) == len(voi_group.vois) and all(
+        w.voi_number == v.voi_number and w.name == v.name and
+        np.array_equal(w.voxel_indexes, v.voxel_indexes)
+        for w, v in zip(written.vois, voi_group.vois))
+    if not same:
+        raise voi.VOIFileError(
+            "{0} doesn't read back the same as the input".format(filename))
+
+
+def console():
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    console()
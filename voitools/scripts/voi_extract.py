@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Part of the voitools package
+# Copyright 2015 Board of Regents of the University of Wisconsin System
+# Licensed under the MIT license; see LICENSE at the root of the package.
+
+# Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+# Imaging and Behavior.
+
+"""Extract time series from a 4D nifti image within each VOI of a .voi file.
+
+The image must be on the VOI group's grid. Each VOI's voxels are read
+straight from the image, a chunk of time points at a time; no masks are
+made. The output has one row per time point; tab-separated output has a
+"volume" column and then one column per VOI and statistic, named like
+"3_mean" for the mean of VOI 3. .npy output holds a float64 array of
+shape (statistics, time points, VOIs).
+
+Usage:
+  voi_extract [options] <datafile> <image>
+  voi_extract -h | --help
+
+Options:
+  --output=<file>       Write the table here; files ending in .npy get a
+                        numpy array, anything else is tab-separated text.
+                        - means standard output [default: -]
+  --stats=<names>       The statistics to compute, separated by commas:
+                        mean, median, std [default: mean]
+  --voi-numbers=<nums>  The indexes (starting from 1) of the VOIs to use.
+                        Separate with commas. If not specified, uses all
+                        VOIs.
+  --chunk-volumes=<n>   Read this many time points at a time. If not
+                        specified, reads about 16M voxels at a time.
+  --no-cache            Don't read or store parsed VOI files in the cache
+                        ($VOITOOLS_CACHE_DIR, or ~/.cache/voitools)
+  -h --help             Show this screen
+  --version             Show version
+  -v --verbose          Display debugging information
+"""
+
+import sys
+import logging
+
+import voitools
+from voitools import lazy
+from voitools import voi
+from voitools import extract
+from voitools.cache import VOICache
+from voitools.vendor import docopt
+
+np = lazy.module("numpy")
+
+logger = voi.logger
+
+
+def main(argv):
+    arguments = docopt.docopt(
+        __doc__,
+        argv,
+        version="voitools {0}".format(voitools.__version__))
+    voi.log_to_stderr()
+    logger.setLevel(logging.INFO)
+    if arguments['--verbose']:
+        logger.setLevel(logging.DEBUG)
+    logger.debug(arguments)
+    statistics = arguments['--stats'].split(",")
+    unknown = [s for s in statistics if s not in extract.STATISTICS]
+    if unknown:
+        logger.error("Unknown statistics {0}; --stats can use {1}".format(
+            ", ".join(unknown), ", ".join(extract.STATISTICS)))
+        sys.exit(1)
+    cache = None if arguments['--no-cache'] else VOICache()
+    voi_group = voi.read_file(
+        arguments['<datafile>'],
+        voi.parse_voi_numbers(arguments['--voi-numbers']),
+        cache=cache)
+    chunk_volumes = None
+    if arguments['--chunk-volumes']:
+        chunk_volumes = int(arguments['--chunk-volumes'])
+    results = extract.extract_file(
+        voi_group.vois, arguments['<image>'], statistics, chunk_volumes)
+    output = arguments['--output']
+    if output.endswith(".npy"):
+        np.save(output, np.array(list(results.values())))
+    elif output == "-":
+        write_table(sys.stdout, voi_group.vois, results)
+    else:
+        with open(output, 'w') as f:
+            write_table(f, voi_group.vois, results)
+
+
+def write_table(out, vois, results):
+    columns = ["volume"]
+    series = []
+    for i, cur_voi in enumerate(vois):
+        for stat, values in results.items():
+            columns.append("{0}_{1}".format(cur_voi.voi_number, stat))
+            series.append(values[:, i])
+    out.write("\t".join(columns) + "\n")
+    time_points = len(series[0]) if series else 0
+    for t in range(time_points):
+        out.write("\t".join(
+            [str(t)] + ["{0:.6g}".format(s[t]) for s in series]) + "\n")
+
+
+def console():
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    console()
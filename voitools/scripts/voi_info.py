@@ -9,11 +9,21 @@
 
 """Print information about a spamalize .voi file.
 
+Normally, prints the group and VOI headers. With --stats, reads the voxels
+and prints a tab-separated table with a row for each VOI: its number and
+name, its number of voxels and volume in mm^3, its centre of mass in voxel
+and world coordinates (with the default centered affine), its bounding box
+in voxels (stop is one past the last voxel), and how many of its voxels
+are on its boundary.
+
 Usage:
   voi_info [options] <datafile>
   voi_info -h | --help
 
 Options:
+  --stats                   Print the table of VOI statistics
+  --no-cache                Don't read or store parsed VOI files in the
+                            cache ($VOITOOLS_CACHE_DIR, or ~/.cache/voitools)
   -h --help                 Show this screen
   --version                 Show version
   -v --verbose              Display debugging information
@@ -23,8 +33,15 @@ import sys
 import voitools
 from voitools import voi
 import logging
+from voitools.cache import VOICache
 from voitools.vendor import docopt
 
+STATS_COLUMNS = (
+    "voi_number", "name", "voxels", "volume_mm3",
+    "com_x", "com_y", "com_z", "world_x", "world_y", "world_z",
+    "x_start", "y_start", "z_start", "x_stop", "y_stop", "z_stop",
+    "boundary_voxels")
+
 
 def main(argv):
     arguments = docopt.docopt(
@@ -32,13 +49,17 @@ def main(argv):
         argv,
         version="voitools {0}".format(voitools.__version__)
     )
+    voi.log_to_stderr()
     if arguments["--verbose"]:
         voi.logger.setLevel(logging.DEBUG)
-    print_voi_info(arguments)
+    if arguments["--stats"]:
+        print_voi_stats(arguments)
+    else:
+        print_voi_info(arguments)
 
 
 def print_voi_info(arguments):
-    voi_data = voi.read_file(arguments['<datafile>'])
+    voi_data = voi.read_headers(arguments['<datafile>'])
     print("VOI Group Header")
     for k, v in voi_data.header.iteritems():
         print("{0}: {1}".format(k, v))
@@ -48,6 +69,30 @@ def print_voi_info(arguments):
             print("  {0}: {1}".format(k, v))
 
 
+def print_voi_stats(arguments):
+    cache = None if arguments['--no-cache'] else VOICache()
+    voi_group = voi.read_file(arguments['<datafile>'], cache=cache)
+    print("\t".join(STATS_COLUMNS))
+    rows = zip(
+        voi_group.vois,
+        voi_group.volumes_mm3(),
+        voi_group.centers_of_mass(),
+        voi_group.world_centers_of_mass(),
+        voi_group.bounding_boxes(),
+        voi_group.boundary_voxel_counts())
+    for cur_voi, volume, com, world, box, boundary in rows:
+        # Empty VOIs have no bounding box
+        box_values = [""] * 6
+        if box is not None:
+            box_values = list(box.start) + list(box.stop)
+        values = (
+            [cur_voi.voi_number, cur_voi.name, len(cur_voi.voxel_indexes),
+             "{0:g}".format(volume)] +
+            ["{0:.2f}".format(c) for c in list(com) + list(world)] +
+            box_values + [boundary])
+        print("\t".join("{0}".format(v) for v in values))
+
+
 def console():
     main(sys.argv[1:])
 
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Part of the voitools package
+# Copyright 2015 Board of Regents of the University of Wisconsin System
+# Licensed under the MIT license; see LICENSE at the root of the package.
+
+# Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+# Imaging and Behavior.
+
+"""Compute the overlap between every pair of VOIs, as a CSV table.
+
+With one .voi file, every VOI in it is compared with every other; with two
+(say, from two raters), every VOI in the first is compared with every VOI
+in the second. Both files must be on the same grid. Rows are VOIs from the
+first file and columns VOIs from the second, labelled like "2 caudate R".
+
+Usage:
+  voi_overlap [options] <datafile> [<other_datafile>]
+  voi_overlap -h | --help
+
+Options:
+  --measure=<name>      dice, jaccard, or intersection (the number of
+                        voxels in common) [default: dice]
+  --output=<file>       Write the table here; - means standard output
+                        [default: -]
+  --no-cache            Don't read or store parsed VOI files in the cache
+                        ($VOITOOLS_CACHE_DIR, or ~/.cache/voitools)
+  -h --help             Show this screen
+  --version             Show version
+  -v --verbose          Display debugging information
+"""
+
+import sys
+import csv
+import logging
+
+import voitools
+from voitools import voi
+from voitools import sets
+from voitools.cache import VOICache
+from voitools.vendor import docopt
+
+logger = voi.logger
+
+
+def main(argv):
+    arguments = docopt.docopt(
+        __doc__,
+        argv,
+        version="voitools {0}".format(voitools.__version__))
+    voi.log_to_stderr()
+    logger.setLevel(logging.INFO)
+    if arguments['--verbose']:
+        logger.setLevel(logging.DEBUG)
+    logger.debug(arguments)
+    if arguments['--measure'] not in sets.MEASURES:
+        logger.error("--measure must be one of {0}".format(
+            ", ".join(sets.MEASURES)))
+        sys.exit(1)
+    cache = None if arguments['--no-cache'] else VOICache()
+    group_a = voi.read_file(arguments['<datafile>'], cache=cache)
+    group_b = group_a
+    if arguments['<other_datafile>']:
+        group_b = voi.read_file(arguments['<other_datafile>'], cache=cache)
+        if not group_a.shape == group_b.shape:
+            logger.error("Can't compare VOIs on grids {0} and {1}".format(
+                tuple(group_a.shape), tuple(group_b.shape)))
+            sys.exit(1)
+    matrix = sets.overlap_matrix(
+        group_a.vois, group_b.vois, arguments['--measure'])
+    output = arguments['--output']
+    if output == "-":
+        write_csv(sys.stdout, group_a.vois, group_b.vois, matrix)
+    else:
+        with open(output, 'w') as f:
+            write_csv(f, group_a.vois, group_b.vois, matrix)
+
+
+def voi_label(cur_voi):
+    return "{0} {1}".format(cur_voi.voi_number, cur_voi.name)
+
+
+def write_csv(out, vois_a, vois_b, matrix):
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow([""] + [voi_label(v) for v in vois_b])
+    for cur_voi, row in zip(vois_a, matrix):
+        writer.writerow([voi_label(cur_voi)] + [
+            "{0:.6g}".format(value) for value in row])
+
+
+def console():
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    console()
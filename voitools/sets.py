@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+Set operations and overlap measures on VOIs, done on their voxel indexes
+rather than on volumes. The set operations take sorted arrays of unique
+voxel indexes (see sorted_indexes()) and return the same.
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+from voitools import lazy
+
+np = lazy.module("numpy")
+
+MEASURES = ("dice", "jaccard", "intersection")
+
+
+def sorted_indexes(voxel_indexes):
+    """
+    voxel_indexes (say, a VOI's) sorted, without repeats.
+    """
+    return np.unique(voxel_indexes)
+
+
+def _found_in(values, sorted_array):
+    """
+    A boolean array: which of values are in sorted_array.
+    """
+    if not len(sorted_array):
+        return np.zeros(len(values), dtype=bool)
+    positions = np.searchsorted(sorted_array, values)
+    positions[positions == len(sorted_array)] = 0
+    return sorted_array[positions] == values
+
+
+def intersection(a, b):
+    return a[_found_in(a, b)]
+
+
+def difference(a, b):
+    """
+    The voxels of a that aren't in b.
+    """
+    return a[~_found_in(a, b)]
+
+
+def union(a, b):
+    extra = difference(b, a)
+    return np.insert(a, np.searchsorted(a, extra), extra)
+
+
+def intersection_counts(index_lists_a, index_lists_b):
+    """
+    The number of voxels each of index_lists_a shares with each of
+    index_lists_b, as a (len(a), len(b)) array. The lists must be sorted
+    and unique.
+
+    Every voxel of b is tagged with its list's number and sorted; for each
+    list in a, we look up where its voxels fall in that, and count the tags.
+    """
+    counts = np.zeros((len(index_lists_a), len(index_lists_b)), dtype=np.intp)
+    if not len(index_lists_b):
+        return counts
+    voxels = np.concatenate(index_lists_b)
+    tags = np.repeat(
+        np.arange(len(index_lists_b)), [len(b) for b in index_lists_b])
+    order = np.argsort(voxels, kind='mergesort')
+    voxels = voxels[order]
+    tags = tags[order]
+    for i, a in enumerate(index_lists_a):
+        starts = np.searchsorted(voxels, a, 'left')
+        lengths = np.searchsorted(voxels, a, 'right') - starts
+        # The positions of all the runs of tags we want, end to end
+        positions = np.arange(lengths.sum()) + np.repeat(
+            starts - (np.cumsum(lengths) - lengths), lengths)
+        counts[i] = np.bincount(tags[positions], minlength=len(index_lists_b))
+    return counts
+
+
+def overlap_matrix(vois_a, vois_b=None, measure="dice"):
+    """
+    The overlap of every VOI in vois_a with every VOI in vois_b (or with
+    each other, if vois_b is None), as a (len(a), len(b)) array. measure is
+    "dice", "jaccard", or "intersection" (the number of shared voxels).
+    Pairs of empty VOIs get NaN for dice and jaccard.
+    """
+    if measure not in MEASURES:
+        raise ValueError("measure must be one of {0}".format(
+            ", ".join(MEASURES)))
+    index_lists_a = [sorted_indexes(v.voxel_indexes) for v in vois_a]
+    if vois_b is None:
+        index_lists_b = index_lists_a
+    else:
+        index_lists_b = [sorted_indexes(v.voxel_indexes) for v in vois_b]
+    shared = intersection_counts(index_lists_a, index_lists_b)
+    if measure == "intersection":
+        return shared
+    sizes_a = np.array([len(a) for a in index_lists_a])[:, np.newaxis]
+    sizes_b = np.array([len(b) for b in index_lists_b])[np.newaxis, :]
+    if measure == "dice":
+        numerator = 2.0 * shared
+        denominator = sizes_a + sizes_b
+    else:
+        numerator = shared.astype(np.float64)
+        denominator = sizes_a + sizes_b - shared
+    out = np.full(shared.shape, np.nan)
+    nonzero = denominator > 0
+    out[nonzero] = numerator[nonzero] / denominator[nonzero]
+    return out
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Part of the voitools package
+Copyright 2015 Board of Regents of the University of Wisconsin System
+Licensed under the MIT license; see LICENSE at the root of the package.
+
+Authored by Nate Vack <njvack@wisc.edu> at the Waisman Laboratory for Brain
+Imaging and Behavior.
+
+Per-phase timing and memory instrumentation. Code marks out its phases with
+
+    with stats.phase("to_volume", voi_number, io) as p:
+        ...
+
+and, until enable() is called, phase() returns a do-nothing context
+manager, so instrumented code costs next to nothing when nobody's looking.
+
+Memory is measured three ways, as available:
+
+peak_alloc_kb        The most memory allocated during the phase, beyond
+                     what was allocated when it started (tracemalloc; only
+                     on python 3.4+, otherwise None)
+rss_growth_kb        How much the process's peak resident set size rose
+                     during the phase. Works everywhere, but it's 0 for
+                     phases that don't use more memory than the process
+                     already has at some point, so it's a lower bound.
+process_max_rss_kb   The process's peak resident set size so far, when the
+                     phase ended; not a per-phase figure.
+"""
+
+from __future__ import (
+    print_function,
+    unicode_literals,
+    division,
+    absolute_import)
+
+import json
+import os
+import resource
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from voitools.vendor.ordereddict import OrderedDict
+
+_recorder = None
+
+
+def enable(trace_memory=True):
+    """
+    Start recording phases. If trace_memory is True and tracemalloc is
+    available (python 3.4+), each phase's peak allocation is recorded too;
+    growth of the peak RSS is always recorded. Returns the new Recorder.
+    """
+    global _recorder
+    _recorder = Recorder(trace_memory and tracemalloc is not None)
+    return _recorder
+
+
+def disable():
+    global _recorder
+    if _recorder is not None and _recorder.started_tracing:
+        tracemalloc.stop()
+    _recorder = None
+
+
+def active():
+    """
+    The current Recorder, or None.
+    """
+    return _recorder
+
+
+def phase(name, voi_number=None, io=None):
+    """
+    A context manager timing one phase of work. If io is given, the bytes
+    read from it during the phase are recorded.
+    """
+    if _recorder is None:
+        return _NULL_PHASE
+    return _Phase(_recorder, name, voi_number, io)
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+    def record_written(self, filename):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+def _tell(io):
+    try:
+        return io.tell()
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+
+def _max_rss_kb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # macOS reports bytes, everyone else kB
+        usage = usage // 1024
+    return usage
+
+
+class _Phase(object):
+    def __init__(self, recorder, name, voi_number, io):
+        super(_Phase, self).__init__()
+        self.recorder = recorder
+        self.name = name
+        self.voi_number = voi_number
+        self.io = io
+        self.bytes_written = 0
+
+    def __enter__(self):
+        if self.recorder.trace_memory:
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self.start_traced = tracemalloc.get_traced_memory()[0]
+        self.start_pos = _tell(self.io) if self.io is not None else None
+        self.start_max_rss = _max_rss_kb()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        elapsed = time.time() - self.start
+        max_rss = _max_rss_kb()
+        event = OrderedDict([
+            ('phase', self.name),
+            ('voi_number', self.voi_number),
+            ('seconds', elapsed),
+            ('bytes_read', 0),
+            ('bytes_written', self.bytes_written),
+            ('peak_alloc_kb', None),
+            ('rss_growth_kb', max_rss - self.start_max_rss),
+            ('process_max_rss_kb', max_rss),
+        ])
+        if self.start_pos is not None:
+            end_pos = _tell(self.io)
+            if end_pos is not None:
+                event['bytes_read'] = end_pos - self.start_pos
+        if self.recorder.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            event['peak_alloc_kb'] = max(peak - self.start_traced, 0) // 1024
+        self.recorder.events.append(event)
+        return False
+
+    def record_written(self, filename):
+        self.bytes_written += os.path.getsize(filename)
+
+
+class Recorder(object):
+    def __init__(self, trace_memory=False):
+        super(Recorder, self).__init__()
+        self.trace_memory = trace_memory
+        self.events = []
+        self.started_tracing = False
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    def summary(self):
+        """
+        Totals for each phase, in the order phases first appeared. The
+        peak_alloc_kb and process_max_rss_kb are the largest of any call.
+        """
+        totals = OrderedDict()
+        for event in self.events:
+            total = totals.setdefault(event['phase'], OrderedDict([
+                ('phase', event['phase']),
+                ('calls', 0),
+                ('seconds', 0.0),
+                ('bytes_read', 0),
+                ('bytes_written', 0),
+                ('peak_alloc_kb', None),
+                ('rss_growth_kb', 0),
+                ('process_max_rss_kb', 0),
+            ]))
+            total['calls'] += 1
+            for k in [
+                    'seconds', 'bytes_read', 'bytes_written',
+                    'rss_growth_kb']:
+                total[k] += event[k]
+            if event['peak_alloc_kb'] is not None:
+                total['peak_alloc_kb'] = max(
+                    total['peak_alloc_kb'] or 0, event['peak_alloc_kb'])
+            total['process_max_rss_kb'] = max(
+                total['process_max_rss_kb'], event['process_max_rss_kb'])
+        return list(totals.values())
+
+    def per_voi(self):
+        """
+        Seconds spent on each VOI, by phase.
+        """
+        vois = OrderedDict()
+        for event in self.events:
+            if event['voi_number'] is None:
+                continue
+            key = (event.get('file'), event['voi_number'])
+            phases = vois.setdefault(key, OrderedDict())
+            phases[event['phase']] = (
+                phases.get(event['phase'], 0.0) + event['seconds'])
+        return vois
+
+    def write_text(self, out):
+        row = "{0:<16}{1:>8}{2:>12}{3:>14}{4:>14}{5:>16}{6:>16}{7:>20}\n"
+        out.write(row.format(
+            "phase", "calls", "seconds", "bytes read", "bytes written",
+            "alloc peak kB", "RSS growth kB", "process max RSS kB"))
+        for total in self.summary():
+            peak = total['peak_alloc_kb']
+            out.write(row.format(
+                total['phase'], total['calls'],
+                "{0:.4f}".format(total['seconds']),
+                total['bytes_read'], total['bytes_written'],
+                "-" if peak is None else peak, total['rss_growth_kb'],
+                total['process_max_rss_kb']))
+        per_voi = self.per_voi()
+        if not per_voi:
+            return
+        out.write("\nSeconds per VOI:\n")
+        for (filename, voi_number), phases in per_voi.items():
+            label = "VOI {0}".format(voi_number)
+            if filename is not None:
+                label = "{0} {1}".format(filename, label)
+            out.write("  {0}: {1}\n".format(label, ", ".join(
+                "{0} {1:.4f}".format(k, v) for k, v in phases.items())))
+
+    def write_json(self, out):
+        json.dump(OrderedDict([
+            ('summary', self.summary()),
+            ('events', self.events),
+        ]), out, indent=2)
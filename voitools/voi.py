@@ -16,45 +16,643 @@ from __future__ import (
 
 from collections import namedtuple
 from voitools.vendor.ordereddict import OrderedDict
-import numpy as np
+import logging
+import mmap
 import os
+import re
+import time
+
+from voitools import geometry
+from voitools import lazy
+from voitools import stats
+
+np = lazy.module("numpy")
 
-import logging
 logger = logging.getLogger("voi")
 logger.setLevel(logging.ERROR)
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-ch.setFormatter(logging.Formatter("%(message)s"))
-logger.addHandler(ch)
+# The scripts call log_to_stderr(); as a library, we leave that to our
+# caller.
+logger.addHandler(logging.NullHandler())
+
+
+def log_to_stderr():
+    """
+    Print our log messages (just the message) to stderr, once.
+    """
+    if any(getattr(h, '_voitools', False) for h in logger.handlers):
+        return
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    ch.setFormatter(logging.Formatter("%(message)s"))
+    ch._voitools = True
+    logger.addHandler(ch)
 
 
 Triple = namedtuple('Triple', ['x', 'y', 'z'])
 
+LONG_INDEX = "LONG coordinate index"
+TEXT_INDEX = "Text coordinate index"
+TEXT_TRIPLE = "Text coordinate triple"
+DATA_FORMATS = (LONG_INDEX, TEXT_INDEX, TEXT_TRIPLE)
+
+BYTE_ORDER_TYPES = {
+    "BIG_ENDIAN": ">i4",
+    "LITTLE_ENDIAN": "<i4",
+}
+
+# Spamalize writes files with DOS line endings
+LINE_END = "\r\n"
+
+# Where a VOI lives in a VOI group file, found by scan_vois().
+VOIOffset = namedtuple(
+    'VOIOffset', ['offset', 'data_format', 'voxel_count', 'header'])
+
+
+class BoundingBox(namedtuple('BoundingBox', ['start', 'stop'])):
+    """
+    A box of voxels in a grid, from start up to (not including) stop.
+    """
+    __slots__ = ()
+
+    @property
+    def shape(self):
+        return Triple(*[b - a for a, b in zip(self.start, self.stop)])
+
+    @property
+    def slices(self):
+        return tuple(slice(a, b) for a, b in zip(self.start, self.stop))
+
+    def crop_indexes(self, voxel_indexes, shape):
+        """
+        Convert voxel indexes in a grid of shape to indexes in this box,
+        dropping any outside it.
+        """
+        coords = np.array(
+            np.unravel_index(voxel_indexes, shape, order='F'))
+        start = np.array(self.start)[:, np.newaxis]
+        stop = np.array(self.stop)[:, np.newaxis]
+        inside = np.all((coords >= start) & (coords < stop), axis=0)
+        return np.ravel_multi_index(
+            coords[:, inside] - start, self.shape, order='F')
+
+    def crop_affine(self, affine):
+        """
+        affine, shifted so voxel (0, 0, 0) of the box lands where start did.
+        """
+        affine = np.array(affine, dtype=np.float64)
+        affine[:3, 3] = affine[:3, :3].dot(self.start) + affine[:3, 3]
+        return affine
+
+
+class VolumeBuffer(object):
+    """
+    A volume to make masks in, one after another (see VOI.to_volume()),
+    rather than allocating a new one each time. Making a mask clears just
+    the voxels set for the last one, so don't change array yourself.
+    """
+    __slots__ = ('array', '__raveled', '__set_indexes')
+
+    def __init__(self, shape, dtype="int16"):
+        super(VolumeBuffer, self).__init__()
+        self.array = np.zeros(shape, dtype=dtype, order='F')
+        self.__raveled = self.array.ravel('A')
+        self.__set_indexes = None
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    @property
+    def dtype(self):
+        return self.array.dtype
+
+    def fill(self, voxel_indexes):
+        """
+        Set voxel_indexes (in fortran order) to 1, and everything else to 0.
+        Returns array.
+        """
+        if self.__set_indexes is not None:
+            self.__raveled[self.__set_indexes] = 0
+        # Indexing converts indexes (often big-endian int32) to intp; do it
+        # once, for both setting and clearing.
+        voxel_indexes = np.asarray(voxel_indexes, dtype=np.intp)
+        self.__raveled[voxel_indexes] = 1
+        self.__set_indexes = voxel_indexes
+        return self.array
+
+
+def read_file(filename_or_io, voi_numbers=None, cache=None):
+    """
+    Read a VOI group file. If voi_numbers (starting from 1) is given, only
+    those VOIs will be read, in that order; the rest are skipped without
+    decoding their voxel data. If cache (a voitools.cache.VOICache) is
+    given, filenames are read through it.
+    """
+    if hasattr(filename_or_io, 'readline'):
+        return _read_io(filename_or_io, voi_numbers)
+    elif cache is not None:
+        return cache.read_file(filename_or_io, voi_numbers)
+    else:
+        with MappedFile(filename_or_io) as f:
+            return _read_io(f, voi_numbers)
+
+
+def read_headers(filename_or_io):
+    """
+    Read only the headers of a VOI group file. The VOIs' voxel_indexes will
+    be None; their voxel data is skipped without being decoded.
+    """
+    if hasattr(filename_or_io, 'readline'):
+        return _read_headers_io(filename_or_io)
+    else:
+        with MappedFile(filename_or_io) as f:
+            return _read_headers_io(f)
+
+
+class MappedFile(object):
+    """
+    A VOI group file, memory-mapped and read like a binary file. Lines come
+    back as native strings, as from a file opened in text mode, and
+    read_array() returns LONG voxel data as a read-only view of the map
+    rather than a copy: only the pages of VOIs that are used get read. The
+    map stays open as long as any of those views does; close() just lets
+    go of ours.
+    """
+    def __init__(self, filename):
+        super(MappedFile, self).__init__()
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                self.buffer = mmap.mmap(
+                    f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # Empty files can't be mapped
+                self.buffer = b""
+        self.position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def close(self):
+        self.buffer = None
+
+    def readline(self):
+        end = self.buffer.find(b"\n", self.position)
+        end = len(self.buffer) if end < 0 else end + 1
+        line = self.buffer[self.position:end]
+        self.position = end
+        return _native_str(line)
+
+    def read_lines(self, count):
+        """
+        The next count lines (or as many as there are), as one native str.
+        """
+        end = self.__lines_end(count)
+        lines = self.buffer[self.position:end]
+        self.position = end
+        return _native_str(lines)
+
+    def skip_lines(self, count):
+        self.position = self.__lines_end(count)
+
+    def __lines_end(self, count):
+        """
+        The position just past the count-th newline from here, or the end
+        of the map. Newlines are found with numpy, in windows that grow
+        until they hold count of them.
+        """
+        start = self.position
+        if count <= 0:
+            return start
+        size = len(self.buffer)
+        window = count * 16
+        found = 0
+        while start < size:
+            stop = min(start + window, size)
+            newlines = np.flatnonzero(np.frombuffer(
+                self.buffer, np.uint8, stop - start, start) == 10)
+            if found + len(newlines) >= count:
+                return start + int(newlines[count - found - 1]) + 1
+            found += len(newlines)
+            start = stop
+            window *= 2
+        return size
+
+    def read(self, size=-1):
+        end = len(self.buffer)
+        if size >= 0:
+            end = min(self.position + size, end)
+        data = self.buffer[self.position:end]
+        self.position = end
+        return data
+
+    def read_array(self, dtype, count):
+        """
+        The next count values of dtype, as a view of the map.
+        """
+        dtype = np.dtype(dtype)
+        if self.position + dtype.itemsize * count > len(self.buffer):
+            raise VOIFileError("file ended in voxel data")
+        data = np.frombuffer(self.buffer, dtype, count, self.position)
+        self.position += dtype.itemsize * count
+        return data
+
+    def tell(self):
+        return self.position
 
-def read_file(filename_or_io):
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += len(self.buffer)
+        self.position = max(offset, 0)
+
+
+def _native_str(data):
+    """
+    bytes from a file as a str: unchanged on Python 2, decoded on 3.
+    """
+    if isinstance(data, str):
+        return data
+    return data.decode("latin-1")
+
+
+def _read_array(io, dtype, count):
+    """
+    Read count values of dtype from io: a view, from a MappedFile, or else
+    a fresh array.
+    """
+    if hasattr(io, 'read_array'):
+        return io.read_array(dtype, count)
+    dtype = np.dtype(dtype)
+    data = io.read(dtype.itemsize * count)
+    if not len(data) == dtype.itemsize * count:
+        raise VOIFileError("file ended in voxel data")
+    return np.frombuffer(data, dtype, count)
+
+
+def _read_headers_io(io):
+    voi_group = VOIGroup.from_io(io)
+    for entry in scan_vois(voi_group, io):
+        VOI(voi_group, entry.header, None)
+    return voi_group
+
+
+def _read_io(io, voi_numbers=None):
+    voi_group = VOIGroup.from_io(io)
+    voi_group.vois.extend(_iter_group_vois(voi_group, io, voi_numbers))
+    if voi_numbers is None:
+        voi_group.raw_trailer = _native_str(io.read())
+    return voi_group
+
+
+def iter_vois(filename_or_io, voi_numbers=None, affine=None, cache=None):
+    """
+    Like read_file(), but yields each VOI as soon as it's read. The VOIs
+    share a VOIGroup (with affine set), but it doesn't keep a list of them,
+    so each one can be freed when the caller is done with it.
+    """
     if hasattr(filename_or_io, 'readline'):
-        return _read_io(filename_or_io)
+        for voi in _iter_io(filename_or_io, voi_numbers, affine):
+            yield voi
+    elif cache is not None:
+        for voi in cache.iter_vois(filename_or_io, voi_numbers, affine):
+            yield voi
     else:
-        with open(filename_or_io, 'r') as f:
-            return _read_io(f)
+        with MappedFile(filename_or_io) as f:
+            for voi in _iter_io(f, voi_numbers, affine):
+                yield voi
 
 
-def _read_io(io):
+def _iter_io(io, voi_numbers=None, affine=None):
     voi_group = VOIGroup.from_io(io)
+    voi_group.set_affine(affine)
+    for voi in _iter_group_vois(voi_group, io, voi_numbers):
+        yield voi
+
+
+def _iter_group_vois(voi_group, io, voi_numbers=None):
+    """
+    Read VOIs belonging to voi_group from io, which should be just past the
+    group header. Doesn't add them to voi_group.vois.
+    """
+    if voi_numbers is None:
+        for i in range(voi_group.voi_count):
+            yield VOI.from_io(voi_group, io, attach=False)
+        return
+    offsets = scan_vois(voi_group, io)
+    for number in voi_numbers:
+        _check_voi_number(number, len(offsets))
+        io.seek(offsets[number - 1].offset)
+        yield VOI.from_io(voi_group, io, attach=False)
+
+
+def select_vois(voi_group, voi_numbers):
+    """
+    Make a new VOIGroup with just the VOIs numbered (starting from 1) in
+    voi_numbers, in that order. Voxel indexes are shared, not copied.
+    """
+    selected = VOIGroup(voi_group.header)
+    for number in voi_numbers:
+        _check_voi_number(number, len(voi_group.vois))
+        source = voi_group.vois[number - 1]
+        VOI(selected, source.header, source.voxel_indexes)
+    return selected
+
+
+OVERLAP_POLICIES = ("first", "last", "error")
+
+
+def label_volume(vois, shape, overlap="last", dtype="int16"):
+    """
+    Make one volume where each voxel holds the number of the VOI containing
+    it, or 0. When VOIs overlap, overlap decides what happens: "first" keeps
+    the label of the earliest VOI, "last" the latest, and "error" raises a
+    VOIOverlapError.
+    """
+    if overlap not in OVERLAP_POLICIES:
+        raise ValueError("overlap must be one of {0}".format(
+            ", ".join(OVERLAP_POLICIES)))
+    vol = np.zeros(shape, dtype=dtype, order='F')
+    raveled = vol.ravel('A')
+    max_label = np.iinfo(dtype).max
+    for cur_voi in vois:
+        label = int(cur_voi.voi_number)
+        if not 0 < label <= max_label:
+            raise ValueError("can't store VOI number {0} as {1}".format(
+                label, np.dtype(dtype).name))
+        indexes = cur_voi.voxel_indexes
+        if not overlap == "last":
+            taken = raveled[indexes] != 0
+            if overlap == "error" and taken.any():
+                raise VOIOverlapError(
+                    "VOI {0} overlaps VOI {1}".format(
+                        label, raveled[indexes[taken][0]]))
+            indexes = indexes[~taken]
+        raveled[indexes] = label
+    return vol
+
+
+def bounding_box(voxel_indexes, shape, padding=0):
+    """
+    The smallest BoundingBox holding voxel_indexes (in fortran order) in a
+    grid of shape, grown by padding voxels on each side, but not past the
+    edges of the grid. None if there are no voxels.
+    """
+    return _bounding_boxes([voxel_indexes], shape, padding)[0]
+
+
+def _bounding_boxes(index_lists, shape, padding):
+    starts, stops = geometry.bounding_boxes(index_lists, shape, padding)
+    return [
+        BoundingBox(Triple(*start.tolist()), Triple(*stop.tolist()))
+        if len(indexes) else None
+        for start, stop, indexes in zip(starts, stops, index_lists)]
+
+
+def parse_voi_numbers(voi_numbers_string):
+    """
+    The VOI numbers (starting from 1) in a comma-separated string, as from a
+    --voi-numbers option, or None (meaning all VOIs) if it's None.
+    """
+    if voi_numbers_string is None:
+        return None
+    return [int(num) for num in voi_numbers_string.split(",")]
+
+
+def _check_voi_number(number, voi_count):
+    if not 1 <= number <= voi_count:
+        raise VOIFileError(
+            "no VOI number {0}; file has {1} VOIs".format(number, voi_count))
+
+
+def scan_vois(voi_group, io):
+    """
+    Find where each VOI in voi_group starts, without decoding any voxel
+    data. Assumes io is seek()ed to the start of the first VOI header (eg,
+    just after VOIGroup.from_io()). Returns a list of VOIOffsets; seek() to
+    an offset and call VOI.from_io() to read that VOI.
+    """
+    with stats.phase("scan", io=io):
+        return _scan_vois(voi_group, io)
+
+
+def _scan_vois(voi_group, io):
+    offsets = []
     for i in range(voi_group.voi_count):
-        VOI.from_io(voi_group, io)
+        offset = io.tell()
+        header, raw_header = VOI._read_header(io)
+        entry = VOIOffset(
+            offset=offset,
+            data_format=header[VOI.BEGIN_DATA],
+            voxel_count=int(header['Number of voxels']),
+            header=header)
+        _skip_data(io, entry)
+        _skip_to_next_voi(io)
+        offsets.append(entry)
+    return offsets
+
+
+def _skip_data(io, entry):
+    """
+    Move io past the voxel data of a VOI. LONG data is seeked over; text
+    data has to be read to find the ends of its lines (all at once, from a
+    MappedFile), but isn't parsed.
+    """
+    if entry.data_format == LONG_INDEX:
+        io.seek(io.tell() + 4 * entry.voxel_count)
+    elif entry.data_format in (TEXT_TRIPLE, TEXT_INDEX):
+        if hasattr(io, 'skip_lines'):
+            io.skip_lines(entry.voxel_count)
+            return
+        for i in range(entry.voxel_count):
+            io.readline()
+    else:
+        raise VOIFileError(
+            "unknown voxel data format {0}".format(entry.data_format))
+
+
+def _skip_to_next_voi(io):
+    """
+    Assumes we're at the end of the voxel data, we'll read lines until we
+    get to END_VOI, and then another couple to leave us at the start of
+    the next VOI header. Returns the text we skipped.
+    """
+    lines = []
+    while True:
+        line = io.readline()
+        if not line:
+            raise VOIFileError("file ended before {0}".format(VOI.END_VOI))
+        lines.append(line)
+        parts = [p.strip() for p in line.split("=")]
+        if len(parts) == 2 and parts[0] == VOI.END_VOI:
+            break
+    # There are two lines we can ignore here...
+    lines.append(io.readline())
+    lines.append(io.readline())
+    return "".join(lines)
+
+
+def write_file(
+        voi_group, filename_or_io, data_format=LONG_INDEX, byte_order=None):
+    """
+    Write voi_group as a VOI group file, with voxel data in data_format.
+    byte_order ("BIG_ENDIAN" or "LITTLE_ENDIAN") defaults to the group's.
+    Files are written in binary mode.
+    """
+    if hasattr(filename_or_io, 'write'):
+        voi_group.to_io(filename_or_io, data_format, byte_order)
+    else:
+        with open(filename_or_io, 'wb') as f:
+            voi_group.to_io(f, data_format, byte_order)
+
+
+def group_from_masks(masks, voxel_dimensions, names=None, **kwargs):
+    """
+    Make a VOIGroup with one VOI per 3D mask (all the same shape), made of
+    the mask's nonzero voxels. Other arguments are passed to VOIGroup.new().
+    """
+    masks = list(masks)
+    if names is None:
+        names = ["VOI {0}".format(i + 1) for i in range(len(masks))]
+    voi_group = VOIGroup.new(masks[0].shape, voxel_dimensions, **kwargs)
+    for mask, name in zip(masks, names):
+        if not mask.shape == masks[0].shape:
+            raise ValueError("masks must all be the same shape")
+        VOI.new(voi_group, np.flatnonzero(mask.ravel(order='F')), name)
     return voi_group
 
 
+def group_from_labels(labels, voxel_dimensions, names=None, **kwargs):
+    """
+    Make a VOIGroup from a 3D integer label volume, with one VOI for each
+    distinct nonzero label, in label order. names maps labels to VOI names;
+    unnamed labels are called "label <n>". Other arguments are passed to
+    VOIGroup.new(). Returns the group and a list of each VOI's label.
+    """
+    names = names or {}
+    flat = np.asarray(labels).ravel(order='F')
+    voxels = np.flatnonzero(flat)
+    # A stable sort keeps each label's voxels in index order.
+    order = np.argsort(flat[voxels], kind='mergesort')
+    sorted_labels = flat[voxels][order]
+    sorted_voxels = voxels[order]
+    label_values, starts = np.unique(sorted_labels, return_index=True)
+    voi_group = VOIGroup.new(labels.shape, voxel_dimensions, **kwargs)
+    bounds = list(starts[1:]) + [len(sorted_voxels)]
+    for label, start, stop in zip(label_values.tolist(), starts, bounds):
+        name = names.get(label, "label {0}".format(label))
+        VOI.new(voi_group, sorted_voxels[start:stop], name)
+    return voi_group, label_values.tolist()
+
+
+def _timestamp():
+    return time.strftime("%Y%m%d_%H%M%S")
+
+
+def _write_lines(io, lines, line_end=LINE_END):
+    io.write("".join(
+        line + line_end for line in lines).encode("utf-8"))
+
+
+def _write_raw(io, text):
+    """
+    Write text as read from a file (see _native_str()) back out unchanged.
+    """
+    if not isinstance(text, bytes):
+        text = text.encode("latin-1")
+    io.write(text)
+
+
+def _line_end(text):
+    return "\r\n" if text.endswith("\r\n") else "\n"
+
+
+def _replace_field(text, key, value):
+    """
+    Change the value of the first "key = value" line in text, keeping the
+    rest of the text -- spacing, line endings -- as it was.
+    """
+    pattern = re.compile(
+        r"^(" + re.escape(key) + r"[ \t]*=[ \t]*)[^\r\n]*", re.M)
+    # Keep text's type (bytes on Python 2)
+    return pattern.sub(
+        lambda m: m.group(1) + type(m.group(1))(value), text, count=1)
+
+
 class VOIGroup(object):
+    """
+    header is kept as read, for voi_info and for writing; the fields we use
+    (shape, voxel_dimensions, voi_count, byte_order and data_type_string)
+    are parsed from it once, here, so a malformed header is caught at read
+    time. Changing header afterwards doesn't change them.
+
+    Groups read whole from a file also keep the text of their header
+    (raw_header) and of what follows the last VOI (raw_trailer), so they
+    can be written back exactly as they were; see to_io().
+    """
+    __slots__ = (
+        'header', 'vois', '__affine', 'shape', 'voxel_dimensions',
+        'voi_count', 'byte_order', 'data_type_string', 'raw_header',
+        'raw_trailer')
+
     def __init__(self, header, vois=None, affine=None):
         super(VOIGroup, self).__init__()
         self.header = header
         self.vois = vois or []
         self.__affine = affine
+        self.raw_header = None
+        self.raw_trailer = None
+        self.shape = _parse_triple(header, "{0} dim", "XYZ", int)
+        self.voxel_dimensions = _parse_triple(
+            header, "{0} pixdim", "XYZ", float)
+        self.voi_count = _parse_field(header, 'Number of VOIs', int)
+        self.byte_order = _parse_field(header, 'Byte Order', str)
+        if self.byte_order not in BYTE_ORDER_TYPES:
+            raise VOIFileError(
+                "unknown byte order {0}".format(self.byte_order))
+        self.data_type_string = BYTE_ORDER_TYPES[self.byte_order]
 
     BEGIN_HEADER = "******** VOIGroup File *********"
+    PROGRAM_LINE = "*** Program name: VOIGroup, from the SPAMALIZE package.***"
     END_HEADER = "-----------------------------------"
+    # When writing, we put a blank line before each of these keys.
+    SECTION_KEYS = set([
+        'Date and time of file creation or last update', 'Creator',
+        'Byte Order', 'Number of VOIs', 'X dim', 'Color'])
+
+    @classmethod
+    def new(
+            kls, shape, voxel_dimensions,
+            byte_order="BIG_ENDIAN", filename="", base_filename=""):
+        """
+        Make an empty VOIGroup for a grid of the given shape and voxel
+        dimensions, with the header fields Spamalize writes. The VOI count
+        fields, like the VOI names and colors, are written from vois by
+        to_io().
+        """
+        header = OrderedDict([
+            ('Date and time of file creation or last update', _timestamp()),
+            ('Original file name', filename),
+            ('Current file name', filename),
+            ('Image-base file name', base_filename),
+            ('Creator', 'Unknown'),
+            ('Owner', 'Unknown'),
+            ('Byte Order', byte_order),
+            ('Number of VOIs', '0'),
+            ('VOI name', ''),
+            ('Current VOI', '0'),
+            ('Last mode', 'voxel'),
+        ])
+        for axis, dim in zip("XYZ", shape):
+            header['{0} dim'.format(axis)] = str(int(dim))
+        for axis, pixdim in zip("XYZ", voxel_dimensions):
+            header['{0} pixdim'.format(axis)] = "{0:.5f}".format(pixdim)
+        header['Color'] = ''
+        return kls(header)
 
     @classmethod
     def from_io(kls, io):
@@ -62,50 +660,119 @@ class VOIGroup(object):
         readable is assumed to be seek()ed to the start of the data -- in this
         case, that will generally be the start of the file.
         """
+        with stats.phase("group_header", io=io):
+            header, raw_header = kls._read_header(io)
+        voi_group = kls(header)
+        voi_group.raw_header = raw_header
+        return voi_group
+
+    @classmethod
+    def _read_header(kls, io):
+        """
+        Returns the header, and its text.
+        """
         header = OrderedDict()
-        header_start_line = io.readline().strip()
-        if not header_start_line == kls.BEGIN_HEADER:
+        lines = [io.readline()]
+        if not lines[0].strip() == kls.BEGIN_HEADER:
             raise VOIFileError(
                 "file does not start with {0}".format(kls.BEGIN_HEADER))
         while True:
-            line = io.readline().strip()
-            logger.debug("Main header read {0}".format(line))
+            lines.append(io.readline())
+            if not lines[-1]:
+                raise VOIFileError("file ended in the group header")
+            line = lines[-1].strip()
+            logger.debug("Main header read %s", line)
             if line == kls.END_HEADER:
                 logger.debug("Main header end")
                 break
             parts = [p.strip() for p in line.split("=", 1)]
             if len(parts) == 2:
                 k, v = parts
-                logger.debug("Setting {0} to {1}".format(k, v))
+                logger.debug("Setting %s to %s", k, v)
                 header[parts[0]] = parts[1]
-        return kls(header)
+        return header, "".join(lines)
 
-    @property
-    def data_type_string(self):
-        return {
-            "BIG_ENDIAN": ">i4",
-            "LITTLE_ENDIAN": "<i4"
-        }[self.header["Byte Order"]]
+    def to_io(self, io, data_format=LONG_INDEX, byte_order=None):
+        """
+        Write the group header and all our VOIs to the binary stream io.
 
-    @property
-    def voi_count(self):
-        return int(self.header['Number of VOIs'])
+        If we were read whole from a file, and still have all our VOIs with
+        the voxels they were read with, the text of our headers is written
+        back as it was read, with just the byte order and data format lines
+        changed; converting a file and back again gives the same bytes.
+        (Changes to the header dicts are ignored then; set raw_header to
+        None to write new headers.) Otherwise, we write new headers, as
+        Spamalize does.
+        """
+        byte_order = byte_order or self.byte_order
+        dtype = BYTE_ORDER_TYPES[byte_order]
+        if self.__as_read():
+            self.__to_io_raw(io, data_format, byte_order, dtype)
+            return
+        _write_lines(io, self._header_lines(byte_order))
+        for i, voi in enumerate(self.vois):
+            voi.to_io(io, i + 1, data_format, dtype)
+            if i + 1 < len(self.vois):
+                _write_lines(io, [self.END_HEADER])
+        _write_lines(io, [
+            " ", "Finished writing VOIGroup at {0}".format(_timestamp()),
+            "END"])
+
+    def __as_read(self):
+        """
+        Whether we, and our VOIs, are as read from a file.
+        """
+        if self.raw_header is None or self.raw_trailer is None:
+            return False
+        if not len(self.vois) == self.voi_count:
+            return False
+        return all(
+            voi.raw_header is not None and voi.raw_trailer is not None and
+            voi.voxel_indexes is not None and
+            len(voi.voxel_indexes) == voi.voxel_count
+            for voi in self.vois)
+
+    def __to_io_raw(self, io, data_format, byte_order, dtype):
+        _write_raw(
+            io, _replace_field(self.raw_header, 'Byte Order', byte_order))
+        for voi in self.vois:
+            voi._to_io_raw(io, data_format, dtype)
+        _write_raw(io, self.raw_trailer)
+
+    def _header_lines(self, byte_order):
+        lines = [self.BEGIN_HEADER, self.PROGRAM_LINE]
+        for k, v in self.header.items():
+            if k in self.SECTION_KEYS:
+                lines.append(" ")
+            if k == 'VOI name':
+                lines.extend(
+                    "VOI name  = {0}".format(voi.name) for voi in self.vois)
+            elif k == 'Color':
+                lines.extend(
+                    "Color = {0} = {1}".format(
+                        voi.header.get('color', '255, 0, 0'), i + 1)
+                    for i, voi in enumerate(self.vois))
+            elif k in ('Number of VOIs', 'Current VOI'):
+                # Spamalize leaves the last VOI current
+                lines.append("{0} = {1}".format(k, len(self.vois)))
+            elif k == 'Byte Order':
+                lines.append("{0} = {1}".format(k, byte_order))
+            else:
+                lines.append("{0} = {1}".format(k, v))
+        lines.extend([" ", self.END_HEADER])
+        return lines
 
     @property
-    def voxel_dimensions(self):
-        return Triple(
-            float(self.header['X pixdim']),
-            float(self.header['Y pixdim']),
-            float(self.header['Z pixdim']),
-        )
+    def base_name(self):
+        f = os.path.basename(self.header['Image-base file name'])
+        noext = os.path.splitext(f)[0]
+        return noext
 
     @property
-    def shape(self):
-        return Triple(
-            x=int(self.header['X dim']),
-            y=int(self.header['Y dim']),
-            z=int(self.header['Z dim']),
-        )
+    def cur_name(self):
+        f = os.path.basename(self.header['Current file name'])
+        noext = os.path.splitext(f)[0]
+        return noext
 
     @property
     def affine(self):
@@ -120,6 +787,61 @@ class VOIGroup(object):
     def using_default_affine(self):
         return self.__affine is None
 
+    def __index_lists(self):
+        return [cur_voi.voxel_indexes for cur_voi in self.vois]
+
+    def volumes_mm3(self):
+        """
+        The volume of each of our VOIs, as an array.
+        """
+        voxel_counts = np.array(
+            [len(indexes) for indexes in self.__index_lists()])
+        return voxel_counts * float(np.prod(self.voxel_dimensions))
+
+    def centers_of_mass(self):
+        """
+        The centre of mass of each of our VOIs, in voxel coordinates, as an
+        (n, 3) array. Empty VOIs get NaN.
+        """
+        return geometry.centers_of_mass(self.__index_lists(), self.shape)
+
+    def world_centers_of_mass(self):
+        """
+        centers_of_mass(), in world coordinates by our affine.
+        """
+        return geometry.world_coordinates(
+            self.centers_of_mass(), self.affine)
+
+    def bounding_boxes(self, padding=0):
+        """
+        Each of our VOIs' BoundingBox (or None, if it's empty), grown by
+        padding voxels but not past the edges of the grid.
+        """
+        return _bounding_boxes(self.__index_lists(), self.shape, padding)
+
+    def iter_volumes(self, dtype="int16", buffers=2):
+        """
+        Yield (voi, volume) for each of our VOIs, as VOI.to_volume() makes
+        them. The volumes are made in turn in a pool of VolumeBuffers, so
+        memory use doesn't grow with the number of VOIs; but each volume is
+        only good until buffers more have been yielded.
+        Copy any you want to keep.
+        """
+        if buffers < 1:
+            raise ValueError("buffers must be at least 1")
+        pool = []
+        for i, cur_voi in enumerate(self.vois):
+            if len(pool) < buffers:
+                pool.append(VolumeBuffer(self.shape, dtype))
+            yield cur_voi, cur_voi.to_volume(out=pool[i % buffers])
+
+    def boundary_voxel_counts(self):
+        """
+        How many voxels of each of our VOIs touch (by a face) a voxel that
+        isn't in it, as an array.
+        """
+        return geometry.boundary_counts(self.__index_lists(), self.shape)
+
     @property
     def __center_coords(self):
         shape = np.array(self.shape)
@@ -138,73 +860,185 @@ class VOIGroup(object):
 
 
 class VOI(object):
-    def __init__(self, voi_group, header, voxel_indexes):
+    """
+    Like VOIGroup, the header is kept as read, and the fields we use are
+    parsed from it once, when the VOI is made. VOIs read from a file keep
+    the text of their header and of what follows their voxel data
+    (raw_header and raw_trailer).
+    """
+    __slots__ = (
+        'voi_group', 'header', 'voxel_indexes', 'shape', 'voxel_dimensions',
+        'voxel_count', 'voi_number', 'name', 'data_format', 'raw_header',
+        'raw_trailer')
+
+    def __init__(self, voi_group, header, voxel_indexes, attach=True):
+        """
+        Unless attach is False, the new VOI is added to voi_group.vois.
+        """
         super(VOI, self).__init__()
         self.voi_group = voi_group
         self.header = header
         self.voxel_indexes = voxel_indexes
-        self.voi_group.vois.append(self)
+        self.raw_header = None
+        self.raw_trailer = None
+        self.shape = _parse_triple(header, "{0}_dim", "xyz", int)
+        self.voxel_dimensions = _parse_triple(
+            header, "{0}_pixdim", "xyz", float)
+        self.voxel_count = _parse_field(header, 'Number of voxels', int)
+        # The number stays a string, as it's used in file names
+        self.voi_number = _parse_field(header, 'VOI number', str)
+        self.name = header.get('VOI name', '')
+        self.data_format = _parse_field(header, self.BEGIN_DATA, str)
+        if self.data_format not in DATA_FORMATS:
+            raise VOIFileError(
+                "unknown voxel data format {0}".format(self.data_format))
+        if attach:
+            self.voi_group.vois.append(self)
 
     BEGIN_HEADER = "VOI"
     BEGIN_DATA = "Start voxel data"
     END_VOI = "End of VOI"
+    # When writing, we put a blank line before each of these keys.
+    SECTION_KEYS = set(['x_dim', 'VOI volume (cc)'])
+
+    @classmethod
+    def new(kls, voi_group, voxel_indexes, name, color="255, 0, 0"):
+        """
+        Make a VOI in voi_group (appended to voi_group.vois) from an array of
+        voxel indexes, with the header fields Spamalize writes.
+        """
+        voxel_indexes = np.asarray(voxel_indexes, dtype=np.int32)
+        shape = voi_group.shape
+        voxdims = voi_group.voxel_dimensions
+        voxel_cc = np.prod(voxdims) / 1000.0
+        now = _timestamp()
+        header = OrderedDict([
+            ('VOI number', str(len(voi_group.vois) + 1)),
+            ('VOI name', name),
+            ('Filename', voi_group.header.get('Current file name', '')),
+            ('Date written', now),
+            ('Date created', now),
+            ('Date updated any', now),
+            ('Date updated vox', now),
+            ('Date updated vert', ''),
+            ('Creator', 'Unknown'),
+            ('Owner', 'Unknown'),
+            ('x_dim', "{0:8d}".format(shape.x)),
+            ('y_dim', "{0:8d}".format(shape.y)),
+            ('z_dim', "{0:8d}".format(shape.z)),
+            ('x_pixdim', "{0:13.5f}".format(voxdims.x)),
+            ('y_pixdim', "{0:13.5f}".format(voxdims.y)),
+            ('z_pixdim', "{0:13.5f}".format(voxdims.z)),
+            ('color', color),
+            ('VOI volume (cc)', "{0:g}".format(
+                len(voxel_indexes) * voxel_cc)),
+            ('Number of voxels', str(len(voxel_indexes))),
+            ('Voxel volume (cm^3)', "{0:g}".format(voxel_cc)),
+            ('VOI CoM', ", ".join(
+                "{0:g}".format(c) for c in geometry.centers_of_mass(
+                    [voxel_indexes], shape)[0])),
+            ('Start voxel data', LONG_INDEX),
+        ])
+        return kls(voi_group, header, voxel_indexes)
+
+    def to_io(self, io, number, data_format, dtype):
+        """
+        Write our header and voxel data to the binary stream io, as VOI
+        number in its group.
+        """
+        lines = [self.BEGIN_HEADER]
+        for k, v in self.header.items():
+            if k in self.SECTION_KEYS:
+                lines.append(" ")
+            if k == 'VOI number':
+                v = number
+            elif k == 'Number of voxels':
+                v = len(self.voxel_indexes)
+            elif k == self.BEGIN_DATA:
+                v = data_format
+            lines.append("{0} = {1}".format(k, v))
+        _write_lines(io, lines)
+        self._write_data(io, data_format, dtype)
+        _write_lines(io, [
+            " ",
+            "Number of vertecies =            0",
+            "{0} = {1}".format(self.END_VOI, number),
+            " "])
+
+    def _to_io_raw(self, io, data_format, dtype):
+        """
+        Write our header and trailer text as read, around our voxel data in
+        data_format.
+        """
+        _write_raw(io, _replace_field(
+            self.raw_header, self.BEGIN_DATA, data_format))
+        self._write_data(
+            io, data_format, dtype, _line_end(self.raw_header))
+        _write_raw(io, self.raw_trailer)
+
+    def _write_data(self, io, data_format, dtype, line_end=LINE_END):
+        if data_format == LONG_INDEX:
+            io.write(np.asarray(self.voxel_indexes).astype(dtype).tobytes())
+        elif data_format == TEXT_INDEX:
+            _write_lines(
+                io, [str(idx) for idx in self.voxel_indexes.tolist()],
+                line_end)
+        elif data_format == TEXT_TRIPLE:
+            x, y, z = np.unravel_index(
+                self.voxel_indexes, self.shape, order='F')
+            _write_lines(io, [
+                "{0}, {1}, {2}".format(*xyz)
+                for xyz in zip(x.tolist(), y.tolist(), z.tolist())],
+                line_end)
+        else:
+            raise ValueError(
+                "unknown voxel data format {0}".format(data_format))
 
     @classmethod
-    def from_io(kls, voi_group, io):
+    def from_io(kls, voi_group, io, attach=True):
         """
         Read the header and voxel indexes. Assumes io is seek()ed to the start
         of the VOI header (eg, the next bytes we read should be "VOI").
         Transforms text triples into voxel indexes.
         When done, we will be seek()ed to the start of the next VOI, or eof.
         """
-        header = kls._read_header(io)
-        voi = kls(voi_group, header, None)
-        voi._read_data(io)
-        voi._seek_to_next_voi(io)
+        with stats.phase("voi_header", io=io):
+            header, raw_header = kls._read_header(io)
+        voi = kls(voi_group, header, None, attach)
+        voi.raw_header = raw_header
+        with stats.phase("voxel_data", header.get("VOI number"), io):
+            voi._read_data(io)
+            voi.raw_trailer = voi._seek_to_next_voi(io)
         return voi
 
     @classmethod
     def _read_header(kls, io):
+        """
+        Returns the header, and its text.
+        """
         header = OrderedDict()
-        header_start_line = io.readline().strip()
-        if not header_start_line == kls.BEGIN_HEADER:
+        lines = [io.readline()]
+        if not lines[0].strip() == kls.BEGIN_HEADER:
             raise VOIFileError(
                 "voi does not start with {0}".format(kls.BEGIN_HEADER))
+        # Files can have thousands of VOIs; don't format debug messages for
+        # every header line unless someone will see them.
+        debug = logger.isEnabledFor(logging.DEBUG)
         while True:
-            line = io.readline().strip()
-            logger.debug("VOI header read {0}".format(line))
-            parts = [p.strip() for p in line.split("=", 1)]
+            line = io.readline()
+            if not line:
+                raise VOIFileError("file ended in a VOI header")
+            lines.append(line)
+            if debug:
+                logger.debug("VOI header read %s", line.strip())
+            parts = line.split("=", 1)
             if len(parts) == 2:
-                k, v = parts
-                header[k] = v
+                k = parts[0].strip()
+                header[k] = parts[1].strip()
                 if k == kls.BEGIN_DATA:
                     logger.debug("VOI header end, data starts")
                     break
-        return header
-
-    @property
-    def voxel_count(self):
-        return int(self.header['Number of voxels'])
-
-    @property
-    def shape(self):
-        return Triple(
-            x=int(self.header['x_dim']),
-            y=int(self.header['y_dim']),
-            z=int(self.header['z_dim']),
-        )
-
-    @property
-    def voxel_dimensions(self):
-        return Triple(
-            x=float(self.header['x_pixdim']),
-            y=float(self.header['y_pixdim']),
-            z=float(self.header['z_pixdim']),
-        )
-
-    @property
-    def name(self):
-        return self.header['VOI name']
+        return header, "".join(lines)
 
     @property
     def voi_name(self):
@@ -212,28 +1046,68 @@ class VOI(object):
 
     @property
     def base_name(self):
-        f = os.path.basename(self.voi_group.header['Image-base file name'])
-        noext = os.path.splitext(f)[0]
-        return noext
+        return self.voi_group.base_name
 
     @property
     def cur_name(self):
-        f = os.path.basename(self.voi_group.header['Current file name'])
-        noext = os.path.splitext(f)[0]
-        return noext
-
-    @property
-    def voi_number(self):
-        return self.header['VOI number']
+        return self.voi_group.cur_name
 
     @property
     def affine(self):
         return self.voi_group.affine
 
-    def to_volume(self, dtype=np.int16):
-        vol = np.zeros(self.shape, dtype=dtype, order='F')
-        raveled = vol.ravel('A')
-        raveled[self.voxel_indexes] = 1
+    def bounding_box(self, padding=0):
+        """
+        Our BoundingBox, grown by padding voxels; see bounding_box().
+        """
+        return bounding_box(self.voxel_indexes, self.shape, padding)
+
+    def volume_mm3(self):
+        return len(self.voxel_indexes) * float(np.prod(self.voxel_dimensions))
+
+    def center_of_mass(self):
+        """
+        Our mean voxel coordinates, as a 3-element array; NaN if we're empty.
+        """
+        return geometry.centers_of_mass([self.voxel_indexes], self.shape)[0]
+
+    def world_center_of_mass(self):
+        """
+        center_of_mass(), in world coordinates by our affine.
+        """
+        return geometry.world_coordinates(
+            self.center_of_mass()[np.newaxis], self.affine)[0]
+
+    def boundary_voxel_count(self):
+        """
+        How many of our voxels touch (by a face) a voxel that isn't ours.
+        """
+        return int(geometry.boundary_counts(
+            [self.voxel_indexes], self.shape)[0])
+
+    def to_volume(self, dtype="int16", box=None, out=None):
+        """
+        A volume with our voxels set to 1. If box (a BoundingBox) is given,
+        just that part of the volume is made. dtype may be anything numpy
+        can set to 1, like "uint8" or "bool". If out (a VolumeBuffer of the
+        right shape) is given, the volume is made in it, with its dtype, and
+        returned; it's only good until out is used again.
+        """
+        with stats.phase("to_volume", self.voi_number):
+            if box is None:
+                shape = tuple(self.shape)
+                indexes = self.voxel_indexes
+            else:
+                shape = tuple(box.shape)
+                indexes = box.crop_indexes(self.voxel_indexes, self.shape)
+            if out is not None:
+                if not tuple(out.shape) == shape:
+                    raise ValueError(
+                        "out has shape {0}, not {1}".format(out.shape, shape))
+                return out.fill(indexes)
+            vol = np.zeros(shape, dtype=dtype, order='F')
+            raveled = vol.ravel('A')
+            raveled[indexes] = 1
         return vol
 
     def _read_data(self, io):
@@ -246,17 +1120,18 @@ class VOI(object):
         going to be in; find the corresponding function and call it.
         """
         return {
-            "Text coordinate triple": self.__read_data_text_triples,
-            "Text coordinate index": self.__read_data_text_indexes,
-            "LONG coordinate index": self.__read_data_long_indexes,
-        }[self.header["Start voxel data"]]
+            TEXT_TRIPLE: self.__read_data_text_triples,
+            TEXT_INDEX: self.__read_data_text_indexes,
+            LONG_INDEX: self.__read_data_long_indexes,
+        }[self.data_format]
 
     def __read_data_long_indexes(self, io):
         """
-        This data is a bunch of 32-bit ints strung together.
+        This data is a bunch of 32-bit ints strung together. From a
+        MappedFile, we get a view of them without copying.
         """
         logger.debug("Reading long index data")
-        self.voxel_indexes = np.fromfile(
+        self.voxel_indexes = _read_array(
             io,
             self.voi_group.data_type_string,
             self.voxel_count)
@@ -266,13 +1141,9 @@ class VOI(object):
         This is a set of text indexes, one per line
         """
         logger.debug("Reading text index data")
-        self.voxel_indexes = np.zeros(self.voxel_count, dtype=np.int32)
-        for i in range(self.voxel_count):
-            idx = int(io.readline.strip())
-            self.voxel_indexes[i] = idx
-
-    def __triple_to_index(self, x, y, z):
-        return ((z * self.shape.x * self.shape.y) + (y * self.shape.x) + x)
+        self.voxel_indexes = _parse_text_indexes(
+            _read_text_block(io, self.voxel_count),
+            self.voxel_count)
 
     def __read_data_text_triples(self, io):
         """
@@ -282,39 +1153,83 @@ class VOI(object):
         those.
         """
         logger.debug("Reading text triple data")
-
-        def triple_line_to_index(line):
-            x, y, z = [int(num) for num in line.split(",")]
-            return self.__triple_to_index(x, y, z)
-
-        self.voxel_indexes = np.zeros(self.voxel_count, dtype=np.int32)
-        for i in range(self.voxel_count):
-            triple_text = io.readline().strip()
-            idx = triple_line_to_index(triple_text)
-            logger.debug("Triple {0} -> {1}".format(triple_text, idx))
-            self.voxel_indexes[i] = idx
+        self.voxel_indexes = _parse_text_triples(
+            _read_text_block(io, self.voxel_count),
+            self.voxel_count,
+            self.shape)
 
     def _seek_to_next_voi(self, io):
-        """
-        Assumes we're at the end of our voxel data, we'll read lines until we
-        get to END_VOI, and then another couple to leave us at the start of
-        the next VOI header.
-        """
-        while True:
-            line = io.readline()
-            parts = [p.strip() for p in line.split("=")]
-            if len(parts) == 2 and parts[0] == self.END_VOI:
-                break
-        # There are two lines we can ignore here...
-        io.readline()
-        io.readline()
+        return _skip_to_next_voi(io)
 
     def __repr__(self):
         return "VOI #{0}: {1}, {2} voxels".format(
-            self.header["VOI number"],
+            self.voi_number,
             self.name,
             self.voxel_count)
 
 
+def _parse_field(header, key, parse):
+    """
+    Returns parse(header[key]), or raises a VOIFileError if it's missing or
+    malformed.
+    """
+    try:
+        return parse(header[key])
+    except KeyError:
+        raise VOIFileError("header has no {0}".format(key))
+    except ValueError:
+        raise VOIFileError("can't read {0} = {1}".format(key, header[key]))
+
+
+def _parse_triple(header, key_format, axes, parse):
+    return Triple(*[
+        _parse_field(header, key_format.format(axis), parse)
+        for axis in axes])
+
+
+def _read_text_block(io, line_count):
+    """
+    Read line_count lines of voxel data from io, returning them as one
+    string. Leaves io positioned at the start of the following line.
+    """
+    if hasattr(io, 'read_lines'):
+        return io.read_lines(line_count)
+    return "".join([io.readline() for i in range(line_count)])
+
+
+def _parse_text_block(text, value_count):
+    """
+    Convert a block of comma- and/or whitespace-separated integers into a
+    numpy array, checking that we got as many as we expected.
+    """
+    values = np.fromstring(text.replace(",", " "), dtype=np.int64, sep=" ")
+    if not len(values) == value_count:
+        raise VOIFileError(
+            "expected {0} values in voxel data, found {1}".format(
+                value_count, len(values)))
+    return values
+
+
+def _parse_text_indexes(text, voxel_count):
+    """
+    Convert a block of text indexes, one per line, to voxel indexes.
+    """
+    return _parse_text_block(text, voxel_count).astype(np.int32)
+
+
+def _parse_text_triples(text, voxel_count, shape):
+    """
+    Convert a block of "x, y, z" lines to voxel indexes in a volume of
+    the given shape. Indexes are in fortran order, like to_volume() expects.
+    """
+    triples = _parse_text_block(text, voxel_count * 3).reshape(-1, 3)
+    strides = np.array([1, shape.x, shape.x * shape.y], dtype=np.int64)
+    return triples.dot(strides).astype(np.int32)
+
+
 class VOIFileError(ValueError):
     pass
+
+
+class VOIOverlapError(ValueError):
+    pass